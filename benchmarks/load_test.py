@@ -0,0 +1,330 @@
+""" Replays a mix of /submit/ requests against the app at a target rate and reports how it copes.
+
+    The app is started in this process under uvicorn, on a thread with its own event loop, or
+    under a local uvicorn process with --serve subprocess, or an already running server is
+    targeted with --url. Requests are sent open loop: each starts at its scheduled time whether
+    or not earlier ones have completed, and its latency is counted from that time, so a server
+    falling behind shows up as latency rather than as a lower request rate.
+
+    The report gives the throughput, the latency percentiles of successful requests, the rate of
+    errors and of 503 responses, and, when the app runs in this process, the lag of its event
+    loop, sampled every 10 ms. The client shares the process with the app in that mode, so
+    --serve subprocess measures throughput more faithfully.
+
+    The 'standard' scenario is fixed, down to the random sequences, so that runs before and after
+    a change can be compared with --output and --baseline:
+
+        python benchmarks/load_test.py --scenario standard --output before.json
+        python benchmarks/load_test.py --scenario standard --baseline before.json
+
+    A custom mix is a JSON list of entries such as
+        {"ptm": "PHOSPHORYLATION_ST", "organism": "HUMAN", "label": "NO_LABELS",
+         "sequences": 10, "length": 400, "weight": 3, "format": "json"}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+""" The 20 amino acids synthetic proteins are drawn from """
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+""" The interval in seconds between two samples of the event loop lag """
+LAG_INTERVAL = 0.01
+
+
+@dataclass(frozen=True)
+class PayloadMix:
+    """ A kind of /submit/ request and how often it is sent relative to the others """
+    ptm: str
+    organism: str = "HUMAN"
+    label: str = "NO_LABELS"
+    sequences: int = 1
+    length: int = 400
+    weight: float = 1.0
+    format: str = "json"
+
+
+@dataclass(frozen=True)
+class Scenario:
+    rps: float
+    duration: float
+    mix: List[PayloadMix]
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "standard": Scenario(
+        rps=5.0,
+        duration=30.0,
+        mix=[
+            PayloadMix("PHOSPHORYLATION_ST", sequences=1, length=400, weight=5),
+            PayloadMix("PHOSPHORYLATION_ST", sequences=10, length=400, weight=3),
+            PayloadMix("UBIQUITINATION_K", sequences=1, length=2000, weight=1),
+            PayloadMix("N_LINKED_GLYCOSYLATION_N", sequences=50, length=300, weight=1, format="ndjson"),
+        ],
+    ),
+}
+
+
+@dataclass(frozen=True)
+class LoadReport:
+    scenario: str
+    target_rps: float
+    duration: float
+    sent: int
+    succeeded: int
+    rejected: int
+    errors: int
+    dropped: int
+    throughput_rps: float
+    error_rate: float
+    latency_p50_ms: float
+    latency_p90_ms: float
+    latency_p99_ms: float
+    latency_max_ms: float
+    loop_lag_p50_ms: Optional[float]
+    loop_lag_p99_ms: Optional[float]
+    loop_lag_max_ms: Optional[float]
+
+
+def build_requests(mix: List[PayloadMix], count: int, seed: int) -> List[Tuple[str, dict]]:
+    """ Draw the path and body of count requests from the mix, with random sequences """
+    rng = np.random.default_rng(seed)
+    residues = np.frombuffer(AMINO_ACIDS.encode(), dtype=np.uint8)
+    weights = np.array([entry.weight for entry in mix], dtype=float)
+    requests = []
+    for index, choice in enumerate(rng.choice(len(mix), size=count, p=weights / weights.sum())):
+        entry = mix[choice]
+        records = [
+            f">load_{index}_{sequence}\n{rng.choice(residues, size=entry.length).tobytes().decode()}"
+            for sequence in range(entry.sequences)
+        ]
+        body = {"ptm": entry.ptm, "organism": entry.organism, "label": entry.label, "text": "\n".join(records)}
+        requests.append((f"/submit/?format={entry.format}", body))
+    return requests
+
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) * 1000 if samples else 0.0
+
+
+class InProcessServer:
+    """ Runs the app under uvicorn on a thread of this process, whose event loop can be probed """
+
+    def __init__(self, port: int):
+        import uvicorn
+
+        self._server = uvicorn.Server(uvicorn.Config("sitetack.app.main:app", host="127.0.0.1", port=port, log_level="warning"))
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="load-test-server", daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._server.serve())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(30)
+
+    def measure_lag(self, samples: List[float], stop: threading.Event):
+        """ Sample how late the event loop of the app wakes up from a sleep, until stop is set """
+
+        async def probe():
+            while not stop.is_set():
+                start = self.loop.time()
+                await asyncio.sleep(LAG_INTERVAL)
+                samples.append(max(0.0, self.loop.time() - start - LAG_INTERVAL))
+
+        return asyncio.run_coroutine_threadsafe(probe(), self.loop)
+
+
+class SubprocessServer:
+    """ Runs the app under a local uvicorn process """
+
+    def __init__(self, port: int):
+        self._command = [sys.executable, "-m", "uvicorn", "sitetack.app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self):
+        self._process = subprocess.Popen(self._command, env={**os.environ, "TF_CPP_MIN_LOG_LEVEL": "2"})
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait(30)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float):
+    """ Poll /health/ready until the app has warmed up """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health/ready", timeout=5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} was not ready after {timeout:.0f} s")
+
+
+async def send_load(url: str, requests: List[Tuple[str, dict]], rps: float, max_in_flight: int, timeout: float) -> dict:
+    """ Send the requests open loop at rps, counting outcomes and latencies """
+    counts = {"succeeded": 0, "rejected": 0, "errors": 0, "dropped": 0}
+    latencies: List[float] = []
+    in_flight = 0
+
+    async def send(client: httpx.AsyncClient, path: str, body: dict, scheduled: float):
+        nonlocal in_flight
+        try:
+            response = await client.post(path, json=body)
+            await response.aread()
+            if response.status_code == 200:
+                counts["succeeded"] += 1
+                latencies.append(time.perf_counter() - scheduled)
+            elif response.status_code == 503:
+                counts["rejected"] += 1
+            else:
+                counts["errors"] += 1
+        except httpx.HTTPError:
+            counts["errors"] += 1
+        finally:
+            in_flight -= 1
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        tasks = []
+        start = time.perf_counter()
+        for index, (path, body) in enumerate(requests):
+            scheduled = start + index / rps
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            if in_flight >= max_in_flight:
+                # The client would become the bottleneck, so the request is counted and skipped
+                counts["dropped"] += 1
+                continue
+            in_flight += 1
+            tasks.append(asyncio.ensure_future(send(client, path, body, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return {**counts, "latencies": latencies, "elapsed": elapsed}
+
+
+def load_mix(path: Path) -> List[PayloadMix]:
+    return [PayloadMix(**entry) for entry in json.loads(path.read_text())]
+
+
+def compare(report: LoadReport, baseline: LoadReport, threshold: float) -> List[str]:
+    """ Describe how the report is worse than the baseline by more than threshold """
+    regressions = []
+    if report.throughput_rps < baseline.throughput_rps * (1 - threshold):
+        regressions.append(f"throughput {report.throughput_rps:.2f} rps, was {baseline.throughput_rps:.2f}")
+    if baseline.latency_p99_ms and report.latency_p99_ms > baseline.latency_p99_ms * (1 + threshold):
+        regressions.append(f"p99 latency {report.latency_p99_ms:.0f} ms, was {baseline.latency_p99_ms:.0f}")
+    if report.error_rate > baseline.error_rate + threshold / 10:
+        regressions.append(f"error rate {report.error_rate:.1%}, was {baseline.error_rate:.1%}")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=(__doc__ or "").split("\n")[0])
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="standard", help="The fixed scenario to run, unless --mix is given")
+    parser.add_argument("--mix", type=Path, help="A JSON file of the requests to send instead of the scenario's")
+    parser.add_argument("--rps", type=float, help="The requests sent per second, the scenario's by default")
+    parser.add_argument("--duration", type=float, help="How long requests are sent in seconds, the scenario's by default")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the random sequences and request order")
+    parser.add_argument("--serve", choices=["inprocess", "subprocess"], default="inprocess", help="How the app is started when --url is not given")
+    parser.add_argument("--url", help="The address of a running server, such as http://127.0.0.1:8000")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Requests pending at once, beyond which new ones are dropped")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds before a request counts as an error")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds to wait for /health/ready")
+    parser.add_argument("--output", type=Path, help="Save the report to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="A report saved with --output to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="The relative slowdown reported as a regression")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    scenario = SCENARIOS[args.scenario]
+    mix = load_mix(args.mix) if args.mix else scenario.mix
+    rps = args.rps or scenario.rps
+    duration = args.duration or scenario.duration
+    requests = build_requests(mix, max(1, int(rps * duration)), args.seed)
+
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = InProcessServer(port) if args.serve == "inprocess" else SubprocessServer(port)
+        server.start()
+    lag_samples: List[float] = []
+    stop_lag = threading.Event()
+    try:
+        wait_until_ready(url.rstrip("/"), args.ready_timeout)
+        if isinstance(server, InProcessServer):
+            server.measure_lag(lag_samples, stop_lag)
+        result = asyncio.run(send_load(url.rstrip("/"), requests, rps, args.max_in_flight, args.timeout))
+    finally:
+        stop_lag.set()
+        if server is not None:
+            server.stop()
+
+    latencies = result["latencies"]
+    sent = len(requests) - result["dropped"]
+    report = LoadReport(
+        scenario="custom" if args.mix else args.scenario,
+        target_rps=rps,
+        duration=duration,
+        sent=sent,
+        succeeded=result["succeeded"],
+        rejected=result["rejected"],
+        errors=result["errors"],
+        dropped=result["dropped"],
+        throughput_rps=result["succeeded"] / result["elapsed"],
+        error_rate=(result["errors"] + result["rejected"]) / sent if sent else 0.0,
+        latency_p50_ms=percentile_ms(latencies, 50),
+        latency_p90_ms=percentile_ms(latencies, 90),
+        latency_p99_ms=percentile_ms(latencies, 99),
+        latency_max_ms=max(latencies, default=0.0) * 1000,
+        loop_lag_p50_ms=percentile_ms(lag_samples, 50) if lag_samples else None,
+        loop_lag_p99_ms=percentile_ms(lag_samples, 99) if lag_samples else None,
+        loop_lag_max_ms=max(lag_samples) * 1000 if lag_samples else None,
+    )
+
+    for name, value in asdict(report).items():
+        print(f"{name:>16}: {value:.2f}" if isinstance(value, float) else f"{name:>16}: {value}")
+    if args.output:
+        args.output.write_text(json.dumps(asdict(report), indent=2))
+    if args.baseline:
+        regressions = compare(report, LoadReport(**json.loads(args.baseline.read_text())), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regression of more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+""" Measures the throughput, latency and memory of each stage of a prediction, to catch regressions.
+
+    The stages are FASTA parsing and validation, kmer extraction with Sequence.get_kmers, encoding
+    with Predict._tensor_encoding, model loading and inference. They run over synthetic FASTAs of
+    1, 100 and 10k proteins of 400 residues and a single titin-sized protein, and inference also
+    over the kmer test sets of test/MusiteDeep. Each stage and dataset is measured in a fresh
+    process, so that its peak RSS is its own.
+
+    Every result reports sites per second, the p50 and p99 latency of its unit of work (the whole
+    submission for parsing, a sequence for kmer extraction and encoding, a load, or a model call
+    for inference) and the peak RSS. --output saves them as JSON, and --baseline compares them with
+    a saved run, exiting with an error when a stage got slower than --threshold allows.
+
+    Example:
+        python benchmarks/stages.py --output baseline.json
+        python benchmarks/stages.py --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+STAGES = ["parse", "kmers", "encoding", "load", "inference"]
+
+""" The number of proteins of each synthetic dataset, and their length """
+SYNTHETIC_DATASETS: Dict[str, Tuple[int, int]] = {
+    "1": (1, 400),
+    "100": (100, 400),
+    "10k": (10000, 400),
+    "titin": (1, 34350),
+}
+
+""" The kmer test sets of test/MusiteDeep, only used for inference """
+TEST_KMERS = "test_kmers"
+
+""" The dataset name of stages that do not depend on one """
+NO_DATASET = "-"
+
+""" The 20 amino acids synthetic proteins are drawn from """
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+
+
+@dataclass(frozen=True)
+class StageResult:
+    """ The measurements of a stage over a dataset """
+    stage: str
+    dataset: str
+    sites: int
+    samples: int
+    seconds: float
+    sites_per_second: float
+    p50_ms: float
+    p99_ms: float
+    peak_rss_mb: float
+
+
+def synthetic_fasta(sequences: int, length: int) -> str:
+    rng = np.random.default_rng(sequences * 100003 + length)
+    residues = np.frombuffer(AMINO_ACIDS.encode(), dtype=np.uint8)
+    records = []
+    for index in range(sequences):
+        sequence = rng.choice(residues, size=length).tobytes().decode()
+        lines = [sequence[start:start + 60] for start in range(0, length, 60)]
+        records.append(f">synthetic_{index}\n" + "\n".join(lines))
+    return "\n".join(records) + "\n"
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def timed(samples: List[float], function: Callable, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def run_stage(args: argparse.Namespace) -> StageResult:
+    """ Measure one stage over one dataset in this process """
+    from sitetack.app.export import find_test_sets, read_test_kmers
+    from sitetack.app.fasta import Fasta
+    from sitetack.app.kmer import Kmer
+    from sitetack.app.model import Model
+    from sitetack.app.predict import Predict
+    from sitetack.app.registry import ModelRegistry
+    from sitetack.app.sequence import Sequence
+    from sitetack.app.warmup import parse_model_keys
+
+    (key,) = parse_model_keys(args.model, Model.index().keys())
+    alphabet = Model.get_alphabet(*key)
+    amino_acids = key[0].value.amino_acids
+    h5_file = Path(args.h5) if args.h5 else Model.get_h5_file(*key)
+    stage, dataset = args.child_stage, args.child_dataset
+
+    def get_kmers(sequence: Sequence) -> List[Kmer]:
+        return [kmer for amino_acid in amino_acids for kmer in sequence.get_kmers(Predict.KMER_LENGTH, amino_acid)]
+
+    # The inputs of the stage are prepared untimed, by the stages before it. The kmers are only
+    # built for the stages encoding them, so that they do not add to the peak RSS of the others
+    fasta_text = ""
+    sequences: List[Sequence] = []
+    if dataset in SYNTHETIC_DATASETS:
+        fasta_text = synthetic_fasta(*SYNTHETIC_DATASETS[dataset])
+        sequences, errors = Fasta.parse(fasta_text, alphabet)
+        assert not errors, errors
+    kmers = [get_kmers(sequence) for sequence in sequences] if stage in ("encoding", "inference") else []
+    sites = sum(sequence.sequence.count(amino_acid) for sequence in sequences for amino_acid in amino_acids)
+
+    samples: List[float] = []
+    if stage == "parse":
+        def work():
+            timed(samples, Fasta.parse, fasta_text, alphabet)
+    elif stage == "kmers":
+        def work():
+            for sequence in sequences:
+                timed(samples, get_kmers, sequence)
+    elif stage == "encoding":
+        def work():
+            for sequence_kmers in kmers:
+                if sequence_kmers:
+                    timed(samples, Predict._tensor_encoding, sequence_kmers, alphabet)
+    elif stage == "load":
+        loader = ModelRegistry.backend_loader()
+
+        def work():
+            timed(samples, loader, h5_file)
+    else:
+        if dataset == TEST_KMERS:
+            test_sets = find_test_sets(REPOSITORY / "test" / "MusiteDeep")
+            if key not in test_sets:
+                raise SystemExit(f"No test set of {args.model} in test/MusiteDeep")
+            tensor = read_test_kmers(test_sets[key], alphabet)
+        else:
+            tensor = np.concatenate([Predict._tensor_encoding(sequence_kmers, alphabet) for sequence_kmers in kmers if sequence_kmers])
+        sites = len(tensor)
+        model = ModelRegistry.backend_loader()(h5_file)
+        model.predict_on_batch(tensor[:args.batch_size])
+
+        def work():
+            for start in range(0, len(tensor), args.batch_size):
+                timed(samples, model.predict_on_batch, tensor[start:start + args.batch_size])
+
+    # One untimed run, so that the first call does not skew the percentiles
+    work()
+    samples.clear()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        work()
+    seconds = time.perf_counter() - start
+    return StageResult(
+        stage=stage,
+        dataset=dataset,
+        sites=sites,
+        samples=len(samples),
+        seconds=seconds,
+        sites_per_second=sites * args.repeat / seconds if stage != "load" else 0.0,
+        p50_ms=float(np.percentile(samples, 50)) * 1000 if samples else 0.0,
+        p99_ms=float(np.percentile(samples, 99)) * 1000 if samples else 0.0,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def datasets_of(stage: str, datasets: List[str]) -> List[str]:
+    if stage == "load":
+        return [NO_DATASET]
+    if stage == "inference":
+        return datasets
+    return [dataset for dataset in datasets if dataset != TEST_KMERS]
+
+
+def measure(args: argparse.Namespace, stage: str, dataset: str) -> Optional[StageResult]:
+    """ Measure a stage over a dataset in a fresh process """
+    command = [
+        sys.executable, __file__, "--child-stage", stage, "--child-dataset", dataset, "--model", args.model,
+        "--repeat", str(args.repeat), "--batch-size", str(args.batch_size),
+    ] + (["--h5", args.h5] if args.h5 else [])
+    env = {**os.environ, "TF_CPP_MIN_LOG_LEVEL": "2"}
+    completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if completed.returncode != 0:
+        print(f"{stage} {dataset} failed:\n{completed.stderr}", file=sys.stderr)
+        return None
+    return StageResult(**json.loads(completed.stdout.strip().splitlines()[-1]))
+
+
+def compare(results: List[StageResult], baseline: List[StageResult], threshold: float) -> List[str]:
+    """ Describe the stages whose throughput fell or whose p99 latency rose by more than threshold """
+    previous = {(result.stage, result.dataset): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result.stage, result.dataset))
+        if old is None:
+            continue
+        if old.sites_per_second and result.sites_per_second < old.sites_per_second * (1 - threshold):
+            regressions.append(
+                f"{result.stage} {result.dataset}: {result.sites_per_second:.0f} sites/s, was {old.sites_per_second:.0f}"
+            )
+        if old.p99_ms and result.p99_ms > old.p99_ms * (1 + threshold):
+            regressions.append(f"{result.stage} {result.dataset}: p99 {result.p99_ms:.2f} ms, was {old.p99_ms:.2f} ms")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=(__doc__ or "").split("\n")[0])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="The stages to measure, all by default")
+    parser.add_argument(
+        "--datasets", nargs="+", choices=list(SYNTHETIC_DATASETS) + [TEST_KMERS],
+        default=list(SYNTHETIC_DATASETS) + [TEST_KMERS], help="The datasets to measure the stages over, all by default",
+    )
+    parser.add_argument("--model", default="PHOSPHORYLATION_ST:HUMAN:NO_LABELS", help="The model, as PTM:ORGANISM:LABEL")
+    parser.add_argument("--h5", help="An h5 file to load and run instead of the file of --model")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs of each stage")
+    parser.add_argument("--batch-size", type=int, default=1024, help="The number of kmers per model call")
+    parser.add_argument("--output", type=Path, help="Save the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="A JSON file saved with --output to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="The relative slowdown reported as a regression")
+    parser.add_argument("--child-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--child-dataset", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.child_stage:
+        print(json.dumps(asdict(run_stage(args))))
+        return 0
+
+    results = []
+    failed = False
+    print(f"{'stage':>10} {'dataset':>10} {'sites':>9} {'sites/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>8}")
+    for stage in args.stages:
+        for dataset in datasets_of(stage, args.datasets):
+            result = measure(args, stage, dataset)
+            if result is None:
+                failed = True
+                continue
+            results.append(result)
+            print(
+                f"{stage:>10} {dataset:>10} {result.sites:>9} {result.sites_per_second:>12.0f} "
+                f"{result.p50_ms:>9.3f} {result.p99_ms:>9.3f} {result.peak_rss_mb:>8.0f}"
+            )
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "model": args.model,
+            "backend": os.environ.get("SITETACK_INFERENCE_BACKEND", "keras"),
+            "batch_size": args.batch_size,
+            "results": [asdict(result) for result in results],
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = [StageResult(**result) for result in json.loads(args.baseline.read_text())["results"]]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No stage regressed by more than {args.threshold:.0%}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
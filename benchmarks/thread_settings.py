@@ -0,0 +1,124 @@
+""" Measures the inference throughput of a model under different thread and CPU settings.
+
+    TensorFlow sizes its thread pools once per process, so each combination of settings is run in
+    a fresh process configured through the SITETACK_* environment variables, exactly as a
+    deployment would be. Each process loads the model, warms it up, then runs full batches from
+    as many threads as there are inference slots for a fixed time.
+
+    Example:
+        python benchmarks/thread_settings.py --intra 0 1 2 4 --inter 0 1 --slots 1 2 4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+
+def run_child(args: argparse.Namespace):
+    """ Measure one combination of settings, configured by the environment, and print it as JSON """
+    from sitetack.app.model import Model
+    from sitetack.app.registry import ModelRegistry
+    from sitetack.app.warmup import parse_model_keys
+
+    (key,) = parse_model_keys(args.model, Model.index().keys())
+    h5_file = Path(args.h5) if args.h5 else Model.get_h5_file(*key)
+    alphabet = Model.get_alphabet(*key)
+    model = ModelRegistry.local().get_file(h5_file)
+
+    rng = np.random.default_rng(0)
+    residues = np.frombuffer(alphabet.str.replace("-", "").encode(), dtype=np.uint8)
+    sequences = ["".join(map(chr, rng.choice(residues, size=53))) for _ in range(args.batch_size)]
+    tensor = np.stack([alphabet.encode(sequence) for sequence in sequences])
+    for _ in range(3):
+        model.predict_on_batch(tensor)
+
+    stop = threading.Event()
+    counts = [0] * args.child_slots
+
+    def score(slot: int):
+        while not stop.is_set():
+            model.predict_on_batch(tensor)
+            counts[slot] += len(tensor)
+
+    threads = [threading.Thread(target=score, args=(slot,), daemon=True) for slot in range(args.child_slots)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"kmers": sum(counts), "seconds": elapsed, "kmers_per_second": sum(counts) / elapsed}))
+
+
+def measure(args: argparse.Namespace, intra: int, inter: int, slots: int, affinity: str) -> Optional[dict]:
+    env = {
+        **os.environ,
+        "SITETACK_TF_INTRA_OP_THREADS": str(intra),
+        "SITETACK_TF_INTER_OP_THREADS": str(inter),
+        "SITETACK_CPU_AFFINITY": affinity,
+        "SITETACK_INFERENCE_BACKEND": args.backend,
+        "TF_CPP_MIN_LOG_LEVEL": "2",
+    }
+    command = [
+        sys.executable, __file__, "--child", "--child-slots", str(slots), "--model", args.model,
+        "--batch-size", str(args.batch_size), "--seconds", str(args.seconds),
+    ] + (["--h5", args.h5] if args.h5 else [])
+    completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if completed.returncode != 0:
+        print(completed.stderr, file=sys.stderr)
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=(__doc__ or "").split("\n")[0])
+    parser.add_argument("--model", default="PHOSPHORYLATION_ST:HUMAN:NO_LABELS", help="The model to run, as PTM:ORGANISM:LABEL")
+    parser.add_argument("--h5", help="An h5 file to run instead of the file of --model, encoded with the alphabet of --model")
+    parser.add_argument("--backend", default="keras", help="The inference backend, see SITETACK_INFERENCE_BACKEND")
+    parser.add_argument("--intra", type=int, nargs="+", default=[0], help="Values of SITETACK_TF_INTRA_OP_THREADS, 0 for the TensorFlow default")
+    parser.add_argument("--inter", type=int, nargs="+", default=[0], help="Values of SITETACK_TF_INTER_OP_THREADS, 0 for the TensorFlow default")
+    parser.add_argument("--slots", type=int, nargs="+", default=[1], help="Numbers of threads scoring at once, like SITETACK_INFERENCE_WORKERS")
+    parser.add_argument("--affinity", nargs="+", default=[""], help="Values of SITETACK_CPU_AFFINITY, such as 0-3, '' for every CPU")
+    parser.add_argument("--batch-size", type=int, default=1024, help="The number of kmers per model call")
+    parser.add_argument("--seconds", type=float, default=5.0, help="How long each combination is measured")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--child-slots", type=int, default=1, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.child:
+        run_child(args)
+        return 0
+
+    print(f"{'intra':>5} {'inter':>5} {'slots':>5} {'affinity':>10} {'kmers/s':>10} {'relative':>8}")
+    baseline = None
+    failed = False
+    for intra, inter, slots, affinity in itertools.product(args.intra, args.inter, args.slots, args.affinity):
+        result = measure(args, intra, inter, slots, affinity)
+        if result is None:
+            failed = True
+            print(f"{intra:>5} {inter:>5} {slots:>5} {affinity or 'all':>10} {'failed':>10}")
+            continue
+        baseline = baseline or result["kmers_per_second"]
+        print(
+            f"{intra:>5} {inter:>5} {slots:>5} {affinity or 'all':>10} "
+            f"{result['kmers_per_second']:>10.0f} {result['kmers_per_second'] / baseline:>8.2f}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,7 @@
+import builtins
 from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
 
 
 @dataclass(frozen=True)
@@ -11,6 +14,9 @@ class Alphabet:
 
     str: str
 
+    """ The index given to characters that are not in the alphabet """
+    INVALID_INDEX = 255
+
     def __post_init__(self):
         # check that all characters are unique
         if len(self.str) != len(set(self.str)):
@@ -23,3 +29,38 @@ class Alphabet:
     def __iter__(self):
         """ Make the alphabet iterable by returning an iterator over the string """
         return iter(self.str)
+
+    def intersection(self, other: "Alphabet") -> "Alphabet":
+        """ Return the alphabet of the characters that are in both alphabets, in the order of this one """
+        return Alphabet(str="".join(char for char in self.str if char in other.str))
+
+    def lookup_table(self) -> np.ndarray:
+        """ Return a table mapping every byte to the index of its character in the alphabet,
+            or to INVALID_INDEX if the character is not in the alphabet
+        """
+        return _lookup_table(self.str)
+
+    # builtins.str, as the str field shadows the builtin in the class body
+    def encode(self, text: builtins.str) -> np.ndarray:
+        """ Translate a text into an array of alphabet indices, with INVALID_INDEX for characters
+            that are not in the alphabet
+
+            Parameters:
+                text: The text to translate, such as 'MTEITAA'
+        """
+        text_bytes = np.frombuffer(text.encode("ascii", errors="replace"), dtype=np.uint8)
+        return self.lookup_table()[text_bytes]
+
+
+@lru_cache(maxsize=None)
+def _lookup_table(alphabet: str) -> np.ndarray:
+    """ Build the byte lookup table of an alphabet, shared by all equal alphabets """
+    if len(alphabet) >= Alphabet.INVALID_INDEX:
+        raise ValueError(f"Alphabet must have fewer than {Alphabet.INVALID_INDEX} characters")
+    table = np.full(256, Alphabet.INVALID_INDEX, dtype=np.uint8)
+    for index, char in enumerate(alphabet):
+        if ord(char) > 127:
+            raise ValueError(f"Alphabet must only contain ASCII characters, got {char!r}")
+        table[ord(char)] = index
+    table.setflags(write=False)
+    return table
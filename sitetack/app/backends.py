@@ -0,0 +1,190 @@
+""" Inference backends running models exported from their h5 files, see sitetack.app.export,
+    or read from them by the NumPy engine of sitetack.app.numpy_backend
+"""
+
+import functools
+import json
+import logging
+import threading
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+import numpy as np
+
+from sitetack.app.cache import file_sha256
+from sitetack.app.runtime import apply_cpu_affinity, import_tensorflow
+from sitetack.app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[Path], Any]
+
+""" The number of kmers per call when predict splits a tensor into batches """
+PREDICT_BATCH_SIZE = 1024
+
+
+class InferenceBackend(Enum):
+    """ The formats models can be run from """
+    KERAS = "keras"
+    SAVED_MODEL = "saved_model"
+    TFLITE = "tflite"
+    NUMPY = "numpy"
+
+    @property
+    def suffix(self) -> str:
+        """ The suffix of the exported model, a directory for SavedModel and a file for TFLite """
+        return {
+            InferenceBackend.KERAS: ".h5",
+            InferenceBackend.NUMPY: ".h5",
+            InferenceBackend.SAVED_MODEL: ".savedmodel",
+            InferenceBackend.TFLITE: ".tflite",
+        }[self]
+
+
+def exported_path(h5_file: Path, backend: InferenceBackend, export_dir: Path, model_directory: Path) -> Optional[Path]:
+    """ The path a model is exported to, mirroring its place in the models directory,
+        or None for h5 files outside of it
+    """
+    try:
+        relative = Path(h5_file).resolve().relative_to(Path(model_directory).resolve())
+    except ValueError:
+        return None
+    return Path(export_dir) / relative.with_suffix(backend.suffix)
+
+
+def metadata_path(path: Path) -> Path:
+    """ The JSON file recording which h5 file an exported model was built from """
+    return path.with_name(f"{path.name}.json")
+
+
+def write_metadata(path: Path, h5_file: Path, quantized: bool = False):
+    metadata_path(path).write_text(json.dumps({"h5_sha256": file_sha256(h5_file), "quantized": quantized}))
+
+
+def read_metadata(path: Path) -> dict:
+    """ The metadata of an exported model, empty when it is missing or unreadable """
+    try:
+        return json.loads(metadata_path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def is_up_to_date(path: Path, h5_file: Path) -> bool:
+    """ Whether a model was exported from the current content of its h5 file """
+    return path.exists() and read_metadata(path).get("h5_sha256") == file_sha256(h5_file)
+
+
+def loaded_backend(model: Any) -> Tuple[InferenceBackend, bool]:
+    """ The backend that actually loaded a model and whether its weights are quantized, read from its
+        inference_backend and quantized attributes. Models without them, such as the Keras models
+        the loaders fall back to, run on Keras.
+    """
+    return getattr(model, "inference_backend", InferenceBackend.KERAS), bool(getattr(model, "quantized", False))
+
+
+def predict_in_batches(predict_on_batch: Callable[[np.ndarray], np.ndarray], tensor: np.ndarray) -> np.ndarray:
+    """ Same as predict of a Keras model, splitting the tensor into batches of PREDICT_BATCH_SIZE """
+    if len(tensor) <= PREDICT_BATCH_SIZE:
+        return predict_on_batch(tensor)
+    return np.concatenate([
+        predict_on_batch(tensor[start:start + PREDICT_BATCH_SIZE]) for start in range(0, len(tensor), PREDICT_BATCH_SIZE)
+    ])
+
+
+class SavedModelPredictor:
+    """ Runs the serving signature of an exported SavedModel, a single traced graph without the
+        per-call overhead of Keras
+    """
+
+    inference_backend = InferenceBackend.SAVED_MODEL
+    quantized = False
+
+    def __init__(self, path: Path):
+        tf = import_tensorflow()
+        self._tf = tf
+        # The loaded object owns the variables of the signature, so it is kept alive with it
+        self._loaded = tf.saved_model.load(str(path))
+        self._signature = self._loaded.signatures["serving_default"]
+        (self._input_name, input_spec), = self._signature.structured_input_signature[1].items()
+        self._dtype = input_spec.dtype.as_numpy_dtype
+
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        outputs = self._signature(**{self._input_name: self._tf.constant(tensor.astype(self._dtype))})
+        return next(iter(outputs.values())).numpy()
+
+    def predict(self, tensor: np.ndarray) -> np.ndarray:
+        return predict_in_batches(self.predict_on_batch, tensor)
+
+
+class TFLitePredictor:
+    """ Runs an exported TFLite model, resizing its input to the size of each batch. The
+        interpreter is not thread safe, so calls are serialized.
+    """
+
+    inference_backend = InferenceBackend.TFLITE
+
+    def __init__(self, path: Path):
+        tf = import_tensorflow()
+        self.quantized = bool(read_metadata(path).get("quantized", False))
+        # TFLite has a single thread pool, sized like the intra-op pool of TensorFlow
+        self._interpreter = tf.lite.Interpreter(model_path=str(path), num_threads=get_settings().tf_intra_op_threads or None)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._shape = tuple(self._input["shape"])
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        with self._lock:
+            if tuple(tensor.shape) != self._shape:
+                self._interpreter.resize_tensor_input(self._input["index"], list(tensor.shape))
+                self._interpreter.allocate_tensors()
+                self._shape = tuple(tensor.shape)
+            self._interpreter.set_tensor(self._input["index"], tensor.astype(self._input["dtype"]))
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output["index"]).copy()
+
+    def predict(self, tensor: np.ndarray) -> np.ndarray:
+        return predict_in_batches(self.predict_on_batch, tensor)
+
+
+def load_numpy_model(h5_file: Path, fallback: Loader) -> Any:
+    """ Read a model from its h5 file for the NumPy engine, or load it with Keras if it uses
+        layers the engine does not implement
+    """
+    from sitetack.app.numpy_backend import NumpyModel, UnsupportedModel
+
+    apply_cpu_affinity()
+    try:
+        return NumpyModel.from_h5(h5_file)
+    except UnsupportedModel as e:
+        logger.warning("%s, loading %s with Keras", e, h5_file)
+        return fallback(h5_file)
+
+
+def make_loader(backend: InferenceBackend, export_dir: Path, model_directory: Path, fallback: Loader) -> Loader:
+    """ Get a loader of the registry running the models with a backend.
+
+        Parameters:
+            backend: The backend to run the models with
+            export_dir: The directory the models were exported to
+            model_directory: The directory of the h5 files
+            fallback: Loads an h5 file with Keras, used for the Keras backend, for the models
+                      that were not exported or whose h5 file changed since, and for the models
+                      the NumPy engine does not support
+    """
+    if backend == InferenceBackend.KERAS:
+        return fallback
+    if backend == InferenceBackend.NUMPY:
+        return functools.partial(load_numpy_model, fallback=fallback)
+    predictor_class = SavedModelPredictor if backend == InferenceBackend.SAVED_MODEL else TFLitePredictor
+
+    def load(h5_file: Path) -> Any:
+        path = exported_path(h5_file, backend, export_dir, model_directory)
+        if path is None or not is_up_to_date(path, h5_file):
+            logger.warning("No up to date %s export of %s, loading it with Keras", backend.value, h5_file)
+            return fallback(h5_file)
+        return predictor_class(path)
+
+    return load
@@ -0,0 +1,196 @@
+""" Coalesces the small batches of concurrent requests for the same model into one model call """
+
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+from sitetack.app.backends import InferenceBackend, loaded_backend
+from sitetack.app.settings import get_settings
+
+Loader = Callable[[Path], Any]
+
+
+@dataclass(frozen=True)
+class BatchingStats:
+    """ Counters of the micro-batching, over every model """
+    requests: int
+    batches: int
+    kmers: int
+    bypassed: int
+
+    @property
+    def requests_per_batch(self) -> float:
+        """ The mean number of requests scored by a coalesced model call """
+        return self.requests / self.batches if self.batches else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "kmers": self.kmers,
+            "bypassed": self.bypassed,
+            "requests_per_batch": self.requests_per_batch,
+        }
+
+
+class _Request:
+    """ The kmers of one caller, waiting to be scored in a batch """
+
+    def __init__(self, tensor: np.ndarray):
+        self.tensor = tensor
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class BatchedModel:
+    """ Stands in for a model, coalescing the predict_on_batch calls of concurrent threads.
+
+        The first caller to arrive while no batch is being gathered leads the next batch. It runs
+        at once if the model is idle; otherwise it waits for the running batch to finish, for
+        max_batch kmers to be queued or for max_wait seconds, whichever comes first, then runs
+        every queued request as one call. Callers arriving in the meantime wait for their share
+        of the results. A lone request is therefore never delayed, and under load a request
+        waits at most max_wait before its batch starts.
+    """
+
+    def __init__(self, model: Any, batcher: "MicroBatcher"):
+        self.model = model
+        self._batcher = batcher
+        self._condition = threading.Condition()
+        self._queue: List[_Request] = []
+        self._queued_kmers = 0
+        self._gathering = False
+        self._running = 0
+
+    @property
+    def inference_backend(self) -> InferenceBackend:
+        """ The backend that loaded the wrapped model """
+        return loaded_backend(self.model)[0]
+
+    @property
+    def quantized(self) -> bool:
+        """ Whether the wrapped model has quantized weights """
+        return loaded_backend(self.model)[1]
+
+    def predict(self, tensor: np.ndarray) -> np.ndarray:
+        """ Same as model.predict, which batches the kmers itself, so it is not coalesced """
+        self._batcher._record(requests=0, batches=0, kmers=0, bypassed=1)
+        return self.model.predict(tensor)
+
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        if len(tensor) >= self._batcher.max_batch:
+            self._batcher._record(requests=0, batches=0, kmers=0, bypassed=1)
+            return self.model.predict_on_batch(tensor)
+
+        request = _Request(tensor)
+        with self._condition:
+            self._queue.append(request)
+            self._queued_kmers += len(tensor)
+            leader = not self._gathering
+            self._gathering = True
+            self._condition.notify_all()
+        if leader:
+            self._lead()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        assert request.result is not None, "a request is done once it has a result or an error"
+        return request.result
+
+    def _lead(self):
+        deadline = time.monotonic() + self._batcher.max_wait
+        with self._condition:
+            while self._running and self._queued_kmers < self._batcher.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            requests, self._queue = self._queue, []
+            self._queued_kmers = 0
+            # Callers arriving from now on gather the next batch, which can run alongside this one
+            self._gathering = False
+            self._running += 1
+        kmers = sum(len(request.tensor) for request in requests)
+        try:
+            probabilities = np.asarray(self.model.predict_on_batch(np.concatenate([request.tensor for request in requests])))
+            offset = 0
+            for request in requests:
+                request.result = probabilities[offset:offset + len(request.tensor)]
+                offset += len(request.tensor)
+        except BaseException as e:
+            for request in requests:
+                request.error = e
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+            for request in requests:
+                request.done.set()
+        self._batcher._record(requests=len(requests), batches=1, kmers=kmers, bypassed=0)
+
+
+class MicroBatcher:
+    """ Wraps the models of a registry in BatchedModels sharing the same limits and counters """
+
+    _shared: Optional["MicroBatcher"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_batch: int, max_wait: float):
+        """
+        Parameters:
+            max_batch: The number of kmers after which a batch runs without waiting any longer.
+                       Calls with at least as many kmers run on their own.
+            max_wait: The maximum number of seconds a batch waits for the running one to finish,
+                      0 to disable micro-batching
+        """
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be positive, got {max_batch}")
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._kmers = 0
+        self._bypassed = 0
+
+    @classmethod
+    def shared(cls) -> "MicroBatcher":
+        """ Get the batcher shared by the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                settings = get_settings()
+                cls._shared = cls(max_batch=settings.batch_size, max_wait=settings.batch_max_wait_ms / 1000)
+            return cls._shared
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_wait > 0
+
+    def wrap(self, loader: Loader) -> Loader:
+        """ Get a loader returning BatchedModels around the models of a loader, or the loader
+            itself when micro-batching is disabled
+        """
+        if not self.enabled:
+            return loader
+        return lambda h5_file: BatchedModel(loader(h5_file), self)
+
+    def _record(self, requests: int, batches: int, kmers: int, bypassed: int):
+        with self._lock:
+            self._requests += requests
+            self._batches += batches
+            self._kmers += kmers
+            self._bypassed += bypassed
+
+    def stats(self) -> BatchingStats:
+        with self._lock:
+            return BatchingStats(
+                requests=self._requests,
+                batches=self._batches,
+                kmers=self._kmers,
+                bypassed=self._bypassed,
+            )
@@ -0,0 +1,361 @@
+""" Content-addressed cache of the predictions of a sequence by a model """
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: Path) -> str:
+    """ Hash the content of a file, reading it in chunks """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """ Counters of a prediction cache, in sequences """
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    memory_entries: int
+    memory_bytes: int
+    disk_bytes: int
+
+    @property
+    def hit_ratio(self) -> float:
+        """ The fraction of lookups answered from either tier """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "memory_entries": self.memory_entries,
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+        }
+
+
+class SqlitePredictionStore:
+    """ The on-disk tier of the prediction cache, a SQLite file evicting the least recently used
+        entries once its values exceed max_bytes.
+    """
+
+    """ Eviction removes entries until the values take at most this fraction of max_bytes """
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, path: Path, max_bytes: int):
+        """
+        Parameters:
+            path: The SQLite file, created if missing
+            max_bytes: The maximum total size of the cached values
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (key BLOB PRIMARY KEY, value BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        # The total size is kept in the database by triggers, so that every process sharing the
+        # file evicts against the writes of all of them
+        with self._transaction():
+            self._connection.execute("CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO size (id, bytes) SELECT 0, COALESCE(SUM(LENGTH(value)), 0) FROM predictions"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS predictions_insert AFTER INSERT ON predictions "
+                "BEGIN UPDATE size SET bytes = bytes + LENGTH(NEW.value) WHERE id = 0; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS predictions_delete AFTER DELETE ON predictions "
+                "BEGIN UPDATE size SET bytes = bytes - LENGTH(OLD.value) WHERE id = 0; END"
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """ Run a block as one write transaction, taking the write lock of the file at its start """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _size_bytes(self) -> int:
+        return self._connection.execute("SELECT bytes FROM size WHERE id = 0").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        """ The total size of the cached values, written by every process sharing the file """
+        with self._lock:
+            return self._size_bytes()
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: bytes, value: bytes):
+        with self._lock, self._transaction():
+            # Entries are content addressed, so an existing key already holds the same value
+            self._connection.execute(
+                "INSERT OR IGNORE INTO predictions (key, value, accessed) VALUES (?, ?, ?)", (key, value, time.time())
+            )
+            size = self._size_bytes()
+            if size > self.max_bytes:
+                self._evict(size)
+
+    def _evict(self, size: int):
+        target = self.max_bytes * self.EVICTION_TARGET
+        while size > target:
+            rows = self._connection.execute(
+                "SELECT key, LENGTH(value) FROM predictions ORDER BY accessed LIMIT 256"
+            ).fetchall()
+            if not rows:
+                return
+            evicted = []
+            for key, value_size in rows:
+                if size <= target:
+                    break
+                evicted.append((key,))
+                size -= value_size
+            self._connection.executemany("DELETE FROM predictions WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ModelPredictionCache:
+    """ The view of a prediction cache for one model, mapping sequences to their site probabilities """
+
+    def __init__(self, cache: "PredictionCache", model_identity: str):
+        """
+        Parameters:
+            cache: The cache holding the predictions of every model
+            model_identity: Identifies the model, see PredictionCache.model_identity
+        """
+        self._cache = cache
+        self._prefix = model_identity.encode()
+
+    def key(self, sequence: str) -> bytes:
+        return hashlib.sha256(self._prefix + b"\0" + sequence.encode()).digest()
+
+    def get(self, sequence: str) -> Optional[np.ndarray]:
+        """ The float32 probabilities of the sites of a sequence, in the order of KmerEncoder.find_sites,
+            as a read-only view of the cached value, or None
+        """
+        value = self._cache.get(self.key(sequence))
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32)
+
+    def put(self, sequence: str, probabilities: Union[np.ndarray, List[float]]):
+        self._cache.put(self.key(sequence), np.asarray(probabilities, dtype=np.float32).tobytes())
+
+
+class PredictionCache:
+    """ Caches the predictions of sequences by models, keyed by the hash of the sequence and the
+        identity of the model, which includes the content hash of its h5 file so that updating a
+        model invalidates its entries.
+
+        Lookups go to an in-memory LRU tier, then to an optional SQLite tier shared by the processes
+        of a deployment and kept across restarts.
+    """
+
+    """ The bytes charged to each memory entry besides its key and value, roughly the Python objects
+        and the OrderedDict node holding them, so that empty predictions count against max_bytes too
+    """
+    ENTRY_OVERHEAD = 128
+
+    _shared: Optional["PredictionCache"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int, directory: Optional[Path] = None, max_disk_bytes: int = 0):
+        """
+        Parameters:
+            max_bytes: The maximum total size of the entries kept in memory, counting their keys and
+                       ENTRY_OVERHEAD, 0 to disable the memory tier
+            directory: The directory of the SQLite tier, None to disable it
+            max_disk_bytes: The maximum total size of the probabilities kept on disk
+        """
+        self.max_bytes = max_bytes
+        self._disk = SqlitePredictionStore(Path(directory) / "predictions.sqlite", max_disk_bytes) if directory else None
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    @classmethod
+    def shared(cls) -> "PredictionCache":
+        """ Get the prediction cache shared by the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                settings = get_settings()
+                cls._shared = cls(
+                    max_bytes=settings.prediction_cache_bytes,
+                    directory=Path(settings.prediction_cache_dir) if settings.prediction_cache_dir else None,
+                    max_disk_bytes=settings.prediction_cache_disk_bytes,
+                )
+            return cls._shared
+
+    @classmethod
+    def shutdown_shared(cls):
+        """ Close the shared prediction cache, a new one is created on the next call to shared() """
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.close()
+                cls._shared = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self._disk is not None
+
+    def model_identity(
+        self,
+        h5_file: Path,
+        alphabet: Alphabet,
+        amino_acids: List[str],
+        kmer_length: int,
+        backend: str = "keras",
+        quantized: bool = False,
+    ) -> str:
+        """ Identify a model by its h5 file path and content, the inference backend that loaded it and
+            whether its weights are quantized, and the way its input is encoded.
+            The content hash is computed once per modification of the file.
+        """
+        h5_file = Path(h5_file).resolve()
+        stat = h5_file.stat()
+        file_key = (str(h5_file), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            content_hash = self._file_hashes.get(file_key)
+        if content_hash is None:
+            content_hash = file_sha256(h5_file)
+            with self._lock:
+                self._file_hashes[file_key] = content_hash
+        parts = [str(h5_file), content_hash, backend, str(quantized), alphabet.str, "".join(amino_acids), str(kmer_length)]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def for_model(
+        self,
+        h5_file: Path,
+        alphabet: Alphabet,
+        amino_acids: List[str],
+        kmer_length: int,
+        backend: str = "keras",
+        quantized: bool = False,
+    ) -> Optional[ModelPredictionCache]:
+        """ Get the view of the cache for a model, or None if the cache is disabled.
+
+            Parameters:
+                h5_file: The h5 file of the model
+                alphabet: The alphabet its kmers are encoded with
+                amino_acids: The amino acids of its sites
+                kmer_length: The length of its kmers
+                backend: The value of the InferenceBackend that loaded it, see backends.loaded_backend
+                quantized: Whether the loaded model has quantized weights
+        """
+        if not self.enabled:
+            return None
+        identity = self.model_identity(h5_file, alphabet, amino_acids, kmer_length, backend, quantized)
+        return ModelPredictionCache(self, identity)
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return value
+        value = None
+        if self._disk is not None:
+            try:
+                value = self._disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Could not read from the prediction cache: %s", e)
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+        self._put_memory(key, value)
+        return value
+
+    def put(self, key: bytes, value: bytes):
+        self._put_memory(key, value)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, value)
+            except sqlite3.Error as e:
+                logger.warning("Could not write to the prediction cache: %s", e)
+
+    def _entry_bytes(self, key: bytes, value: bytes) -> int:
+        return len(key) + len(value) + self.ENTRY_OVERHEAD
+
+    def _put_memory(self, key: bytes, value: bytes):
+        if self.max_bytes <= 0 or self._entry_bytes(key, value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= self._entry_bytes(key, previous)
+            self._memory[key] = value
+            self._memory_bytes += self._entry_bytes(key, value)
+            while self._memory_bytes > self.max_bytes:
+                evicted_key, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= self._entry_bytes(evicted_key, evicted)
+
+    def stats(self) -> CacheStats:
+        disk_bytes = 0
+        if self._disk is not None:
+            try:
+                disk_bytes = self._disk.size_bytes
+            except sqlite3.Error as e:
+                logger.warning("Could not read the size of the prediction cache: %s", e)
+        with self._lock:
+            return CacheStats(
+                memory_hits=self._memory_hits,
+                disk_hits=self._disk_hits,
+                misses=self._misses,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_bytes=disk_bytes,
+            )
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
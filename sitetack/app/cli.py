@@ -0,0 +1,463 @@
+""" Command line entry point for scoring FASTA files offline, without going through the web app """
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field, replace
+from enum import Enum
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.fasta import Fasta
+from sitetack.app.formats import CSV_HEADER, arrow_schema, to_arrow, to_csv_rows, to_ndjson_line
+from sitetack.app.predict import Predict, SequencePrediction
+from sitetack.app.sequence import Sequence
+from sitetack.app.settings import get_settings
+
+PredictFunction = Callable[[Iterable[Sequence], PtmKind, OrganismKind, LabelKind, int], Iterator[SequencePrediction]]
+
+""" The extensions of the files picked up when a directory is given as input """
+FASTA_SUFFIXES = (".fasta", ".fa", ".faa", ".fas")
+
+""" The input name that reads standard input """
+STDIN = "-"
+
+
+class CliError(Exception):
+    """ Raised for problems reported to the user without a traceback """
+
+
+class OutputFormat(Enum):
+    """ The formats the command line can write """
+    CSV = "csv"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
+
+    @staticmethod
+    def from_path(path: Path) -> "OutputFormat":
+        """ Guess the format from the extension of the output path, CSV by default """
+        suffix = path.suffix.lower()
+        if suffix in (".ndjson", ".jsonl"):
+            return OutputFormat.NDJSON
+        if suffix == ".parquet":
+            return OutputFormat.PARQUET
+        return OutputFormat.CSV
+
+
+def find_fasta_files(paths: Iterable[str]) -> List[str]:
+    """ Expand the directories among the given paths into the FASTA files they contain, recursively and sorted.
+        Files, including gzipped ones, are kept as given, and '-' stands for standard input.
+    """
+    files: List[str] = []
+    for path in paths:
+        if path != STDIN and Path(path).is_dir():
+            found = [
+                str(file) for file in Path(path).rglob("*")
+                if file.is_file() and file.name.lower().replace(".gz", "").endswith(FASTA_SUFFIXES)
+            ]
+            files.extend(sorted(found))
+        elif path == STDIN or Path(path).is_file():
+            files.append(path)
+        else:
+            raise CliError(f"No such file or directory: {path}")
+    return files
+
+
+def read_sequences(path: str) -> Iterator[Sequence]:
+    """ Read the sequences of a FASTA file, optionally gzipped, or of standard input """
+    if path == STDIN:
+        return Fasta.iter_sequences(sys.stdin)
+    return Fasta.iter_sequences_from_file(Path(path))
+
+
+class _EndOfInput:
+    """ Sent by the thread of ReadAhead once the file is read, with the error that stopped it if any """
+
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+class ReadAhead:
+    """ Reads the sequences of a FASTA file on a background thread, up to buffer sequences ahead of
+        the consumer, so that reading and decompressing the next files overlaps with scoring.
+    """
+
+    def __init__(self, path: str, buffer: int, read: Callable[[str], Iterable[Sequence]] = read_sequences):
+        """
+        Parameters:
+            path: The FASTA file to read, or '-' for standard input
+            buffer: The maximum number of sequences read but not consumed yet
+            read: Reads the sequences of a path, read_sequences by default
+        """
+        self.path = path
+        self._read = read
+        self._queue: queue.Queue = queue.Queue(maxsize=buffer)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sitetack-read", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for sequence in self._read(self.path):
+                if not self._put(sequence):
+                    return
+            self._put(_EndOfInput())
+        except BaseException as e:
+            self._put(_EndOfInput(e))
+
+    def __iter__(self) -> Iterator[Sequence]:
+        while True:
+            item = self._queue.get()
+            if isinstance(item, _EndOfInput):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+
+    def close(self):
+        """ Stop reading, for when the consumer gives up early """
+        self._stopped.set()
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """ The inputs whose predictions are fully written, saved after each input so that an interrupted
+        run resumes where it stopped
+    """
+    options: Dict[str, str]
+    completed: List[str] = field(default_factory=list)
+    output_bytes: int = 0
+
+    @staticmethod
+    def load(checkpoint_file: Path) -> Optional["Checkpoint"]:
+        if not checkpoint_file.is_file():
+            return None
+        try:
+            return Checkpoint(**json.loads(checkpoint_file.read_text()))
+        except (ValueError, TypeError) as e:
+            raise CliError(f"Unreadable checkpoint {checkpoint_file}, delete it to start over: {e}")
+
+    def save(self, checkpoint_file: Path):
+        """ Replace the checkpoint file atomically, so that an interruption never leaves a partial file """
+        temporary_file = checkpoint_file.with_name(f"{checkpoint_file.name}.tmp")
+        temporary_file.write_text(json.dumps(asdict(self)))
+        temporary_file.replace(checkpoint_file)
+
+
+class TextOutput:
+    """ Writes CSV or NDJSON predictions to a single file. On resume, the file is truncated back to
+        the size recorded by the checkpoint, dropping the rows of the input that was interrupted.
+    """
+
+    def __init__(self, path: Path, output_format: OutputFormat):
+        self.path = path
+        self.output_format = output_format
+        self._file: Optional[BinaryIO] = None
+
+    def open(self, checkpoint: Checkpoint):
+        if checkpoint.completed:
+            if not self.path.is_file():
+                raise CliError(f"The output {self.path} of the checkpoint is missing, delete the checkpoint to start over")
+            file = open(self.path, "r+b")
+            file.truncate(checkpoint.output_bytes)
+            file.seek(checkpoint.output_bytes)
+        else:
+            file = open(self.path, "wb")
+            if self.output_format == OutputFormat.CSV:
+                file.write(CSV_HEADER.encode())
+        self._file = file
+
+    def _opened_file(self) -> BinaryIO:
+        if self._file is None:
+            raise RuntimeError("The output must be opened before it is written")
+        return self._file
+
+    def begin(self, index: int):
+        pass
+
+    def write(self, sequence_prediction: SequencePrediction):
+        if self.output_format == OutputFormat.CSV:
+            self._opened_file().write(to_csv_rows(sequence_prediction).encode())
+        else:
+            self._opened_file().write(to_ndjson_line(sequence_prediction).encode())
+
+    def commit(self) -> int:
+        """ Make the predictions written so far durable, returns the size of the output """
+        file = self._opened_file()
+        file.flush()
+        os.fsync(file.fileno())
+        return file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ParquetOutput:
+    """ Writes the predictions of each input to its own Parquet file in the output directory, one row
+        per site. A file is renamed into place once its input is complete, so that an interrupted
+        run never leaves a truncated file behind. Requires pyarrow.
+    """
+
+    """ The number of rows buffered before a row group is written """
+    ROW_GROUP_SIZE = 65536
+
+    output_format = OutputFormat.PARQUET
+
+    def __init__(self, directory: Path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise CliError("Parquet output requires pyarrow, install it with 'pip install pyarrow'")
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        self.directory = directory
+        self.schema = arrow_schema(pyarrow)
+        self._writer: Optional[Any] = None
+        self._part_file: Optional[Path] = None
+        self._buffered: List[SequencePrediction] = []
+        self._buffered_sites = 0
+
+    def open(self, checkpoint: Checkpoint):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for stale_file in self.directory.glob("part-*.parquet.tmp"):
+            stale_file.unlink()
+        if not checkpoint.completed:
+            for old_file in self.directory.glob("part-*.parquet"):
+                old_file.unlink()
+
+    def begin(self, index: int):
+        self._part_file = self.directory / f"part-{index:05d}.parquet"
+        self._writer = self._parquet.ParquetWriter(str(self._temporary_file()), self.schema)
+        self._buffered = []
+        self._buffered_sites = 0
+
+    def _begun_part_file(self) -> Path:
+        if self._part_file is None:
+            raise RuntimeError("An input must be begun before its predictions are written")
+        return self._part_file
+
+    def _begun_writer(self) -> Any:
+        if self._writer is None:
+            raise RuntimeError("An input must be begun before its predictions are written")
+        return self._writer
+
+    def _temporary_file(self) -> Path:
+        part_file = self._begun_part_file()
+        return part_file.with_name(f"{part_file.name}.tmp")
+
+    def write(self, sequence_prediction: SequencePrediction):
+        self._buffered.append(sequence_prediction)
+        self._buffered_sites += len(sequence_prediction.site_predictions)
+        if self._buffered_sites >= self.ROW_GROUP_SIZE:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if self._buffered_sites:
+            self._begun_writer().write_table(to_arrow(self._buffered))
+        self._buffered = []
+        self._buffered_sites = 0
+
+    def commit(self) -> int:
+        self._write_row_group()
+        self._begun_writer().close()
+        self._writer = None
+        self._temporary_file().replace(self._begun_part_file())
+        return 0
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Progress:
+    """ Reports the number of files, sequences and sites scored on stderr, at most every interval seconds """
+
+    def __init__(self, total_files: int, stream: Optional[TextIO] = None, interval: float = 1.0):
+        self.total_files = total_files
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.files = 0
+        self.sequences = 0
+        self.sites = 0
+        self._start = time.monotonic()
+        self._last_report = 0.0
+
+    def sequence_done(self, sites: int):
+        self.sequences += 1
+        self.sites += sites
+        if time.monotonic() - self._last_report >= self.interval:
+            self.report()
+
+    def file_done(self):
+        self.files += 1
+        self.report()
+
+    def report(self):
+        self._last_report = time.monotonic()
+        elapsed = max(self._last_report - self._start, 1e-9)
+        print(
+            f"{self.files}/{self.total_files} files, {self.sequences} sequences, {self.sites} sites, "
+            f"{self.sequences / elapsed:.1f} sequences/s",
+            file=self.stream,
+            flush=True,
+        )
+
+
+def score_files(
+    inputs: List[str],
+    output: Any,
+    checkpoint_file: Path,
+    ptm: PtmKind,
+    organism: OrganismKind,
+    label: LabelKind,
+    batch_size: int,
+    readers: int = 2,
+    read_ahead: int = 256,
+    progress: Optional[Progress] = None,
+    predict: PredictFunction = Predict.on_sequences,
+) -> Checkpoint:
+    """
+    Score FASTA files in order and write their predictions, resuming from the checkpoint file if it
+    exists. The checkpoint is deleted once every input is done.
+
+    Parameters:
+        inputs: The FASTA files to score, '-' for standard input
+        output: A TextOutput or ParquetOutput
+        checkpoint_file: Where the progress is saved after each input
+        ptm: The PTM to predict
+        organism: The organism to predict
+        label: The label to predict
+        batch_size: The number of kmers scored per model call
+        readers: The number of files read ahead on background threads
+        read_ahead: The number of sequences buffered per file read ahead
+        progress: Reports the progress, or None to be quiet
+        predict: Scores a stream of sequences, Predict.on_sequences by default
+    """
+    options = {"ptm": ptm.name, "organism": organism.name, "label": label.name, "format": output.output_format.value}
+    checkpoint = Checkpoint.load(checkpoint_file)
+    if checkpoint is None:
+        checkpoint = Checkpoint(options)
+    elif checkpoint.options != options:
+        raise CliError(f"The checkpoint {checkpoint_file} was written with other options {checkpoint.options}, delete it to start over")
+    elif STDIN in inputs:
+        # Standard input cannot be read again, so whether it was scored says nothing of what it holds now
+        raise CliError(f"Cannot resume from the checkpoint {checkpoint_file} when reading standard input, delete it to start over")
+
+    completed = set(checkpoint.completed)
+    todo = [(index, path) for index, path in enumerate(inputs) if path not in completed]
+    if progress is not None:
+        progress.files = len(inputs) - len(todo)
+
+    output.open(checkpoint)
+    remaining = iter(todo)
+    reading: Deque[Tuple[int, str, ReadAhead]] = deque()
+
+    def read_next():
+        for index, path in remaining:
+            reading.append((index, path, ReadAhead(path, read_ahead)))
+            return
+
+    try:
+        for _ in range(max(1, readers)):
+            read_next()
+        while reading:
+            index, path, sequences = reading.popleft()
+            read_next()
+            output.begin(index)
+            try:
+                for sequence_prediction in predict(sequences, ptm, organism, label, batch_size):
+                    output.write(sequence_prediction)
+                    if progress is not None:
+                        progress.sequence_done(len(sequence_prediction.site_predictions))
+            except Exception as e:
+                raise CliError(f"Failed to score {path}: {e}") from e
+            finally:
+                sequences.close()
+            output_bytes = output.commit()
+            checkpoint = replace(checkpoint, completed=checkpoint.completed + [path], output_bytes=output_bytes)
+            checkpoint.save(checkpoint_file)
+            if progress is not None:
+                progress.file_done()
+    finally:
+        for _, _, sequences in reading:
+            sequences.close()
+        output.close()
+    checkpoint_file.unlink(missing_ok=True)
+    return checkpoint
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="sitetack",
+        description="Predict PTM sites in FASTA files. Interrupted runs resume from their checkpoint when run again.",
+    )
+    parser.add_argument("inputs", nargs="+", help="FASTA files, optionally gzipped, directories of FASTA files, or - for standard input")
+    parser.add_argument("-o", "--output", required=True, type=Path, help="The output file, or directory for parquet")
+    parser.add_argument("--ptm", required=True, choices=list(PtmKind.__members__))
+    parser.add_argument("--organism", required=True, choices=list(OrganismKind.__members__))
+    parser.add_argument("--label", default=LabelKind.NO_LABELS.name, choices=list(LabelKind.__members__))
+    parser.add_argument(
+        "--format",
+        choices=[output_format.value for output_format in OutputFormat],
+        help="The output format, guessed from the output extension by default",
+    )
+    parser.add_argument("--batch-size", type=int, default=get_settings().batch_size, help="The number of kmers scored per model call")
+    parser.add_argument("--readers", type=int, default=2, help="The number of files read ahead in parallel")
+    parser.add_argument("--checkpoint", type=Path, help="The checkpoint file, next to the output by default")
+    parser.add_argument("--quiet", action="store_true", help="Do not report progress on stderr")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    output_format = OutputFormat(args.format) if args.format else OutputFormat.from_path(args.output)
+    checkpoint_file = args.checkpoint or args.output.with_name(f"{args.output.name}.checkpoint.json")
+    try:
+        inputs = find_fasta_files(args.inputs)
+        if output_format == OutputFormat.PARQUET:
+            output = ParquetOutput(args.output)
+        else:
+            output = TextOutput(args.output, output_format)
+        score_files(
+            inputs,
+            output,
+            checkpoint_file,
+            PtmKind[args.ptm],
+            OrganismKind[args.organism],
+            LabelKind[args.label],
+            batch_size=args.batch_size,
+            readers=args.readers,
+            progress=None if args.quiet else Progress(len(inputs)),
+        )
+    except CliError as e:
+        print(f"sitetack: error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        if STDIN in args.inputs:
+            print(f"sitetack: interrupted, delete {checkpoint_file} to start over", file=sys.stderr)
+        else:
+            print(f"sitetack: interrupted, run the same command again to resume from {checkpoint_file}", file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
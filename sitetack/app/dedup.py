@@ -0,0 +1,132 @@
+""" Scores each distinct encoded kmer once, for sequences with repeats or duplicated domains """
+
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+
+from sitetack.app.settings import get_settings
+
+
+@dataclass(frozen=True)
+class DedupStats:
+    """ Counters of a kmer deduplicator, in kmers """
+    kmers: int
+    unique_kmers: int
+    cache_hits: int
+    scored_kmers: int
+
+    @property
+    def dedup_ratio(self) -> float:
+        """ The fraction of kmers that were not run through a model """
+        return 1 - self.scored_kmers / self.kmers if self.kmers else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "kmers": self.kmers,
+            "unique_kmers": self.unique_kmers,
+            "cache_hits": self.cache_hits,
+            "scored_kmers": self.scored_kmers,
+            "dedup_ratio": self.dedup_ratio,
+        }
+
+
+class KmerDeduplicator:
+    """ Runs only the distinct kmers of a batch through a model and fans their probabilities back
+        out to every copy. Optionally remembers the probabilities of the last cache_size distinct
+        kmers of each model, so that repeats spread across batches are scored once too.
+    """
+
+    _shared: Optional["KmerDeduplicator"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_size: int = 0):
+        """
+        Parameters:
+            cache_size: The number of kmers remembered per model across batches, 0 to deduplicate within batches only
+        """
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # Keyed by the model itself, so that the entries of an unloaded model go away with it
+        self._caches: "weakref.WeakKeyDictionary[Any, OrderedDict[bytes, float]]" = weakref.WeakKeyDictionary()
+        self._kmers = 0
+        self._unique_kmers = 0
+        self._cache_hits = 0
+        self._scored_kmers = 0
+
+    @classmethod
+    def shared(cls) -> "KmerDeduplicator":
+        """ Get the deduplicator shared by the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(cache_size=get_settings().kmer_cache_size)
+            return cls._shared
+
+    def predict_on_batch(self, tensor: np.ndarray, model: Any) -> np.ndarray:
+        """ Same as model.predict_on_batch, flattened to one float32 probability per kmer """
+        return self._predict(tensor, model, model.predict_on_batch)
+
+    def predict(self, tensor: np.ndarray, model: Any) -> np.ndarray:
+        """ Same as model.predict, which splits the kmers into its own batches, flattened to one
+            float32 probability per kmer
+        """
+        return self._predict(tensor, model, model.predict)
+
+    def _predict(self, tensor: np.ndarray, model: Any, score) -> np.ndarray:
+        # Each row is viewed as a single opaque value, which np.unique sorts much faster than rows
+        rows = np.ascontiguousarray(tensor)
+        keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).reshape(-1)
+        unique_keys, first_indices, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_probabilities = np.empty(len(unique_keys), dtype=np.float32)
+
+        cache = self._model_cache(model)
+        missing = np.arange(len(unique_keys))
+        if cache is not None:
+            with self._lock:
+                found = [cache.get(key.tobytes()) for key in unique_keys]
+                for key, probability in zip(unique_keys, found):
+                    if probability is not None:
+                        cache.move_to_end(key.tobytes())
+            missing = np.array([i for i, probability in enumerate(found) if probability is None], dtype=np.int64)
+            for i, probability in enumerate(found):
+                if probability is not None:
+                    unique_probabilities[i] = probability
+
+        if len(missing):
+            result = score(rows[first_indices[missing]])
+            unique_probabilities[missing] = np.asarray(result, dtype=np.float32).reshape(-1)
+            if cache is not None:
+                with self._lock:
+                    for i in missing.tolist():
+                        cache[unique_keys[i].tobytes()] = float(unique_probabilities[i])
+                    while len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+
+        with self._lock:
+            self._kmers += len(keys)
+            self._unique_kmers += len(unique_keys)
+            self._cache_hits += len(unique_keys) - len(missing)
+            self._scored_kmers += len(missing)
+        return unique_probabilities[inverse.reshape(-1)]
+
+    def _model_cache(self, model: Any) -> "Optional[OrderedDict[bytes, float]]":
+        if self.cache_size < 1:
+            return None
+        with self._lock:
+            try:
+                return self._caches.setdefault(model, OrderedDict())
+            except TypeError:
+                # The model cannot be weakly referenced, deduplicate within batches only
+                return None
+
+    def stats(self) -> DedupStats:
+        with self._lock:
+            return DedupStats(
+                kmers=self._kmers,
+                unique_kmers=self._unique_kmers,
+                cache_hits=self._cache_hits,
+                scored_kmers=self._scored_kmers,
+            )
@@ -0,0 +1,88 @@
+""" Vectorized kmer extraction and encoding """
+
+from typing import List
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.kmer import Kmer
+
+
+class KmerEncoder:
+    """ Encodes the kmers around the sites of a sequence without building a Kmer per site.
+        The result matches Predict._tensor_encoding of Sequence.get_kmers, including the '-' padding.
+    """
+
+    @staticmethod
+    def find_sites(sequence: str, amino_acids: List[str]) -> np.ndarray:
+        """ Returns the 1-indexed positions of the given amino acids in the sequence, grouped by
+            amino acid in the order given, like Sequence.get_phosporylation_sites for each amino acid.
+
+            Parameters:
+                sequence: The sequence to search, such as 'MTEITAAMVKELRES'
+                amino_acids: The amino acids to find, such as ['S', 'T']
+        """
+        sequence_bytes = np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)
+        positions = [np.flatnonzero(sequence_bytes == ord(amino_acid)) for amino_acid in amino_acids]
+        if not positions:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(positions).astype(np.int64) + 1
+
+    @staticmethod
+    def encode_sites(sequence: str, sites: np.ndarray, alphabet: Alphabet, length: int) -> np.ndarray:
+        """ Returns the (len(sites), length) uint8 tensor of alphabet indices of the kmers centered
+            on the given sites, padded with '-' past the start or end of the sequence.
+
+            Parameters:
+                sequence: The sequence to get the kmers from
+                sites: The 1-indexed sites the kmers are centered about
+                alphabet: The alphabet used to encode the kmers
+                length: The length of the kmers, must be odd
+        """
+        return KmerEncoder.windows(KmerEncoder.pad(sequence, alphabet, length), sites, alphabet, length)
+
+    @staticmethod
+    def pad(sequence: str, alphabet: Alphabet, length: int) -> np.ndarray:
+        """ Returns the alphabet indices of a sequence with length // 2 '-' on both sides, from which
+            the kmers of any sites can be taken with windows. Invalid characters are kept as
+            Alphabet.INVALID_INDEX.
+
+            Parameters:
+                sequence: The sequence to encode
+                alphabet: The alphabet used to encode the kmers
+                length: The length of the kmers, must be odd
+        """
+        if length % 2 != 1:
+            raise ValueError("Length must be odd")
+        half = length // 2
+        indices = alphabet.encode(sequence)
+        padded = np.full(len(indices) + 2 * half, alphabet.encode(Kmer.padding)[0], dtype=np.uint8)
+        padded[half:half + len(indices)] = indices
+        return padded
+
+    @staticmethod
+    def windows(padded: np.ndarray, sites: np.ndarray, alphabet: Alphabet, length: int) -> np.ndarray:
+        """ Returns the tensor of the kmers centered on the given sites of a sequence encoded by pad.
+
+            Parameters:
+                padded: The sequence encoded by pad with the same alphabet and length
+                sites: The 1-indexed sites the kmers are centered about
+                alphabet: The alphabet the sequence was encoded with
+                length: The length of the kmers, must be odd
+        """
+        # Window i of the padded sequence is centered on position i of the sequence
+        tensor = KmerEncoder._sliding_windows(padded, length)[np.asarray(sites, dtype=np.int64) - 1]
+        if (tensor == Alphabet.INVALID_INDEX).any():
+            raise ValueError(f"Kmer contains characters that are not in the alphabet {alphabet.str}")
+        return tensor
+
+    @staticmethod
+    def _sliding_windows(array: np.ndarray, length: int) -> np.ndarray:
+        """ A read-only view of every window of the given length in a 1D array """
+        sliding_window_view = getattr(np.lib.stride_tricks, "sliding_window_view", None)
+        if sliding_window_view is not None:
+            return sliding_window_view(array, length)
+        # numpy < 1.20 has no sliding_window_view
+        stride = array.strides[0]
+        return as_strided(array, shape=(len(array) - length + 1, length), strides=(stride, stride), writeable=False)
@@ -0,0 +1,160 @@
+""" Runs inference off the event loop, with bounded concurrency and queue depth """
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Iterable, Optional
+
+from sitetack.app.settings import get_settings
+
+
+class ExecutorSaturated(Exception):
+    """ Raised when every inference slot and every queue position is taken """
+
+
+class _EndOfStream:
+    """ Sent by the producer thread of InferenceExecutor.iterate once the iterable is exhausted """
+
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+class InferenceExecutor:
+    """ A thread pool for blocking inference calls that rejects work instead of queueing it
+        without bound, so that a burst of large submissions cannot stall the event loop
+        or grow latency indefinitely.
+    """
+
+    _shared: Optional["InferenceExecutor"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_workers: int, max_queue: int):
+        """
+        Parameters:
+            max_workers: The number of inference calls running at once
+            max_queue: The number of inference calls waiting for a worker before new calls are rejected
+        """
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be positive, got {max_workers}")
+        if max_queue < 0:
+            raise ValueError(f"max_queue must not be negative, got {max_queue}")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sitetack-inference")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @classmethod
+    def shared(cls) -> "InferenceExecutor":
+        """ Get the executor shared by the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                settings = get_settings()
+                cls._shared = cls(max_workers=settings.inference_workers, max_queue=settings.inference_queue)
+            return cls._shared
+
+    @classmethod
+    def shutdown_shared(cls):
+        """ Shut down the shared executor, a new one is created on the next call to shared() """
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.shutdown(wait=False)
+                cls._shared = None
+
+    @property
+    def pending(self) -> int:
+        """ The number of calls running or waiting for a worker """
+        with self._lock:
+            return self._pending
+
+    def submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """ Schedule a call on the pool.
+
+            Raises:
+                ExecutorSaturated: When max_workers calls are running and max_queue calls are waiting
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise ExecutorSaturated(f"{self._pending} inference calls are already pending")
+            self._pending += 1
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """ Run a blocking call on the pool and wait for its result without blocking the event loop.
+
+            Raises:
+                ExecutorSaturated: When max_workers calls are running and max_queue calls are waiting
+        """
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def iterate(self, func: Callable[..., Iterable[Any]], *args: Any, buffer: int = 16, **kwargs: Any) -> AsyncGenerator[Any, None]:
+        """ Consume a blocking iterable on the pool, yielding its items on the event loop as they
+            are produced. The pool slot is held until the iterable is exhausted or the consumer
+            stops, and the producer waits while buffer items are not consumed yet, so that a slow
+            client does not make the results pile up in memory.
+
+            Raises:
+                ExecutorSaturated: Immediately, when max_workers calls are running and max_queue calls are waiting
+        """
+        if buffer < 1:
+            raise ValueError(f"buffer must be positive, got {buffer}")
+        loop = asyncio.get_event_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        free_slots = threading.Semaphore(buffer)
+        stopped = threading.Event()
+
+        def put(item: Any) -> bool:
+            while not free_slots.acquire(timeout=0.1):
+                if stopped.is_set():
+                    return False
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+            return True
+
+        def produce():
+            items = None
+            try:
+                items = iter(func(*args, **kwargs))
+                for item in items:
+                    if stopped.is_set() or not put(item):
+                        return
+                end = _EndOfStream()
+            except BaseException as e:
+                end = _EndOfStream(e)
+            finally:
+                # A generator left unfinished is closed on this thread rather than when collected
+                close = getattr(items, "close", None)
+                if close is not None:
+                    close()
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+
+        self.submit(produce)
+
+        async def consume() -> AsyncGenerator[Any, None]:
+            try:
+                while True:
+                    item = await queue.get()
+                    if isinstance(item, _EndOfStream):
+                        if item.error is not None:
+                            raise item.error
+                        return
+                    free_slots.release()
+                    yield item
+            finally:
+                stopped.set()
+
+        return consume()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        """ Stop the worker threads once the pending calls are done """
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,248 @@
+""" Command line tool exporting the h5 models to SavedModel or TFLite for the faster inference backends,
+    and checking them and the NumPy engine against the h5 models
+"""
+
+import argparse
+import re
+import shutil
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.backends import (
+    InferenceBackend,
+    SavedModelPredictor,
+    TFLitePredictor,
+    exported_path,
+    write_metadata,
+)
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.model import Model, ModelKey
+from sitetack.app.numpy_backend import NumpyModel
+from sitetack.app.predict import Predict
+from sitetack.app.registry import load_keras_model
+from sitetack.app.runtime import import_tensorflow
+from sitetack.app.settings import get_settings
+from sitetack.app.warmup import parse_model_keys
+
+""" The PTM of each test set of test/MusiteDeep, all of them human and without labels """
+MUSITEDEEP_TEST_PTMS: Dict[str, PtmKind] = {
+    "Hydroxylation_K": PtmKind.HYDROXYLYSINE_K,
+    "Hydroxylation_P": PtmKind.HYDROXYPROLINE_P,
+    "Methylation_K": PtmKind.METHYLATION_K,
+    "Methylation_R": PtmKind.METHYLATION_R,
+    "N-glycosylation_N": PtmKind.N_LINKED_GLYCOSYLATION_N,
+    "N6-acetylation_K": PtmKind.N6_ACETYLATION_K,
+    "O-glycosylation_ST": PtmKind.O_LINKED_GLYCOSYLATION_ST,
+    "Phosphorylation_ST": PtmKind.PHOSPHORYLATION_ST,
+    "Phosphorylation_Y": PtmKind.PHOSPHORYLATION_Y,
+    "Pyrrolidone_Q": PtmKind.PYRROLIDONE_CARBOXYLIC_ACID_Q,
+    "S-Palmitoylation_C": PtmKind.S_PALMITOYLATION_C,
+    "SUMOylation_K": PtmKind.SUMOYLATION_K,
+    "Ubiquitination_K": PtmKind.UBIQUITINATION_K,
+}
+
+TEST_FILE_PATTERN = re.compile(r"Test_kmers_no_labels_(?:cd_0\.8_)?(?P<ptm>.+)_Humans\.csv")
+
+""" The default maximum absolute difference of probabilities with the h5 model """
+TOLERANCE = 1e-4
+
+""" The default tolerance of TFLite models quantized to int8 weights """
+QUANTIZED_TOLERANCE = 0.05
+
+
+def export_saved_model(model: Any, path: Path):
+    """ Save a Keras model as a SavedModel whose serving signature takes a batch of encoded kmers
+        of any size and returns their probabilities
+    """
+    tf = import_tensorflow()
+    module = tf.Module()
+    module.model = model
+    input_spec = tf.TensorSpec([None] + list(model.input_shape[1:]), model.inputs[0].dtype, name="kmers")
+
+    @tf.function(input_signature=[input_spec])
+    def serve(kmers):
+        return {"probabilities": model(kmers, training=False)}
+
+    module.serve = serve
+    tf.saved_model.save(module, str(path), signatures={"serving_default": serve})
+
+
+def export_tflite(model: Any, path: Path, quantize: bool = False):
+    """ Convert a Keras model to TFLite, with dynamic-range int8 quantization of the weights if asked """
+    tf = import_tensorflow()
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    path.write_bytes(converter.convert())
+
+
+def export_model(
+    h5_file: Path,
+    backends: List[InferenceBackend],
+    export_dir: Path,
+    model_directory: Path,
+    quantize: bool = False,
+    load=load_keras_model,
+) -> Dict[InferenceBackend, Path]:
+    """ Export an h5 model for each backend, replacing previous exports only once complete.
+
+        Parameters:
+            h5_file: The h5 file of the model
+            backends: The formats to export to, SAVED_MODEL and TFLITE
+            export_dir: The directory the models are exported to
+            model_directory: The directory of the h5 files, mirrored in export_dir
+            quantize: Whether to quantize the weights of the TFLite model to int8
+            load: Loads the Keras model of an h5 file
+        Returns:
+            Dict[InferenceBackend, Path]: The exported path of each backend
+    """
+    model = load(h5_file)
+    paths = {}
+    for backend in backends:
+        path = exported_path(h5_file, backend, export_dir, model_directory)
+        if path is None:
+            raise ValueError(f"{h5_file} is not in the models directory {model_directory}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f"{path.name}.tmp")
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        if backend == InferenceBackend.SAVED_MODEL:
+            export_saved_model(model, temporary_path)
+            shutil.rmtree(path, ignore_errors=True)
+        elif backend == InferenceBackend.TFLITE:
+            export_tflite(model, temporary_path, quantize)
+        else:
+            raise ValueError(f"Cannot export to {backend.value}")
+        temporary_path.replace(path)
+        write_metadata(path, h5_file, quantized=quantize and backend == InferenceBackend.TFLITE)
+        paths[backend] = path
+    return paths
+
+
+def find_test_sets(directory: Path) -> Dict[ModelKey, List[Path]]:
+    """ Find the kmer test sets of test/MusiteDeep, by the model they were held out from """
+    test_sets: Dict[ModelKey, List[Path]] = {}
+    for csv_file in sorted(Path(directory).glob("*.csv")):
+        match = TEST_FILE_PATTERN.fullmatch(csv_file.name)
+        if match and match["ptm"] in MUSITEDEEP_TEST_PTMS:
+            key = (MUSITEDEEP_TEST_PTMS[match["ptm"]], OrganismKind.HUMAN, LabelKind.NO_LABELS)
+            test_sets.setdefault(key, []).append(csv_file)
+    return test_sets
+
+
+def read_test_kmers(csv_files: List[Path], alphabet: Alphabet, length: int = Predict.KMER_LENGTH) -> np.ndarray:
+    """ Encode the kmers of test set files, one 'kmer, label' row each. Rows that are not kmers of
+        the given length over the alphabet, such as those of the Hydroxylation (K) files, are skipped.
+    """
+    rows = []
+    for csv_file in csv_files:
+        for line in csv_file.read_text().splitlines():
+            kmer = line.split(",", 1)[0].strip()
+            if len(kmer) != length:
+                continue
+            encoded = alphabet.encode(kmer)
+            if (encoded != Alphabet.INVALID_INDEX).all():
+                rows.append(encoded)
+    return np.stack(rows) if rows else np.empty((0, length), dtype=np.uint8)
+
+
+@dataclass(frozen=True)
+class EquivalenceReport:
+    """ How the probabilities of an exported model differ from those of its h5 model """
+    kmers: int
+    max_difference: float
+    flipped: int
+
+    def passed(self, tolerance: float) -> bool:
+        return self.max_difference <= tolerance
+
+
+def check_equivalence(reference: Any, candidate: Any, tensor: np.ndarray) -> EquivalenceReport:
+    """ Compare the probabilities of two models on the same kmers, counting the kmers on either
+        side of 0.5 as flipped
+    """
+    expected = np.asarray(reference.predict(tensor), dtype=np.float32).reshape(-1)
+    actual = np.asarray(candidate.predict(tensor), dtype=np.float32).reshape(-1)
+    if not len(expected):
+        return EquivalenceReport(0, 0.0, 0)
+    return EquivalenceReport(
+        kmers=len(expected),
+        max_difference=float(np.abs(expected - actual).max()),
+        flipped=int(((expected >= 0.5) != (actual >= 0.5)).sum()),
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(
+        prog="sitetack-export",
+        description="Export the h5 models for the saved_model and tflite inference backends. The numpy backend "
+        "reads the h5 files directly, so it is only checked.",
+    )
+    parser.add_argument(
+        "--models", default="all", help="'all' or comma separated PTM[:ORGANISM[:LABEL]] entries, all models by default"
+    )
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        default=[InferenceBackend.SAVED_MODEL.value, InferenceBackend.TFLITE.value],
+        choices=[InferenceBackend.SAVED_MODEL.value, InferenceBackend.TFLITE.value, InferenceBackend.NUMPY.value],
+        help="The formats to export to, saved_model and tflite by default",
+    )
+    parser.add_argument("--quantize", action="store_true", help="Quantize the weights of the TFLite models to int8")
+    parser.add_argument("--output-dir", type=Path, default=Path(settings.export_dir), help="Where the models are exported to")
+    parser.add_argument("--check", type=Path, help="A directory of kmer test sets, such as test/MusiteDeep, to compare the exported models with the h5 models on")
+    parser.add_argument("--tolerance", type=float, help="The maximum absolute difference of probabilities allowed by --check")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    index = Model.index()
+    try:
+        keys = parse_model_keys(args.models, index.keys())
+    except ValueError as e:
+        print(f"sitetack-export: error: {e}", file=sys.stderr)
+        return 1
+    backends = [InferenceBackend(value) for value in dict.fromkeys(args.format)]
+    exported_backends = [backend for backend in backends if backend != InferenceBackend.NUMPY]
+    test_sets = find_test_sets(args.check) if args.check else {}
+    predictors = {
+        InferenceBackend.SAVED_MODEL: SavedModelPredictor,
+        InferenceBackend.TFLITE: TFLitePredictor,
+        InferenceBackend.NUMPY: NumpyModel.from_h5,
+    }
+
+    failed = False
+    for key in keys:
+        h5_file = index.get_h5_file(*key)
+        name = ":".join(kind.name for kind in key)
+        paths = {}
+        if exported_backends:
+            paths = export_model(h5_file, exported_backends, args.output_dir, Model.model_directory_path(), quantize=args.quantize)
+            print(f"{name}: exported to {', '.join(str(path) for path in paths.values())}")
+        if InferenceBackend.NUMPY in backends:
+            paths[InferenceBackend.NUMPY] = h5_file
+        if key not in test_sets:
+            continue
+        tensor = read_test_kmers(test_sets[key], index.get_alphabet(*key))
+        reference = load_keras_model(h5_file)
+        for backend, path in paths.items():
+            quantized = args.quantize and backend == InferenceBackend.TFLITE
+            tolerance = args.tolerance if args.tolerance is not None else (QUANTIZED_TOLERANCE if quantized else TOLERANCE)
+            report = check_equivalence(reference, predictors[backend](path), tensor)
+            passed = report.passed(tolerance)
+            failed = failed or not passed
+            print(
+                f"{name}: {backend.value} {'matches' if passed else 'DIFFERS FROM'} h5 on {report.kmers} kmers, "
+                f"max difference {report.max_difference:.2e}, {report.flipped} flipped at 0.5"
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
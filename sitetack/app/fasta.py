@@ -1,55 +1,173 @@
+import gzip
+import io
+import mmap
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Optional, Pattern, TextIO, Tuple
 from sitetack.app.alphabet import Alphabet
 from sitetack.app.sequence import Sequence
 
 
+@dataclass(frozen=True)
+class FastaError:
+    """ A problem found in FASTA text, located by its 1-indexed line and column """
+    message: str
+    line: int
+    column: int
+    sequence_name: Optional[str] = None
+
+    def describe(self) -> str:
+        """ The message followed by the location of the problem """
+        location = f"line {self.line}, column {self.column}"
+        if self.sequence_name is not None:
+            location += f", sequence {self.sequence_name}"
+        return f"{self.message} ({location})"
+
+
+class FastaValidationError(ValueError):
+    """ Raised with the errors found in FASTA text that cannot be scored """
+
+    def __init__(self, errors: List[FastaError]):
+        super().__init__("; ".join(error.describe() for error in errors))
+        self.errors = errors
+
+
 class Fasta:
     """ For reading fasta files. """
 
+    """ The first bytes of a gzip file """
+    GZIP_MAGIC = b'\x1f\x8b'
+
     @staticmethod
     def read_sequences_from_file(fasta_file: Path) -> List[Sequence]:
         """
-        Read a fasta file and returns a list of Sequences.
+        Read a fasta file, optionally gzipped, and returns a list of Sequences.
         """
-        sequences: List[Sequence] = []  
-        # Open the fasta file, and read the lines using read_sequences_from_text
-        with open(fasta_file, 'r') as f:
-            sequences = Fasta.read_sequences_from_text(f.read())
-        return sequences
-    
+        return list(Fasta.iter_sequences_from_file(fasta_file))
+
+    @staticmethod
+    def is_gzip(fasta_file: Path) -> bool:
+        """
+        Check whether a file is gzipped from its first bytes rather than its extension.
+        """
+        with open(fasta_file, 'rb') as f:
+            return f.read(len(Fasta.GZIP_MAGIC)) == Fasta.GZIP_MAGIC
+
+    @staticmethod
+    def open_text(fasta_file: Path) -> TextIO:
+        """
+        Open a fasta file for reading as text, decompressing it if it is gzipped.
+        """
+        if Fasta.is_gzip(fasta_file):
+            return gzip.open(fasta_file, 'rt')
+        return open(fasta_file, 'r')
+
+    @staticmethod
+    def iter_sequences_from_file(fasta_file: Path, use_mmap: bool = False) -> Iterator[Sequence]:
+        """
+        Yields the Sequences of a fasta file, optionally gzipped, one record at a time.
+
+        Parameters:
+        fasta_file (Path): The fasta file to read
+        use_mmap (bool): Read an uncompressed file through a memory map rather than a buffered file
+        """
+        # Empty files cannot be memory mapped
+        if use_mmap and os.path.getsize(fasta_file) > 0 and not Fasta.is_gzip(fasta_file):
+            with open(fasta_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from Fasta.iter_sequences(line.decode() for line in iter(mapped.readline, b''))
+            return
+        with Fasta.open_text(fasta_file) as f:
+            yield from Fasta.iter_sequences(f)
+
+    @staticmethod
+    def count_sequences_in_file(fasta_file: Path) -> int:
+        """
+        Count the header lines of a fasta file without keeping its sequences in memory.
+        """
+        with Fasta.open_text(fasta_file) as f:
+            return sum(1 for line in f if line.lstrip().startswith('>'))
+
     @staticmethod
     def read_sequences_from_text(fasta_text: str) -> List[Sequence]:
         """
-        Parses a FASTA formatted text and returns a dictionary with the sequence IDs as keys
-        and a tuple containing the name (description) and sequence as values.
+        Parses a FASTA formatted text and returns a list of Sequences, one for each record.
 
         Parameters:
         fasta_text (str): A string containing FASTA formatted text.
 
         Returns:
-        dict: A dictionary with sequence IDs as keys and tuples of (name, sequence) as values.
+        List[Sequence]: The sequences, in the order of the text.
+        """
+        return list(Fasta.iter_sequences_from_text(fasta_text))
+
+    @staticmethod
+    def iter_sequences_from_text(fasta_text: str) -> Iterator[Sequence]:
+        """
+        Yields the Sequences of a FASTA formatted text one record at a time.
+        """
+        return Fasta.iter_sequences(io.StringIO(fasta_text))
+
+    @staticmethod
+    def iter_sequences(lines: Iterable[str]) -> Iterator[Sequence]:
         """
-        sequences: List[Sequence] = []  
-        sequence_name: str = ""  # Initialize sequence_name as an empty string
-        sequence: str = ""  # Initialize sequence as an empty string
-        lines = fasta_text.strip().split('\n')
+        Yields the Sequences of FASTA formatted lines one record at a time, so that memory is
+        bounded by the longest record. The lines can be a text file handle or sys.stdin.
+        Records without a name are skipped.
 
+        Parameters:
+        lines (Iterable[str]): The lines of FASTA formatted text, with or without line endings.
+        """
+        sequence_name: str = ""
+        chunks: List[str] = []
         for line in lines:
+            line = line.strip()
             if line.startswith('>'):
-                if sequence_name:  # Check if sequence_name is not an empty string
-                    sequences.append(Sequence(sequence_name, sequence))
+                if sequence_name:
+                    yield Sequence(sequence_name, ''.join(chunks))
                 sequence_name = line[1:].strip()
-                sequence = ''  # Reset sequence for the next record
-            else:
-                sequence += line.strip()  # Concatenate the sequence line
+                chunks = []
+            elif line:
+                chunks.append(line)
 
         if sequence_name:  # Check for the last record
-            sequences.append(Sequence(sequence_name, sequence))
+            yield Sequence(sequence_name, ''.join(chunks))
+
+    @staticmethod
+    def parse(fasta_text: str, alphabet: Alphabet, max_errors: Optional[int] = 1) -> Tuple[List[Sequence], List[FastaError]]:
+        """
+        Validates a FASTA formatted text and parses its sequences in the same pass.
+
+        Parameters:
+        fasta_text (str): A string containing FASTA formatted text.
+        alphabet (Alphabet): The characters allowed in the sequences.
+        max_errors (Optional[int]): Stop after this many errors, or None to collect all of them.
+
+        Returns:
+        Tuple[List[Sequence], List[FastaError]]: The sequences, which are only complete when
+                        there are no errors, and the errors in the order of the text.
+        """
+        sequences: List[Sequence] = []
+        errors = _FastaScanner(fasta_text, alphabet, max_errors).scan(sequences)
+        return sequences, errors
+
+    @staticmethod
+    def find_errors(fasta_text: str, alphabet: Alphabet, max_errors: Optional[int] = 1) -> List[FastaError]:
+        """
+        Validates a FASTA formatted text in a single pass, without building its sequences.
+
+        Parameters:
+        fasta_text (str): A string containing FASTA formatted text.
+        alphabet (Alphabet): The characters allowed in the sequences.
+        max_errors (Optional[int]): Stop after this many errors, or None to collect all of them.
+
+        Returns:
+        List[FastaError]: The errors in the order of the text, empty when the text is valid.
+        """
+        return _FastaScanner(fasta_text, alphabet, max_errors).scan(None)
 
-        return sequences
-    
-    
     @staticmethod
     def validate_fasta_text(fasta_text: str, alphabet: Alphabet) -> Tuple[bool, str]:
         """
@@ -63,36 +181,130 @@ class Fasta:
                         whether the FASTA text is valid or not, and the second
                         element is an error message if the text is invalid.
         """
-        unique_sequence_names = set()
-        if not fasta_text.strip():
-            return False, "The FASTA text is empty."
-        
-        lines = fasta_text.strip().split('\n')
-        if not lines[0].startswith('>'):
-            return False, "The FASTA text must start with a header line (>)."
-        
-        valid_chars = set(alphabet.str)  # For nucleotides, including ambiguity codes
-
-        sequence_started = False
-        for line in lines:
-            if line.startswith('>'):
-                if sequence_started:  # A new header starts, so reset the flag
-                    sequence_started = False
+        errors = Fasta.find_errors(fasta_text, alphabet)
+        if errors:
+            return False, errors[0].message
+        return True, "The FASTA text is valid."
 
-                # Also, make sure the header is unique
-                sequence_name = line[1:].strip()
-                print(f"sequence_name: {sequence_name}")
-                if sequence_name in unique_sequence_names:
-                    return False, f"Duplicate sequence name found: {sequence_name}"
-                else:
-                    unique_sequence_names.add(sequence_name)
-                continue
+
+NON_WHITESPACE_PATTERN = re.compile(r'\S')
+
+
+@lru_cache(maxsize=None)
+def _sequence_patterns(alphabet: str) -> Tuple[Pattern, Pattern]:
+    """ The patterns used to check the sequence lines of an alphabet, compiled once per alphabet.
+
+        The first matches a run of alphabet characters and newlines, which covers well formed
+        sequence data in a single C-level pass. The second finds, within one line, a character
+        that is neither in the alphabet nor whitespace, or whitespace between two characters.
+    """
+    valid = ''.join(re.escape(c) for c in alphabet)
+    clean_run = re.compile(rf'[{valid}\n]*')
+    invalid_character = re.compile(rf'[^{valid}\s]|(?<=[{valid}])[^\S\n]+(?=[{valid}])')
+    return clean_run, invalid_character
+
+
+class _FastaScanner:
+    """ Walks FASTA text once, from header to header, checking each record with compiled patterns
+        instead of splitting the text into lines.
+    """
+
+    def __init__(self, fasta_text: str, alphabet: Alphabet, max_errors: Optional[int]):
+        # Lines are stripped, so Windows line endings only need to be normalized once
+        self.text = fasta_text.replace('\r\n', '\n')
+        self.clean_run_pattern, self.invalid_character_pattern = _sequence_patterns(alphabet.str)
+        self.alphabet = alphabet
+        self.max_errors = max_errors
+        self.errors: List[FastaError] = []
+        # The location of the last error, since errors are reported in the order of the text
+        self._position = 0
+        self._line = 1
+        self._line_start = 0
+
+    def report(self, message: str, position: int, sequence_name: Optional[str] = None) -> bool:
+        """ Record an error at a position of the text, returns True when the scan must stop """
+        self._line += self.text.count('\n', self._position, position)
+        newline = self.text.rfind('\n', self._position, position)
+        if newline != -1:
+            self._line_start = newline + 1
+        self._position = position
+        self.errors.append(FastaError(message, self._line, position - self._line_start + 1, sequence_name))
+        return self.max_errors is not None and len(self.errors) >= self.max_errors
+
+    def headers(self) -> Iterator[Tuple[int, int, int]]:
+        """ Yields the start of each header line, the position of its '>' and the end of the line.
+            A header line may be indented.
+        """
+        text = self.text
+        position = text.find('>')
+        while position != -1:
+            line_start = text.rfind('\n', 0, position) + 1
+            if NON_WHITESPACE_PATTERN.search(text, line_start, position) is None:
+                line_end = text.find('\n', position)
+                if line_end == -1:
+                    line_end = len(text)
+                yield line_start, position, line_end
+                position = text.find('>', line_end)
             else:
-                sequence_started = True
-                if not set(line.strip()).issubset(valid_chars):
-                    return False, f"Invalid character found in sequence. Valid characters are: {alphabet.str}"
-        
-        if not sequence_started:  # No sequence lines found after headers
-            return False, "No sequence data found after header lines."
-        
-        return True, "The FASTA text is valid."
\ No newline at end of file
+                position = text.find('>', position + 1)
+
+    def check_sequence_lines(self, start: int, end: int) -> Tuple[Optional[int], bool]:
+        """ Returns the position of the first invalid character between start and end, or None,
+            and whether the lines contain no whitespace other than their newlines.
+        """
+        text = self.text
+        clean = True
+        position = self.clean_run_pattern.match(text, start, end).end()
+        while position < end:
+            # Leading and trailing whitespace is allowed, so check the whole line that broke the run
+            clean = False
+            line_start = max(start, text.rfind('\n', start, position) + 1)
+            line_end = text.find('\n', position, end)
+            if line_end == -1:
+                line_end = end
+            invalid_character = self.invalid_character_pattern.search(text, line_start, line_end)
+            if invalid_character is not None:
+                return invalid_character.start(), clean
+            position = self.clean_run_pattern.match(text, line_end, end).end()
+        return None, clean
+
+    def scan(self, sequences: Optional[List[Sequence]]) -> List[FastaError]:
+        """ Validate the text, appending its named records to sequences unless it is None """
+        text = self.text
+        first_character = NON_WHITESPACE_PATTERN.search(text)
+        if first_character is None:
+            self.report("The FASTA text is empty.", 0)
+            return self.errors
+
+        headers = self.headers()
+        header = next(headers, None)
+        if header is None or first_character.start() < header[1]:
+            if self.report("The FASTA text must start with a header line (>).", first_character.start()):
+                return self.errors
+
+        sequence_names = set()
+        while header is not None:
+            _, name_start, body_start = header
+            sequence_name = text[name_start + 1:body_start].strip()
+            if sequence_name in sequence_names:
+                if self.report(f"Duplicate sequence name found: {sequence_name}", name_start + 1, sequence_name):
+                    return self.errors
+            sequence_names.add(sequence_name)
+
+            next_header = next(headers, None)
+            body_end = next_header[0] if next_header is not None else len(text)
+            invalid_position, clean = self.check_sequence_lines(body_start, body_end)
+            if invalid_position is not None:
+                message = f"Invalid character found in sequence. Valid characters are: {self.alphabet.str}"
+                if self.report(message, invalid_position, sequence_name):
+                    return self.errors
+            elif sequences is not None and sequence_name:
+                body = text[body_start:body_end]
+                sequences.append(Sequence(sequence_name, body.replace('\n', '') if clean else ''.join(body.split())))
+
+            # Like Fasta.read_sequences_from_text, only the last header must be followed by sequence data
+            if next_header is None and NON_WHITESPACE_PATTERN.search(text, body_start, body_end) is None:
+                if self.report("No sequence data found after header lines.", header[1], sequence_name):
+                    return self.errors
+            header = next_header
+        return self.errors
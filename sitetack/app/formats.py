@@ -0,0 +1,152 @@
+""" Serializes predictions one sequence at a time, for streaming responses and result files """
+
+import csv
+import io
+import json
+import math
+from enum import Enum
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+from sitetack.app.predict import PredictionColumns, SequencePrediction, SitePredictions
+
+
+class ResultFormat(Enum):
+    """ The formats predictions can be returned in, with their media types """
+    JSON = "json"
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+    @property
+    def media_type(self) -> str:
+        return {
+            ResultFormat.JSON: "application/json",
+            ResultFormat.NDJSON: "application/x-ndjson",
+            ResultFormat.CSV: "text/csv",
+        }[self]
+
+
+""" The header of CSV results, matching the CSV download of the frontend """
+CSV_HEADER = "sequence name,site,amino acid,probability\n"
+
+
+def sequence_prediction_to_dict(sequence_prediction: SequencePrediction) -> dict:
+    """ Same as dataclasses.asdict, without its recursive deep copy """
+    return sequence_prediction.to_dict()
+
+
+def _float_json(value: float) -> str:
+    # json.dumps writes floats with repr, and rejects the values JSON has no literal for
+    if not math.isfinite(value):
+        raise ValueError(f"Out of range float values are not JSON compliant: {value!r}")
+    return repr(value)
+
+
+def _sequence_json(sequence_prediction: SequencePrediction, item_separator: str, key_separator: str, ensure_ascii: bool) -> str:
+    """ The JSON of a sequence prediction, written directly from the arrays of its sites """
+    site_predictions = SitePredictions.from_list(sequence_prediction.site_predictions)
+    amino_acids = {amino_acid: json.dumps(amino_acid) for amino_acid in set(site_predictions.amino_acids())}
+    site_template = "{{" + item_separator.join(
+        [f'"site"{key_separator}{{}}', f'"amino_acid"{key_separator}{{}}', f'"probability"{key_separator}{{}}']
+    ) + "}}"
+    sites = item_separator.join(
+        site_template.format(site, amino_acids[amino_acid], _float_json(probability))
+        for site, amino_acid, probability in zip(
+            site_predictions.sites.tolist(), site_predictions.amino_acids(), site_predictions.probabilities.tolist()
+        )
+    )
+    return "{" + item_separator.join([
+        f'"sequence_name"{key_separator}{json.dumps(sequence_prediction.sequence_name, ensure_ascii=ensure_ascii)}',
+        f'"sequence"{key_separator}{json.dumps(sequence_prediction.sequence, ensure_ascii=ensure_ascii)}',
+        f'"site_predictions"{key_separator}[{sites}]',
+    ]) + "}"
+
+
+def to_json(sequence_predictions: Iterable[SequencePrediction]) -> str:
+    """ Serialize sequence predictions as the JSON of SequencePredictions.to_dict, compact and with
+        non-ASCII characters as is, like the JSON responses of the app
+    """
+    sequences = ",".join(_sequence_json(sequence_prediction, ",", ":", False) for sequence_prediction in sequence_predictions)
+    return '{"sequence_predictions":[' + sequences + "]}"
+
+
+def to_ndjson_line(sequence_prediction: SequencePrediction) -> str:
+    """ Serialize a sequence prediction as one line of JSON, the same as json.dumps of its dict """
+    return _sequence_json(sequence_prediction, ", ", ": ", True) + "\n"
+
+
+def _csv_name(name: str) -> str:
+    """ A sequence name as a CSV field, quoted if it contains commas, quotes or line breaks """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow([name])
+    return buffer.getvalue()
+
+
+def to_csv_rows(sequence_prediction: SequencePrediction) -> str:
+    """ Serialize a sequence prediction as one CSV row per site, with probabilities rounded
+        to 4 decimals like the frontend. Names containing commas or quotes are quoted.
+    """
+    site_predictions = SitePredictions.from_list(sequence_prediction.site_predictions)
+    if not len(site_predictions):
+        return ""
+    name = _csv_name(sequence_prediction.sequence_name)
+    return "".join(
+        f"{name},{site},{amino_acid},{probability:.4f}\n"
+        for site, amino_acid, probability in zip(
+            site_predictions.sites.tolist(), site_predictions.amino_acids(), site_predictions.probabilities.tolist()
+        )
+    )
+
+
+def to_csv(sequence_predictions: Iterable[SequencePrediction]) -> str:
+    """ Serialize sequence predictions as a whole CSV file, header included """
+    return CSV_HEADER + "".join(to_csv_rows(sequence_prediction) for sequence_prediction in sequence_predictions)
+
+
+def arrow_schema(pyarrow) -> Any:
+    """ The schema of Arrow tables and Parquet files of predictions, one row per site """
+    return pyarrow.schema([
+        ("sequence_name", pyarrow.string()),
+        ("site", pyarrow.int32()),
+        ("amino_acid", pyarrow.string()),
+        ("probability", pyarrow.float32()),
+    ])
+
+
+def to_arrow(sequence_predictions: Iterable[SequencePrediction]):
+    """ Convert sequence predictions to a pyarrow Table of one row per site, with the schema of
+        the Parquet output of the command line. Requires pyarrow.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow output requires pyarrow, install it with 'pip install pyarrow'")
+    if not isinstance(sequence_predictions, PredictionColumns):
+        sequence_predictions = PredictionColumns.from_predictions(sequence_predictions)
+    site_predictions = sequence_predictions.site_predictions
+    names = np.repeat(np.array(sequence_predictions.sequence_names, dtype=object), sequence_predictions.site_counts())
+    return pyarrow.table(
+        {
+            "sequence_name": pyarrow.array(names, type=pyarrow.string()),
+            "site": pyarrow.array(site_predictions.sites, type=pyarrow.int32()),
+            "amino_acid": pyarrow.array(site_predictions.residues.view("S1").astype("U1"), type=pyarrow.string()),
+            "probability": pyarrow.array(site_predictions.probabilities.astype(np.float32), type=pyarrow.float32()),
+        },
+        schema=arrow_schema(pyarrow),
+    )
+
+
+def iter_serialized(sequence_predictions: Iterable[SequencePrediction], result_format: ResultFormat) -> Iterator[str]:
+    """ Serialize a stream of sequence predictions as NDJSON lines or CSV rows, one chunk per sequence """
+    if result_format == ResultFormat.NDJSON:
+        for sequence_prediction in sequence_predictions:
+            yield to_ndjson_line(sequence_prediction)
+    elif result_format == ResultFormat.CSV:
+        yield CSV_HEADER
+        for sequence_prediction in sequence_predictions:
+            rows = to_csv_rows(sequence_prediction)
+            if rows:
+                yield rows
+    else:
+        raise ValueError(f"{result_format} cannot be streamed")
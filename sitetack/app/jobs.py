@@ -0,0 +1,277 @@
+""" Background prediction jobs for submissions too large for a single request """
+
+import json
+import logging
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from enum import Enum
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.fasta import Fasta
+from sitetack.app.formats import to_ndjson_line
+from sitetack.app.predict import Predict, SequencePrediction
+from sitetack.app.sequence import Sequence
+from sitetack.app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+PredictFunction = Callable[[Iterable[Sequence], PtmKind, OrganismKind, LabelKind], Iterator[SequencePrediction]]
+
+
+def predict_sequences(
+    sequences: Iterable[Sequence], ptm: PtmKind, organism: OrganismKind, label: LabelKind
+) -> Iterator[SequencePrediction]:
+    """ Scores the sequences of a job with the configured batch size """
+    return Predict.on_sequences(sequences, ptm, organism, label, batch_size=get_settings().batch_size)
+
+
+class JobNotFound(KeyError):
+    """ Raised when a job id does not match any stored job """
+
+
+class JobState(Enum):
+    """ The life cycle of a job """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class JobStatus:
+    """ The progress of a job, as stored in its status file """
+    job_id: str
+    state: JobState
+    ptm: str
+    organism: str
+    label: str
+    sequences_total: int = 0
+    sequences_done: int = 0
+    sites_scored: int = 0
+    error: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["state"] = self.state.value
+        return d
+
+    @staticmethod
+    def from_dict(d: dict) -> "JobStatus":
+        return JobStatus(**{**d, "state": JobState(d["state"])})
+
+
+class JobStore:
+    """ Keeps every job in its own directory holding the submitted FASTA, the status and the
+        results, one JSON line per sequence.
+    """
+
+    JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+    def __init__(self, directory: Path):
+        """
+        Parameters:
+            directory: The directory the job directories are created in
+        """
+        self.directory = Path(directory)
+
+    def job_directory(self, job_id: str) -> Path:
+        """ Get the directory of a job, checking that the id cannot escape the store """
+        if not self.JOB_ID_PATTERN.fullmatch(job_id):
+            raise JobNotFound(job_id)
+        return self.directory / job_id
+
+    def input_file(self, job_id: str) -> Path:
+        return self.job_directory(job_id) / "input.fasta"
+
+    def results_file(self, job_id: str) -> Path:
+        return self.job_directory(job_id) / "results.ndjson"
+
+    def status_file(self, job_id: str) -> Path:
+        return self.job_directory(job_id) / "status.json"
+
+    def create(self, fasta_text: str, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> JobStatus:
+        """ Store a new queued job and its FASTA text """
+        job_id = uuid.uuid4().hex
+        self.job_directory(job_id).mkdir(parents=True)
+        self.input_file(job_id).write_text(fasta_text)
+        self.results_file(job_id).touch()
+        now = time.time()
+        status = JobStatus(
+            job_id=job_id,
+            state=JobState.QUEUED,
+            ptm=ptm.name,
+            organism=organism.name,
+            label=label.name,
+            created_at=now,
+            updated_at=now,
+        )
+        self.write_status(status)
+        return status
+
+    def write_status(self, status: JobStatus):
+        """ Replace the status file of a job atomically, so that readers never see a partial file """
+        status_file = self.status_file(status.job_id)
+        temporary_file = status_file.with_name(f"{status_file.name}.tmp")
+        temporary_file.write_text(json.dumps(status.to_dict()))
+        temporary_file.replace(status_file)
+
+    def status(self, job_id: str) -> JobStatus:
+        """ Read the status of a job.
+
+            Raises:
+                JobNotFound: When there is no job with this id
+        """
+        try:
+            return JobStatus.from_dict(json.loads(self.status_file(job_id).read_text()))
+        except FileNotFoundError:
+            raise JobNotFound(job_id)
+
+    def read_results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[dict]:
+        """ Read a page of the sequence predictions written so far.
+
+            Parameters:
+                job_id: The id of the job
+                offset: The index of the first sequence prediction to read
+                limit: The maximum number of sequence predictions to read
+        """
+        self.status(job_id)
+        sequence_predictions = []
+        with open(self.results_file(job_id), "r") as f:
+            for line in islice(f, offset, offset + limit):
+                # The last line of a running job may be partly written, it is read once complete
+                if not line.endswith("\n"):
+                    break
+                sequence_predictions.append(json.loads(line))
+        return sequence_predictions
+
+    def statuses(self) -> List[JobStatus]:
+        """ Read the status of every stored job, oldest first """
+        if not self.directory.is_dir():
+            return []
+        statuses = []
+        for job_directory in self.directory.iterdir():
+            try:
+                statuses.append(self.status(job_directory.name))
+            except (JobNotFound, ValueError, TypeError):
+                continue
+        return sorted(statuses, key=lambda status: status.created_at)
+
+    def remove_expired(self, max_age: float):
+        """ Delete the finished jobs last updated more than max_age seconds ago """
+        now = time.time()
+        for status in self.statuses():
+            finished = status.state in (JobState.DONE, JobState.FAILED)
+            if finished and now - status.updated_at > max_age:
+                shutil.rmtree(self.job_directory(status.job_id), ignore_errors=True)
+
+
+class JobManager:
+    """ Runs stored jobs on a local pool of worker threads """
+
+    """ Minimum number of seconds between two progress updates of the status file """
+    PROGRESS_INTERVAL = 0.5
+
+    _shared: Optional["JobManager"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        store: JobStore,
+        max_workers: int = 1,
+        max_age: float = 0,
+        predict: PredictFunction = predict_sequences,
+    ):
+        """
+        Parameters:
+            store: Where the jobs are stored
+            max_workers: The number of jobs running at once
+            max_age: Seconds after which finished jobs are deleted, 0 to keep them
+            predict: Scores a stream of sequences, predict_sequences by default
+        """
+        self.store = store
+        self._max_age = max_age
+        self._predict = predict
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sitetack-job")
+        self._recover()
+
+    @classmethod
+    def shared(cls) -> "JobManager":
+        """ Get the job manager shared by the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                settings = get_settings()
+                cls._shared = cls(
+                    JobStore(Path(settings.job_dir)),
+                    max_workers=settings.job_workers,
+                    max_age=settings.job_max_age,
+                )
+            return cls._shared
+
+    @classmethod
+    def shutdown_shared(cls):
+        """ Shut down the shared job manager, a new one is created on the next call to shared() """
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.shutdown(wait=False)
+                cls._shared = None
+
+    def submit(self, fasta_text: str, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> JobStatus:
+        """ Store a job and queue it on the worker pool """
+        if self._max_age:
+            self.store.remove_expired(self._max_age)
+        status = self.store.create(fasta_text, ptm, organism, label)
+        self._executor.submit(self._run, status)
+        return status
+
+    def _recover(self):
+        """ Handle the jobs left unfinished by a previous server: queued jobs are queued again, and
+            running jobs are marked as failed as their results may be incomplete
+        """
+        for status in self.store.statuses():
+            if status.state == JobState.QUEUED:
+                self._executor.submit(self._run, status)
+            elif status.state == JobState.RUNNING:
+                logger.warning("Job %s was interrupted by a restart", status.job_id)
+                self.store.write_status(replace(
+                    status, state=JobState.FAILED, error="Interrupted by a restart of the server", updated_at=time.time()
+                ))
+
+    def _run(self, status: JobStatus):
+        try:
+            input_file = self.store.input_file(status.job_id)
+            status = replace(status, state=JobState.RUNNING, sequences_total=Fasta.count_sequences_in_file(input_file), updated_at=time.time())
+            self.store.write_status(status)
+
+            sequences = Fasta.iter_sequences_from_file(input_file)
+            predictions = self._predict(sequences, PtmKind[status.ptm], OrganismKind[status.organism], LabelKind[status.label])
+            last_update = time.monotonic()
+            with open(self.store.results_file(status.job_id), "w") as results:
+                for prediction in predictions:
+                    results.write(to_ndjson_line(prediction))
+                    status = replace(
+                        status,
+                        sequences_done=status.sequences_done + 1,
+                        sites_scored=status.sites_scored + len(prediction.site_predictions),
+                    )
+                    if time.monotonic() - last_update >= self.PROGRESS_INTERVAL:
+                        results.flush()
+                        self.store.write_status(replace(status, updated_at=time.time()))
+                        last_update = time.monotonic()
+            self.store.write_status(replace(status, state=JobState.DONE, updated_at=time.time()))
+        except Exception as e:
+            logger.exception("Job %s failed", status.job_id)
+            self.store.write_status(replace(status, state=JobState.FAILED, error=str(e), updated_at=time.time()))
+
+    def shutdown(self, wait: bool = True):
+        """ Stop the worker threads once the running jobs are done """
+        self._executor.shutdown(wait=wait)
@@ -1,26 +1,43 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
 from pydantic.main import BaseModel  # Updated import for BaseModel
 from pydantic.class_validators import validator  # Updated import for validator
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.batching import MicroBatcher
+from sitetack.app.cache import PredictionCache
+from sitetack.app.dedup import KmerDeduplicator
 from sitetack.app.enums import PtmKind, OrganismKind, LabelKind, kind_to_dict
-from sitetack.app.fasta import Fasta
-from sitetack.app.model import Model
-from sitetack.app.predict import Predict
-from starlette.responses import HTMLResponse
+from sitetack.app.executor import ExecutorSaturated, InferenceExecutor
+from sitetack.app.fasta import Fasta, FastaError, FastaValidationError
+from sitetack.app.formats import ResultFormat, iter_serialized, to_json
+from sitetack.app.jobs import JobManager, JobNotFound
+from sitetack.app.metrics import CONTENT_TYPE, Metrics, metric_lines
+from sitetack.app.model import Model, ModelKey
+from sitetack.app.predict import Predict, PredictionColumns, MultiSequencePredictions
+from sitetack.app.profiling import ProfileInfo, ProfileNotFound, Profiler
+from sitetack.app.registry import ModelRegistry
+from sitetack.app.sequence import Sequence
+from sitetack.app.settings import get_settings
+from sitetack.app.warmup import Warmup, WarmupState
+from sitetack.app.workers import WorkerPool
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from starlette.staticfiles import StaticFiles
 
+import asyncio
+import functools
+from dataclasses import asdict
 import importlib.resources
 from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
 
 # Assuming PtmKind, OrganismKind, and LabelKind are defined elsewhere as Enum classes.
 
 
 
 
-class RequestModel(BaseModel):
+class ModelChoice(BaseModel):
     ptm: str
     organism: str
     label: str
-    text: str
 
     @validator('ptm', always=True)
     def ptm_must_be_valid(cls, value):
@@ -40,19 +57,20 @@ class RequestModel(BaseModel):
             raise ValueError('Invalid label kind')
         return value
 
-    @validator('text', pre=False, always=True)  # Ensures this runs after the other validators
-    def validate_text(cls, value, values):
-        ptm_kind = values.get('ptm')
-        organism_kind = values.get('organism')
-        label_kind = values.get('label')
-        if ptm_kind and organism_kind and label_kind:
-            ptm = PtmKind[ptm_kind]
-            organism = OrganismKind[organism_kind]
-            label = LabelKind[label_kind]
-            alphabet = Model.get_alphabet(ptm, organism, label) 
-            is_valid, error_message = Fasta.validate_fasta_text(value, alphabet=alphabet)
-            if not is_valid:
-                raise ValueError(error_message)
+    def key(self) -> ModelKey:
+        return PtmKind[self.ptm], OrganismKind[self.organism], LabelKind[self.label]
+
+class RequestModel(ModelChoice):
+    text: str
+
+class MultiRequestModel(BaseModel):
+    models: List[ModelChoice]
+    text: str
+
+    @validator('models')
+    def models_must_not_be_empty(cls, value):
+        if not value:
+            raise ValueError('At least one model must be chosen')
         return value
 
 app = FastAPI()
@@ -60,15 +78,296 @@ app = FastAPI()
 with importlib.resources.path('sitetack.frontend', '') as frontend_path:
     app.mount("/frontend", StaticFiles(directory=str(frontend_path)), name="frontend")
 
+def busy_response() -> JSONResponse:
+    """ The response sent when every inference worker and queue position is taken """
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is busy, please retry later."},
+        headers={"Retry-After": str(get_settings().retry_after)},
+    )
+
+""" The maximum number of FASTA errors reported in a 422 response """
+MAX_REPORTED_ERRORS = 20
+
+def fasta_error_response(errors: List[FastaError]) -> JSONResponse:
+    """ The response sent for invalid FASTA text, in the format of the other validation errors """
+    return JSONResponse(
+        status_code=422,
+        content={"detail": [{"loc": ["body", "request", "text"], "msg": error.describe(), "type": "value_error"} for error in errors]},
+    )
+
+def parse_fasta(text: str, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> List[Sequence]:
+    """ Validates and parses a submission in a single pass over the text """
+    return parse_fasta_for_models(text, [(ptm, organism, label)])
+
+def parse_fasta_for_models(text: str, model_keys: List[ModelKey]) -> List[Sequence]:
+    """ Validates and parses a submission once for several models, accepting only the characters
+        that are in the alphabets of all of them
+    """
+    metrics = Metrics.shared()
+    with metrics.stage("alphabet"):
+        alphabets = [Model.get_alphabet(*model_key) for model_key in model_keys]
+        alphabet = functools.reduce(Alphabet.intersection, alphabets)
+    with metrics.stage("validate"):
+        sequences, errors = Fasta.parse(text, alphabet, max_errors=MAX_REPORTED_ERRORS)
+    if errors:
+        raise FastaValidationError(errors)
+    return sequences
+
+def predict_fasta(text: str, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> str:
+    """ Scores a submission and serializes it as JSON, run on the inference executor since it blocks """
+    sequences = parse_fasta(text, ptm, organism, label)
+    sequence_predictions = Predict.on_sequences(sequences, ptm, organism, label, batch_size=get_settings().batch_size)
+    return to_json(PredictionColumns.from_predictions(sequence_predictions))
+
+def predict_fasta_multi(text: str, model_keys: List[ModelKey]) -> dict:
+    """ Scores a submission with several models, run on the inference executor since it blocks """
+    sequences = parse_fasta_for_models(text, model_keys)
+    sequence_predictions = Predict.on_sequences_multi(sequences, model_keys, batch_size=get_settings().batch_size)
+    return MultiSequencePredictions(list(sequence_predictions)).to_dict()
+
+def stream_fasta(text: str, ptm: PtmKind, organism: OrganismKind, label: LabelKind, result_format: ResultFormat) -> Iterator[str]:
+    """ Scores a submission and serializes each sequence as soon as its batch is scored,
+        consumed on the inference executor since it blocks
+    """
+    sequences = parse_fasta(text, ptm, organism, label)
+    sequence_predictions = Predict.on_sequences(sequences, ptm, organism, label, batch_size=get_settings().batch_size)
+    return iter_serialized(sequence_predictions, result_format)
+
+async def started_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """ Waits for the first chunk before the response starts, so that invalid FASTA text or a
+        failure to load the model is an error response rather than a truncated stream
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = ""
+
+    async def resumed() -> AsyncIterator[str]:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return resumed()
+
+def invalid_format_response(value: str) -> JSONResponse:
+    formats = ", ".join(result_format.value for result_format in ResultFormat)
+    return JSONResponse(
+        status_code=422,
+        content={"detail": [{"loc": ["query", "format"], "msg": f"Invalid format {value}, expected one of {formats}", "type": "value_error"}]},
+    )
+
+""" The response header holding the id of the profile of a request """
+PROFILE_HEADER = "X-Sitetack-Profile"
+
+async def start_profile(endpoint: str, query: bool, header: Optional[str], model_keys: List[ModelKey]) -> Optional[ProfileInfo]:
+    """ Creates the profile of a request that asks for one with the profile query parameter or the
+        X-Sitetack-Profile header, if profiling is enabled. The profile is written to disk, and the
+        oldest ones deleted, on a thread of the event loop rather than on the loop itself.
+    """
+    requested = query or (header is not None and header.strip().lower() not in ("", "0", "false", "no", "off"))
+    if not requested:
+        return None
+    models = [":".join(kind.name for kind in model_key) for model_key in model_keys]
+    return await asyncio.get_event_loop().run_in_executor(None, Profiler.shared().start, endpoint, models)
+
+async def run_profiled(profile: Optional[ProfileInfo], func: Callable[..., Any], *args: Any) -> Any:
+    """ Runs a blocking call on the inference executor, profiling it if the request asked for it """
+    if profile is None:
+        return await InferenceExecutor.shared().run(func, *args)
+    return await InferenceExecutor.shared().run(Profiler.shared().call, profile, func, *args)
+
+def iterate_profiled(profile: Optional[ProfileInfo], func: Callable[..., Iterator[Any]], *args: Any) -> AsyncIterator[Any]:
+    """ Consumes a blocking iterable on the inference executor, profiling it if the request asked for it """
+    if profile is None:
+        return InferenceExecutor.shared().iterate(func, *args)
+    return InferenceExecutor.shared().iterate(Profiler.shared().iterate, profile, func, *args)
+
+def with_profile(response: Response, profile: Optional[ProfileInfo]) -> Response:
+    """ Tells the client the id of the profile of its request, if any """
+    if profile is not None:
+        response.headers[PROFILE_HEADER] = profile.profile_id
+    return response
+
+async def busy_profiled_response(profile: Optional[ProfileInfo]) -> Response:
+    """ The busy response of a request, whose profile is finished with an error since its work never started """
+    if profile is not None:
+        await asyncio.get_event_loop().run_in_executor(
+            None, Profiler.shared().abandon, profile, "ExecutorSaturated: the server is busy"
+        )
+    return with_profile(busy_response(), profile)
+
 @app.post("/submit/")
-async def submit_data(request: RequestModel):
+async def submit_data(
+    request: RequestModel, format: str = ResultFormat.JSON.value, profile: bool = False, x_sitetack_profile: str = Header(None)
+):
     # Here you can process the validated data
     ptm = PtmKind[request.ptm]
     organism = OrganismKind[request.organism]
     label = LabelKind[request.label]
     text = request.text
-    sequence_predictions = Predict.on_fasta(text, ptm, organism, label)
-    return sequence_predictions.to_dict()
+    try:
+        result_format = ResultFormat(format)
+    except ValueError:
+        return invalid_format_response(format)
+    request_profile = await start_profile("/submit/", profile, x_sitetack_profile, [(ptm, organism, label)])
+    try:
+        if result_format == ResultFormat.JSON:
+            result = await run_profiled(request_profile, predict_fasta, text, ptm, organism, label)
+            return with_profile(Response(result, media_type=result_format.media_type), request_profile)
+        chunks = iterate_profiled(request_profile, stream_fasta, text, ptm, organism, label, result_format)
+        stream = await started_stream(chunks)
+    except ExecutorSaturated:
+        return await busy_profiled_response(request_profile)
+    except FastaValidationError as e:
+        return with_profile(fasta_error_response(e.errors), request_profile)
+    return with_profile(StreamingResponse(stream, media_type=result_format.media_type), request_profile)
+
+@app.post("/submit/multi/")
+async def submit_data_multi(request: MultiRequestModel, profile: bool = False, x_sitetack_profile: str = Header(None)):
+    # Duplicated models are only scored once
+    model_keys = list(dict.fromkeys(model.key() for model in request.models))
+    request_profile = await start_profile("/submit/multi/", profile, x_sitetack_profile, model_keys)
+    try:
+        result = await run_profiled(request_profile, predict_fasta_multi, request.text, model_keys)
+    except ExecutorSaturated:
+        return await busy_profiled_response(request_profile)
+    except FastaValidationError as e:
+        return with_profile(fasta_error_response(e.errors), request_profile)
+    return result if request_profile is None else with_profile(JSONResponse(content=result), request_profile)
+
+def profile_not_found_response(profile_id: str) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"detail": f"Profile {profile_id} not found"})
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str):
+    """ What a profile covers, how long the request took and the files of the profile """
+    profiler = Profiler.shared()
+    if not profiler.enabled:
+        return profile_not_found_response(profile_id)
+    try:
+        info = profiler.store.info(profile_id)
+    except ProfileNotFound:
+        return profile_not_found_response(profile_id)
+    return {**info.to_dict(), "files": profiler.store.files(profile_id)}
+
+@app.get("/profiles/{profile_id}/download")
+def download_profile(profile_id: str):
+    """ A zip of the files of a profile: profile.pstats for pstats or snakeviz, summary.txt, and
+        the TensorFlow trace under tensorflow/ for TensorBoard
+    """
+    profiler = Profiler.shared()
+    if not profiler.enabled:
+        return profile_not_found_response(profile_id)
+    try:
+        archive = profiler.store.archive(profile_id)
+    except ProfileNotFound:
+        return profile_not_found_response(profile_id)
+    return Response(
+        archive, media_type="application/zip", headers={"Content-Disposition": f'attachment; filename="{profile_id}.zip"'}
+    )
+
+@app.on_event("startup")
+def start_warmup():
+    Warmup.shared().start()
+
+@app.on_event("startup")
+def start_jobs():
+    """ Resume the background jobs left queued by a previous server """
+    JobManager.shared()
+
+@app.get("/health/ready")
+def get_readiness():
+    """ 200 once the selected models are loaded and warmed up, 503 before or if the warm-up failed """
+    status = Warmup.shared().status()
+    return JSONResponse(status_code=200 if status.state == WarmupState.READY else 503, content=status.to_dict())
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    InferenceExecutor.shutdown_shared()
+    JobManager.shutdown_shared()
+    PredictionCache.shutdown_shared()
+    WorkerPool.shutdown_shared()
+
+@app.get("/stats")
+def get_stats():
+    """ The counters of the model registry, of the prediction cache with its hit ratio, of
+        the kmer deduplication with its ratio, of the micro-batching and of the inference
+        processes if any
+    """
+    return {
+        "models": asdict(ModelRegistry.shared().stats()),
+        "predictions": PredictionCache.shared().stats().to_dict(),
+        "kmers": KmerDeduplicator.shared().stats().to_dict(),
+        "batching": MicroBatcher.shared().stats().to_dict(),
+        "workers": asdict(WorkerPool.shared().stats()) if get_settings().inference_processes > 0 else None,
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    """ The stage timings and counters in the Prometheus text format, when SITETACK_METRICS is set.
+        The counters of the caches and the pending inference calls are read at scrape time.
+    """
+    metrics = Metrics.shared()
+    if not metrics.enabled:
+        return JSONResponse(status_code=404, content={"detail": "Metrics are disabled, set SITETACK_METRICS to enable them"})
+    registry = ModelRegistry.shared().stats()
+    predictions = PredictionCache.shared().stats()
+    kmers = KmerDeduplicator.shared().stats()
+    lines = metrics.render()
+    lines += metric_lines(
+        "sitetack_model_cache_requests_total", "counter", "Model lookups in the registry, by result",
+        {("hit",): registry.hits, ("miss",): registry.misses}, ("result",),
+    )
+    lines += metric_lines("sitetack_model_cache_evictions_total", "counter", "Models unloaded to stay within budget", {(): registry.evictions})
+    lines += metric_lines("sitetack_models_resident", "gauge", "Models currently loaded", {(): registry.resident_models})
+    lines += metric_lines(
+        "sitetack_prediction_cache_requests_total", "counter", "Sequence lookups in the prediction cache, by result",
+        {("memory_hit",): predictions.memory_hits, ("disk_hit",): predictions.disk_hits, ("miss",): predictions.misses}, ("result",),
+    )
+    lines += metric_lines("sitetack_kmers_deduplicated_total", "counter", "Kmers not run through a model thanks to deduplication", {(): kmers.kmers - kmers.scored_kmers})
+    lines += metric_lines("sitetack_inference_in_flight", "gauge", "Submissions being scored or waiting for an inference worker", {(): InferenceExecutor.shared().pending})
+    return Response("\n".join(lines) + "\n", media_type=CONTENT_TYPE)
+
+def job_not_found_response(job_id: str) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"detail": f"Job {job_id} not found"})
+
+@app.post("/jobs/")
+def submit_job(request: RequestModel):
+    ptm = PtmKind[request.ptm]
+    organism = OrganismKind[request.organism]
+    label = LabelKind[request.label]
+    alphabet = Model.get_alphabet(ptm, organism, label)
+    errors = Fasta.find_errors(request.text, alphabet, max_errors=MAX_REPORTED_ERRORS)
+    if errors:
+        return fasta_error_response(errors)
+    status = JobManager.shared().submit(request.text, ptm, organism, label)
+    return status.to_dict()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    try:
+        return JobManager.shared().store.status(job_id).to_dict()
+    except JobNotFound:
+        return job_not_found_response(job_id)
+
+@app.get("/jobs/{job_id}/results")
+def get_job_results(job_id: str, offset: int = 0, limit: int = 100):
+    limit = max(0, min(limit, 1000))
+    try:
+        sequence_predictions = JobManager.shared().store.read_results(job_id, offset=max(0, offset), limit=limit)
+    except JobNotFound:
+        return job_not_found_response(job_id)
+    return {"offset": offset, "limit": limit, "sequence_predictions": sequence_predictions}
+
+@app.get("/jobs/{job_id}/download")
+def download_job_results(job_id: str):
+    store = JobManager.shared().store
+    try:
+        store.status(job_id)
+    except JobNotFound:
+        return job_not_found_response(job_id)
+    return FileResponse(str(store.results_file(job_id)), media_type="application/x-ndjson", filename=f"{job_id}.ndjson")
 
 @app.get("/")
 async def get_form():
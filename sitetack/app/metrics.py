@@ -0,0 +1,207 @@
+""" Timings and counters of the prediction stages, exposed in the Prometheus text format on /metrics """
+
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from sitetack.app.settings import get_settings
+
+T = TypeVar("T")
+
+""" The upper bounds in seconds of the buckets of the stage histograms """
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+""" The media type of the Prometheus text exposition format """
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def metric_lines(name: str, kind: str, help: str, samples: Dict[Tuple[str, ...], float], label_names: Sequence[str] = ()) -> List[str]:
+    """ Render a counter or gauge whose values are read at scrape time.
+
+        Parameters:
+            name: The name of the metric, e.g. 'sitetack_model_cache_hits_total'
+            kind: 'counter' or 'gauge'
+            help: The description of the metric
+            samples: The value of each combination of label values, keyed by () without labels
+            label_names: The names of the labels
+    """
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(label_names, values)} {_number(value)}" for values, value in samples.items())
+    return lines
+
+
+class Counter:
+    """ A monotonically increasing count for each combination of label values """
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            samples = dict(self._values)
+        return metric_lines(self.name, "counter", self.help, samples, self.label_names)
+
+
+class Histogram:
+    """ The distribution of observed values in cumulative buckets, for each combination of label values """
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._lock = threading.Lock()
+        # The count of each bucket, not cumulative, then the sum of the values
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._series.setdefault(label_values, ([0] * len(self.buckets), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            series = self._series.get(label_values)
+            return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {values: (list(counts), total[0]) for values, (counts, total) in self._series.items()}
+        for values, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """ The stage timings and scoring counters of the process. When disabled, stage() returns a
+        shared no-op context manager and the counting methods return at once, so instrumented
+        code pays for a method call and a flag check.
+    """
+
+    _shared: Optional["Metrics"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, enabled: bool = True):
+        """
+        Parameters:
+            enabled: Whether to record anything
+        """
+        self.enabled = enabled
+        self.stage_seconds = Histogram(
+            "sitetack_stage_seconds", "Seconds spent in each stage of a prediction, by model where it applies", ("stage", "model")
+        )
+        self.sequences = Counter("sitetack_sequences_scored_total", "Sequences scored, by model", ("model",))
+        self.sites = Counter("sitetack_sites_scored_total", "Sites submitted to model calls, by model", ("model",))
+        self._names: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+        self._names_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> "Metrics":
+        """ Get the metrics of the whole process, enabled by the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(enabled=get_settings().metrics_enabled)
+            return cls._shared
+
+    def name_model(self, model: Any, name: str):
+        """ Record the name a loaded model is labelled with, such as 'PHOSPHORYLATION_ST:HUMAN:NO_LABELS' """
+        if not self.enabled:
+            return
+        with self._names_lock:
+            try:
+                self._names[model] = name
+            except TypeError:
+                pass
+
+    def model_name(self, model: Any) -> str:
+        with self._names_lock:
+            try:
+                return self._names.get(model, "unknown")
+            except TypeError:
+                return "unknown"
+
+    def stage(self, stage: str, model: Any = None, name: str = ""):
+        """ Time a block as a stage, labelled with the name of a model object or with a name """
+        if not self.enabled:
+            return _NOOP
+        return self._timed(stage, name or (self.model_name(model) if model is not None else ""))
+
+    @contextmanager
+    def _timed(self, stage: str, model_name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage, model_name)
+
+    def count_sites(self, model: Any, sites: int):
+        if self.enabled:
+            self.sites.inc(sites, self.model_name(model))
+
+    def count_sequences(self, predictions: Iterable[T], *models: Any) -> Iterator[T]:
+        """ Count the sequences of a stream of predictions for each model scoring them, as they
+            are consumed, returning an iterator of the stream itself when disabled
+        """
+        if not self.enabled:
+            return iter(predictions)
+        return self._counted(predictions, [self.model_name(model) for model in models])
+
+    def _counted(self, predictions: Iterable[T], model_names: List[str]) -> Iterator[T]:
+        for prediction in predictions:
+            for model_name in model_names:
+                self.sequences.inc(1, model_name)
+            yield prediction
+
+    def render(self) -> List[str]:
+        return self.stage_seconds.render() + self.sequences.render() + self.sites.render()
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP = _NoopStage()
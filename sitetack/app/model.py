@@ -2,14 +2,201 @@
 
 from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
 from sitetack.app.alphabet import Alphabet
+from sitetack.app.settings import get_settings
+from dataclasses import dataclass
+from itertools import product
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import importlib.util
-import pandas
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+ModelKey = Tuple[PtmKind, OrganismKind, LabelKind]
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    """ The alphabet and h5 file of the model for a PTM, organism and label """
+    ptm: PtmKind
+    organism: OrganismKind
+    label: LabelKind
+    alphabet: Alphabet
+    h5_file: Path
+
+
+class ModelIndex:
+    """ In-memory index of master_info.xlsx and the h5 files, so that lookups are dictionary hits.
+
+        The index is compiled once from the master file and cached to a JSON sidecar file,
+        which is rebuilt when the master file changes or an h5 file is added, renamed or removed.
+    """
+
+    SIDECAR_VERSION = 2
+
+    def __init__(self, alphabets: Dict[ModelKey, Alphabet], h5_files: Dict[ModelKey, Path]):
+        """
+        Parameters:
+            alphabets: The alphabet of each PTM, organism and label found in the master file
+            h5_files: The h5 file of each PTM, organism and label found in the models directory
+        """
+        self._alphabets = alphabets
+        self._h5_files = h5_files
+
+    def get_alphabet(self, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> Alphabet:
+        """ Get the alphabet for a given PTM, organism and label """
+        try:
+            return self._alphabets[(ptm, organism, label)]
+        except KeyError:
+            raise RuntimeError(f"Expected one row for {ptm}, {organism}, {label} but got none or several")
+
+    def get_h5_file(self, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> Path:
+        """ Get the h5 file for a given PTM, organism and label """
+        try:
+            return self._h5_files[(ptm, organism, label)]
+        except KeyError:
+            raise FileNotFoundError(f"No h5 file found for {ptm}, {organism}, {label}")
+
+    def keys(self) -> List[ModelKey]:
+        """ The PTM, organism and label of every model with both an alphabet and an h5 file """
+        return [key for key in product(PtmKind, OrganismKind, LabelKind) if key in self._alphabets and key in self._h5_files]
+
+    def get(self, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> ModelInfo:
+        """ Get the alphabet and h5 file for a given PTM, organism and label """
+        return ModelInfo(
+            ptm=ptm,
+            organism=organism,
+            label=label,
+            alphabet=self.get_alphabet(ptm, organism, label),
+            h5_file=self.get_h5_file(ptm, organism, label),
+        )
+
+    @staticmethod
+    def find_h5_file(model_directory: Path, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> Optional[Path]:
+        """ Search the models directory for the h5 file of a PTM, organism and label """
+        organism_directory = model_directory / ptm.value.directory_name / organism.value.directory_name
+        label_query = label.value.filename_query
+        for h5_file in sorted(organism_directory.glob("*.h5")):
+            if label_query in h5_file.name:
+                return h5_file
+        return None
+
+    @staticmethod
+    def list_h5_files(model_directory: Path) -> List[str]:
+        """ The paths of every h5 file of the models directory, relative to it and sorted """
+        return sorted(h5_file.relative_to(model_directory).as_posix() for h5_file in model_directory.rglob("*.h5"))
+
+    @classmethod
+    def build(cls, master_file: Path, model_directory: Path) -> "ModelIndex":
+        """ Compile the index by parsing the master file and searching the models directory.
+
+            Parameters:
+                master_file (Path): The master_info.xlsx file
+                model_directory (Path): The directory containing the ptm directories
+        """
+        import pandas  # only needed when the sidecar file is missing or stale
+
+        df = pandas.read_excel(master_file)
+        dataset_df = df[df["Dataset"] == "Musite Deep"]
+        alphabets: Dict[ModelKey, Alphabet] = {}
+        h5_files: Dict[ModelKey, Path] = {}
+        for ptm, organism, label in product(PtmKind, OrganismKind, LabelKind):
+            key = (ptm, organism, label)
+            h5_file = cls.find_h5_file(model_directory, ptm, organism, label)
+            if h5_file is not None:
+                h5_files[key] = h5_file
+
+            organism_df = dataset_df[
+                (dataset_df["PTM"] == ptm.value.directory_name)
+                & (dataset_df["Organism"] == organism.value.directory_name)
+            ]
+            if len(organism_df) != 1:
+                continue
+            column = "Alphabet no labels" if label == LabelKind.NO_LABELS else "Alphabet labels"
+            alphabets[key] = Alphabet(str=organism_df[column].values[0])
+        return cls(alphabets, h5_files)
+
+    def to_json(self, master_file: Path, model_directory: Path) -> dict:
+        """ Serialize the index for the sidecar file, recording the state of the master file and
+            the h5 files of the models directory
+        """
+        stat = master_file.stat()
+        return {
+            "version": self.SIDECAR_VERSION,
+            "master_file": {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size},
+            "model_files": self.list_h5_files(model_directory),
+            "alphabets": [
+                [ptm.name, organism.name, label.name, alphabet.str]
+                for (ptm, organism, label), alphabet in self._alphabets.items()
+            ],
+            "h5_files": [
+                [ptm.name, organism.name, label.name, h5_file.relative_to(model_directory).as_posix()]
+                for (ptm, organism, label), h5_file in self._h5_files.items()
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data: dict, master_file: Path, model_directory: Path) -> Optional["ModelIndex"]:
+        """ Deserialize a sidecar file, or return None if it is stale """
+        stat = master_file.stat()
+        if data.get("version") != cls.SIDECAR_VERSION:
+            return None
+        if data.get("master_file") != {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}:
+            return None
+        if data.get("model_files") != cls.list_h5_files(model_directory):
+            return None
+        alphabets = {
+            (PtmKind[ptm], OrganismKind[organism], LabelKind[label]): Alphabet(str=alphabet)
+            for ptm, organism, label, alphabet in data["alphabets"]
+        }
+        h5_files = {
+            (PtmKind[ptm], OrganismKind[organism], LabelKind[label]): model_directory / h5_file
+            for ptm, organism, label, h5_file in data["h5_files"]
+        }
+        if not all(h5_file.is_file() for h5_file in h5_files.values()):
+            return None
+        return cls(alphabets, h5_files)
+
+    @classmethod
+    def load(cls, master_file: Path, model_directory: Path, sidecar_file: Optional[Path] = None) -> "ModelIndex":
+        """ Load the index from the sidecar file if it is up to date, otherwise build it and
+            write the sidecar file.
+
+            Parameters:
+                master_file (Path): The master_info.xlsx file
+                model_directory (Path): The directory containing the ptm directories
+                sidecar_file (Path): The JSON file caching the index, or None to always build it
+        """
+        if sidecar_file is not None and sidecar_file.is_file():
+            try:
+                index = cls.from_json(json.loads(sidecar_file.read_text()), master_file, model_directory)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning("Ignoring unreadable model index %s: %s", sidecar_file, e)
+                index = None
+            if index is not None:
+                return index
+
+        index = cls.build(master_file, model_directory)
+        if sidecar_file is not None:
+            try:
+                sidecar_file.parent.mkdir(parents=True, exist_ok=True)
+                temporary_file = sidecar_file.with_name(f"{sidecar_file.name}.{os.getpid()}.tmp")
+                temporary_file.write_text(json.dumps(index.to_json(master_file, model_directory)))
+                temporary_file.replace(sidecar_file)
+            except OSError as e:
+                logger.warning("Could not write model index %s: %s", sidecar_file, e)
+        return index
 
 
 class Model:
     """ Given a set of PTM, organism and label, this class represents a model """
 
+    _index: Optional[ModelIndex] = None
+    _index_lock = threading.Lock()
+
     def __init__(self, ptm: PtmKind, organism: OrganismKind, label: LabelKind):
         """
         Given a ptm choice, an organism choice and a label choice, this class will load
@@ -34,6 +221,11 @@ class Model:
         """ Get the path to the master file, which contains ptm, organism and label, and alphabet information."""
         return cls.model_directory_path() / "master_info.xlsx"
 
+    @classmethod
+    def index_file_path(cls) -> Path:
+        """ Get the path to the sidecar file caching the model index."""
+        return Path(get_settings().cache_dir) / "model_index.json"
+
     @staticmethod
     def get_directory_from_module(module: str) -> Path:
         """ Get the directory of a module.
@@ -48,6 +240,16 @@ class Model:
             return Path(spec.origin).parent
         raise ValueError(f"Module {module} not found")
 
+    @classmethod
+    def index(cls) -> ModelIndex:
+        """ Get the model index, loaded once per process """
+        with cls._index_lock:
+            if cls._index is None:
+                cls._index = ModelIndex.load(
+                    cls.master_file_path(), cls.model_directory_path(), cls.index_file_path()
+                )
+            return cls._index
+
     @classmethod
     def get_h5_file(
         cls, ptm: PtmKind, organism: OrganismKind, label: LabelKind
@@ -57,19 +259,9 @@ class Model:
             Parameters:
                 ptm (PtmKind): The PTM to use
                 organism (OrganismKind): The organism to use
-                label (LabelKind): The label to use        
+                label (LabelKind): The label to use
         """
-        ptm_directory_name = ptm.value.directory_name
-        organism_directory_name = organism.value.directory_name
-        organism_directory = (
-            cls.model_directory_path() / ptm_directory_name / organism_directory_name
-        )
-        h5_files = list(organism_directory.glob("*.h5"))
-        label_query = label.value.filename_query
-        for h5_file in h5_files:
-            if label_query in h5_file.name:
-                return h5_file
-        raise FileNotFoundError(f"No h5 file found for {ptm}, {organism}, {label}")
+        return cls.index().get_h5_file(ptm, organism, label)
 
     @classmethod
     def get_alphabet(
@@ -84,22 +276,4 @@ class Model:
             Returns:
                 Alphabet: The alphabet for the given PTM, organism and label
         """
-        df = pandas.read_excel(cls.master_file_path())
-        dataset_df = df[df["Dataset"] == "Musite Deep"]
-        ptm_df = dataset_df[dataset_df["PTM"] == ptm.value.directory_name]
-        organism_df = ptm_df[ptm_df["Organism"] == organism.value.directory_name]
-
-        # organism_df should have only one row
-        if len(organism_df) != 1:
-            raise RuntimeError(
-                f"Expected one row for {ptm}, {organism}, {label} but got {len(organism_df)}"
-            )
-
-        if label == LabelKind.NO_LABELS:
-            alphabet = organism_df["Alphabet no labels"].values[0]
-        elif label == LabelKind.WITH_LABELS:
-            alphabet = organism_df["Alphabet labels"].values[0]
-        else:
-            raise ValueError(f"Unknown label {label}")
-
-        return Alphabet(str=alphabet)
+        return cls.index().get_alphabet(ptm, organism, label)
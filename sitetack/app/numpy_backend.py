@@ -0,0 +1,322 @@
+""" Runs the embedding + CNN models of the h5 files with NumPy alone, without TensorFlow """
+
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from sitetack.app.backends import InferenceBackend, predict_in_batches
+
+Layer = Callable[[np.ndarray], np.ndarray]
+
+
+class UnsupportedModel(ValueError):
+    """ Raised for h5 files using layers or options the NumPy engine does not implement """
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # Same as 1 / (1 + exp(-x)), without overflowing for large negative inputs
+    return np.exp(-np.logaddexp(0, -x))
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    exponentials = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exponentials / exponentials.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS: Dict[str, Layer] = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": _sigmoid,
+    "tanh": np.tanh,
+    "softmax": _softmax,
+}
+
+
+def _activation(config: dict) -> Layer:
+    name = config.get("activation") or "linear"
+    if name not in ACTIVATIONS:
+        raise UnsupportedModel(f"Unsupported activation {name!r}")
+    return ACTIVATIONS[name]
+
+
+def _apply_in_place(function: Layer, x: np.ndarray) -> np.ndarray:
+    """ Apply an activation to an array owned by the layer, sparing relu a copy of it """
+    if function is ACTIVATIONS["relu"]:
+        return np.maximum(x, 0, out=x)
+    return function(x)
+
+
+def _pair(value: Any) -> Tuple[int, int]:
+    return (value, value) if isinstance(value, int) else tuple(value)
+
+
+def _same_padding(size: int, kernel: int, stride: int) -> Tuple[int, int]:
+    """ The padding before and after an axis for 'same' padding, as TensorFlow computes it """
+    total = max((-(-size // stride) - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _windows(x: np.ndarray, kernel: Tuple[int, int], strides: Tuple[int, int]) -> np.ndarray:
+    """ View a (batch, height, width, channels) array as its (batch, out height, out width, kernel
+        height, kernel width, channels) windows, without copying
+    """
+    batch, height, width, channels = x.shape
+    out_height = (height - kernel[0]) // strides[0] + 1
+    out_width = (width - kernel[1]) // strides[1] + 1
+    s0, s1, s2, s3 = x.strides
+    return as_strided(
+        x,
+        shape=(batch, out_height, out_width, kernel[0], kernel[1], channels),
+        strides=(s0, s1 * strides[0], s2 * strides[1], s1, s2, s3),
+        writeable=False,
+    )
+
+
+def _pad(x: np.ndarray, kernel: Tuple[int, int], strides: Tuple[int, int], value: float) -> np.ndarray:
+    padding = [(0, 0)] + [_same_padding(x.shape[axis + 1], kernel[axis], strides[axis]) for axis in range(2)] + [(0, 0)]
+    return np.pad(x, padding, constant_values=value)
+
+
+def _check_channels_last(config: dict):
+    if config.get("data_format", "channels_last") != "channels_last":
+        raise UnsupportedModel("Only channels_last data is supported")
+
+
+def _same_padding_of(config: dict) -> bool:
+    """ Whether a layer pads its input the way of "same" padding, rather than not at all """
+    padding = config.get("padding", "valid")
+    if padding not in ("same", "valid"):
+        raise UnsupportedModel(f"Unsupported padding {padding!r}, only 'same' and 'valid' are supported")
+    return padding == "same"
+
+
+def embedding(config: dict, weights: List[np.ndarray]) -> Layer:
+    (table,) = weights
+
+    def call(x: np.ndarray) -> np.ndarray:
+        # Keras casts the encoded kmers to integers before the lookup
+        return table[x.astype(np.int64)]
+
+    return call
+
+
+def reshape(config: dict, weights: List[np.ndarray]) -> Layer:
+    target_shape = tuple(config["target_shape"])
+    return lambda x: x.reshape((len(x),) + target_shape)
+
+
+def flatten(config: dict, weights: List[np.ndarray]) -> Layer:
+    _check_channels_last(config)
+    return lambda x: x.reshape(len(x), -1)
+
+
+def identity(config: dict, weights: List[np.ndarray]) -> Layer:
+    return lambda x: x
+
+
+def activation(config: dict, weights: List[np.ndarray]) -> Layer:
+    return _activation(config)
+
+
+def dense(config: dict, weights: List[np.ndarray]) -> Layer:
+    kernel = weights[0]
+    bias = weights[1] if config.get("use_bias", True) else np.zeros(kernel.shape[-1], dtype=np.float32)
+    function = _activation(config)
+
+    def call(x: np.ndarray) -> np.ndarray:
+        y = x @ kernel
+        y += bias
+        return _apply_in_place(function, y)
+
+    return call
+
+
+def conv2d(config: dict, weights: List[np.ndarray]) -> Layer:
+    _check_channels_last(config)
+    if _pair(config.get("dilation_rate", 1)) != (1, 1) or config.get("groups", 1) != 1:
+        raise UnsupportedModel("Only undilated, ungrouped convolutions are supported")
+    kernel = weights[0]
+    bias = weights[1] if config.get("use_bias", True) else np.zeros(kernel.shape[-1], dtype=np.float32)
+    kernel_size = kernel.shape[:2]
+    strides = _pair(config.get("strides", 1))
+    same = _same_padding_of(config)
+    function = _activation(config)
+
+    matrix = kernel.reshape(-1, kernel.shape[-1])
+
+    def call(x: np.ndarray) -> np.ndarray:
+        if same:
+            x = _pad(x, kernel_size, strides, 0.0)
+        windows = _windows(np.ascontiguousarray(x), kernel_size, strides)
+        # A single matrix product of the copied windows with the kernel, as Keras does on CPU
+        y = windows.reshape(-1, matrix.shape[0]) @ matrix
+        y += bias
+        return _apply_in_place(function, y).reshape(windows.shape[:3] + (matrix.shape[1],))
+
+    return call
+
+
+def conv1d(config: dict, weights: List[np.ndarray]) -> Layer:
+    """ A Conv1D over (batch, steps, channels), run as a Conv2D over (batch, steps, 1, channels) """
+    config = {**config, "strides": (_pair(config.get("strides", 1))[0], 1), "dilation_rate": _pair(config.get("dilation_rate", 1))[0]}
+    call2d = conv2d(config, [weights[0][:, None]] + weights[1:])
+    return lambda x: call2d(x[:, :, None])[:, :, 0]
+
+
+def max_pooling2d(config: dict, weights: List[np.ndarray]) -> Layer:
+    _check_channels_last(config)
+    pool_size = _pair(config.get("pool_size", 2))
+    strides = _pair(config.get("strides") or pool_size)
+    same = _same_padding_of(config)
+
+    def call(x: np.ndarray) -> np.ndarray:
+        if same:
+            x = _pad(x, pool_size, strides, -np.inf)
+        out_height = (x.shape[1] - pool_size[0]) // strides[0] + 1
+        out_width = (x.shape[2] - pool_size[1]) // strides[1] + 1
+        # The maximum of the strided slices at each offset of the pool, faster than reducing windows
+        def part(i: int, j: int) -> np.ndarray:
+            return x[:, i:i + (out_height - 1) * strides[0] + 1:strides[0], j:j + (out_width - 1) * strides[1] + 1:strides[1]]
+
+        result = part(0, 0).copy()
+        for i in range(pool_size[0]):
+            for j in range(pool_size[1]):
+                if i or j:
+                    np.maximum(result, part(i, j), out=result)
+        return result
+
+    return call
+
+
+def max_pooling1d(config: dict, weights: List[np.ndarray]) -> Layer:
+    pool_size = _pair(config.get("pool_size", 2))[0]
+    strides = _pair(config.get("strides") or pool_size)[0]
+    call2d = max_pooling2d({**config, "pool_size": (pool_size, 1), "strides": (strides, 1)}, weights)
+    return lambda x: call2d(x[:, :, None])[:, :, 0]
+
+
+def _check_reduces_steps(config: dict):
+    _check_channels_last(config)
+    if config.get("keepdims", False):
+        raise UnsupportedModel("Only global poolings dropping the steps axis are supported")
+
+
+def global_max_pooling1d(config: dict, weights: List[np.ndarray]) -> Layer:
+    _check_reduces_steps(config)
+    return lambda x: x.max(axis=1)
+
+
+def global_average_pooling1d(config: dict, weights: List[np.ndarray]) -> Layer:
+    _check_reduces_steps(config)
+    return lambda x: x.mean(axis=1)
+
+
+""" Builds each supported Keras layer from its config and weights """
+LAYER_BUILDERS: Dict[str, Callable[[dict, List[np.ndarray]], Layer]] = {
+    "InputLayer": identity,
+    "Dropout": identity,
+    "Embedding": embedding,
+    "Reshape": reshape,
+    "Flatten": flatten,
+    "Activation": activation,
+    "Dense": dense,
+    "Conv1D": conv1d,
+    "Conv2D": conv2d,
+    "MaxPooling1D": max_pooling1d,
+    "MaxPooling2D": max_pooling2d,
+    "GlobalMaxPooling1D": global_max_pooling1d,
+    "GlobalAveragePooling1D": global_average_pooling1d,
+}
+
+
+def _text(value: Any) -> str:
+    return value.decode("utf8") if isinstance(value, bytes) else str(value)
+
+
+def _inbound_layers(value: Any) -> List[str]:
+    """ The names of the layers feeding the inbound nodes of a layer config, written by Keras 2 as
+        [layer, node, tensor, kwargs] lists and by Keras 3 as keras tensors in the call arguments
+    """
+    if isinstance(value, dict):
+        if value.get("class_name") == "__keras_tensor__":
+            return [value["config"]["keras_history"][0]]
+        return [name for item in value.values() for name in _inbound_layers(item)]
+    if isinstance(value, list):
+        if len(value) >= 3 and isinstance(value[0], str) and isinstance(value[1], int):
+            return [value[0]]
+        return [name for item in value for name in _inbound_layers(item)]
+    return []
+
+
+class NumpyModel:
+    """ A stack of layers read from an h5 file and run in float32 NumPy. Offers predict and
+        predict_on_batch like a Keras model, so the registry can serve it in place of one.
+    """
+
+    inference_backend = InferenceBackend.NUMPY
+    quantized = False
+
+    def __init__(self, layers: Sequence[Layer]):
+        """
+        Parameters:
+            layers: The layers applied in order to a batch of encoded kmers
+        """
+        self.layers = list(layers)
+
+    @classmethod
+    def from_h5(cls, h5_file: Path) -> "NumpyModel":
+        """ Read the layers of a Sequential model, or a Functional model whose layers form a chain,
+            from the config and weights of a Keras h5 file.
+
+            Raises:
+                UnsupportedModel: When the model uses a layer or option that is not implemented
+        """
+        import h5py  # only needed by this backend
+
+        with h5py.File(str(h5_file), "r") as f:
+            if "model_config" not in f.attrs:
+                raise UnsupportedModel(f"{h5_file} holds weights only, without a model config")
+            model_config = json.loads(_text(f.attrs["model_config"]))
+            config = model_config["config"]
+            layer_configs = config["layers"] if isinstance(config, dict) else config
+            weights_group = f["model_weights"] if "model_weights" in f else f
+            layers = []
+            previous_name = None
+            for layer_config in layer_configs:
+                class_name = layer_config["class_name"]
+                if class_name not in LAYER_BUILDERS:
+                    raise UnsupportedModel(f"Unsupported layer {class_name} in {h5_file}")
+                name = layer_config.get("name") or layer_config["config"].get("name")
+                inbound_nodes = layer_config.get("inbound_nodes") or []
+                if len(inbound_nodes) > 1:
+                    raise UnsupportedModel(f"Layer {name} is shared, only chains of layers are supported")
+                # Sequential configs list no inbound nodes, the layers of a Functional one must each take the previous one
+                inbound_layers = _inbound_layers(inbound_nodes)
+                if inbound_layers and inbound_layers != [previous_name]:
+                    raise UnsupportedModel(f"Layer {name} does not take the output of the layer before it, only chains of layers are supported")
+                previous_name = name
+                layers.append(LAYER_BUILDERS[class_name](layer_config["config"], cls._read_weights(weights_group, layer_config)))
+        return cls(layers)
+
+    @staticmethod
+    def _read_weights(weights_group: Any, layer_config: dict) -> List[np.ndarray]:
+        name = layer_config["config"].get("name", "")
+        if name not in weights_group:
+            return []
+        group = weights_group[name]
+        return [
+            np.asarray(group[_text(weight_name)], dtype=np.float32)
+            for weight_name in group.attrs.get("weight_names", [])
+        ]
+
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        x = np.asarray(tensor)
+        for layer in self.layers:
+            x = layer(x)
+        return x.astype(np.float32, copy=False)
+
+    def predict(self, tensor: np.ndarray) -> np.ndarray:
+        return predict_in_batches(self.predict_on_batch, tensor)
@@ -1,13 +1,21 @@
+import typing
 import numpy as np
-from typing import List
-import tensorflow as tf
-from dataclasses import dataclass, asdict
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union, overload
+from dataclasses import dataclass
 
 from sitetack.app.alphabet import Alphabet
+from sitetack.app.backends import loaded_backend
+from sitetack.app.cache import ModelPredictionCache, PredictionCache
+from sitetack.app.dedup import KmerDeduplicator
+from sitetack.app.encoding import KmerEncoder
 from sitetack.app.kmer import Kmer
+from sitetack.app.metrics import Metrics
 from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
-from sitetack.app.model import Model
+from sitetack.app.model import Model, ModelKey
 from sitetack.app.fasta import Fasta
+from sitetack.app.registry import ModelRegistry
+from sitetack.app.sequence import Sequence
 
 @dataclass(frozen=True)
 class SitePrediction:
@@ -16,23 +24,289 @@ class SitePrediction:
     amino_acid: str
     probability: float
 
+    def to_dict(self) -> dict:
+        return {"site": self.site, "amino_acid": self.amino_acid, "probability": self.probability}
+
+
+class SitePredictions(typing.Sequence[SitePrediction]):
+    """ The predictions for the sites of a sequence, held as arrays of the sites, of their amino
+        acids and of their probabilities. A SitePrediction is only created when it is accessed, so
+        that a site takes 9 to 13 bytes instead of an object of a few hundred bytes. Compares equal
+        to a list of the same SitePredictions.
+    """
+
+    __slots__ = ("sites", "residues", "probabilities")
+
+    def __init__(self, sites: np.ndarray, residues: np.ndarray, probabilities: np.ndarray):
+        """
+        Parameters:
+            sites: The 1-indexed sites, as int32
+            residues: The amino acid of each site, as ASCII codes
+            probabilities: The probability of each site, as float32 when scored by a model
+        """
+        if not len(sites) == len(residues) == len(probabilities):
+            raise ValueError(f"Got {len(sites)} sites, {len(residues)} residues and {len(probabilities)} probabilities")
+        self.sites = sites
+        self.residues = residues
+        self.probabilities = probabilities
+
+    @staticmethod
+    def of_sequence(sequence: str, sites: np.ndarray, probabilities: Union[np.ndarray, List[float]]) -> "SitePredictions":
+        """ Pairs each site of a sequence with its amino acid and the probability scored by a model,
+            which is float32 and kept as such
+        """
+        sites = np.asarray(sites, dtype=np.int32)
+        sequence_bytes = np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)
+        return SitePredictions(sites, sequence_bytes[sites - 1], np.asarray(probabilities, dtype=np.float32))
+
+    @staticmethod
+    def from_list(site_predictions: Iterable[SitePrediction]) -> "SitePredictions":
+        """ Holds SitePredictions as arrays, keeping their probabilities as float64 so that they are unchanged """
+        if isinstance(site_predictions, SitePredictions):
+            return site_predictions
+        site_predictions = list(site_predictions)
+        return SitePredictions(
+            np.array([site.site for site in site_predictions], dtype=np.int32),
+            np.frombuffer("".join(site.amino_acid for site in site_predictions).encode("ascii"), dtype=np.uint8),
+            np.array([site.probability for site in site_predictions], dtype=np.float64),
+        )
+
+    def amino_acids(self) -> str:
+        """ The amino acids of the sites, one character each """
+        return self.residues.tobytes().decode("ascii")
+
+    def __len__(self) -> int:
+        return len(self.sites)
+
+    @overload
+    def __getitem__(self, index: int) -> SitePrediction: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "SitePredictions": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[SitePrediction, "SitePredictions"]:
+        if isinstance(index, slice):
+            return SitePredictions(self.sites[index], self.residues[index], self.probabilities[index])
+        return SitePrediction(int(self.sites[index]), chr(self.residues[index]), float(self.probabilities[index]))
+
+    def __iter__(self) -> Iterator[SitePrediction]:
+        for site, amino_acid, probability in zip(self.sites.tolist(), self.amino_acids(), self.probabilities.tolist()):
+            yield SitePrediction(site, amino_acid, probability)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SitePredictions):
+            return (
+                np.array_equal(self.sites, other.sites)
+                and np.array_equal(self.residues, other.residues)
+                and np.array_equal(self.probabilities, other.probabilities)
+            )
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"SitePredictions({list(self)!r})"
+
+    def to_dicts(self) -> List[dict]:
+        """ Same as the dicts of dataclasses.asdict, without creating the SitePredictions """
+        return [
+            {"site": site, "amino_acid": amino_acid, "probability": probability}
+            for site, amino_acid, probability in zip(self.sites.tolist(), self.amino_acids(), self.probabilities.tolist())
+        ]
+
+
+def site_predictions_to_dicts(site_predictions: typing.Sequence[SitePrediction]) -> List[dict]:
+    """ The dicts of a list of SitePredictions or of a SitePredictions """
+    if isinstance(site_predictions, SitePredictions):
+        return site_predictions.to_dicts()
+    return [site.to_dict() for site in site_predictions]
+
+
 @dataclass(frozen=True)
 class SequencePrediction:
     """ Contains the predictions for a sequence """
     sequence_name: str
     sequence: str
-    site_predictions: List[SitePrediction]
+    site_predictions: typing.Sequence[SitePrediction]
+
+    def to_dict(self) -> dict:
+        """ Same as dataclasses.asdict, without its recursive deep copy """
+        return {
+            "sequence_name": self.sequence_name,
+            "sequence": self.sequence,
+            "site_predictions": site_predictions_to_dicts(self.site_predictions),
+        }
+
+
+class PredictionColumns(typing.Sequence[SequencePrediction]):
+    """ The predictions for many sequences as flat arrays of the sites of all of them, the sites of
+        sequence i being those from offsets[i] to offsets[i + 1]. Indexing returns a SequencePrediction
+        whose SitePredictions are views of the arrays.
+    """
+
+    def __init__(
+        self,
+        sequence_names: List[str],
+        sequences: List[str],
+        offsets: np.ndarray,
+        site_predictions: SitePredictions,
+    ):
+        """
+        Parameters:
+            sequence_names: The name of each sequence
+            sequences: The residues of each sequence
+            offsets: The len(sequences) + 1 offsets of the sites of each sequence in site_predictions
+            site_predictions: The sites of every sequence, one after the other
+        """
+        if not len(sequence_names) == len(sequences) == len(offsets) - 1:
+            raise ValueError(f"Got {len(sequence_names)} names, {len(sequences)} sequences and {len(offsets)} offsets")
+        self.sequence_names = sequence_names
+        self.sequences = sequences
+        self.offsets = offsets
+        self.site_predictions = site_predictions
+
+    @staticmethod
+    def from_predictions(sequence_predictions: Iterable[SequencePrediction]) -> "PredictionColumns":
+        """ Gathers a stream of SequencePredictions into columns, consuming it """
+        sequence_names: List[str] = []
+        sequences: List[str] = []
+        parts: List[SitePredictions] = []
+        for sequence_prediction in sequence_predictions:
+            sequence_names.append(sequence_prediction.sequence_name)
+            sequences.append(sequence_prediction.sequence)
+            parts.append(SitePredictions.from_list(sequence_prediction.site_predictions))
+        offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(part) for part in parts], out=offsets[1:])
+        if not parts:
+            site_predictions = SitePredictions(
+                np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.float32)
+            )
+        else:
+            site_predictions = SitePredictions(
+                np.concatenate([part.sites for part in parts]),
+                np.concatenate([part.residues for part in parts]),
+                np.concatenate([part.probabilities for part in parts]),
+            )
+        return PredictionColumns(sequence_names, sequences, offsets, site_predictions)
+
+    def __len__(self) -> int:
+        return len(self.sequences)
+
+    @overload
+    def __getitem__(self, index: int) -> SequencePrediction: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[SequencePrediction]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[SequencePrediction, List[SequencePrediction]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PredictionColumns index out of range")
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return SequencePrediction(self.sequence_names[index], self.sequences[index], self.site_predictions[start:end])
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PredictionColumns, list, tuple)):
+            return len(self) == len(other) and all(mine == theirs for mine, theirs in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"PredictionColumns({list(self)!r})"
+
+    def site_counts(self) -> np.ndarray:
+        """ The number of sites of each sequence """
+        return np.diff(self.offsets)
+
 
 @dataclass(frozen=True)
 class SequencePredictions:
-    """ Contains the predictions for a list of sequences """
-    sequence_predictions: List[SequencePrediction]
+    """ Contains the predictions for a list of sequences, which can be PredictionColumns """
+    sequence_predictions: typing.Sequence[SequencePrediction]
+
+    def to_dict(self) -> dict:
+        """ Same as dataclasses.asdict, without its recursive deep copy """
+        return {"sequence_predictions": [sequence_prediction.to_dict() for sequence_prediction in self.sequence_predictions]}
+
 
+@dataclass(frozen=True)
+class ModelPrediction:
+    """ Contains the predictions of one model for a sequence """
+    ptm: str
+    organism: str
+    label: str
+    site_predictions: typing.Sequence[SitePrediction]
 
-    def to_dict(self):
-       return asdict(self)
-       
+    def to_dict(self) -> dict:
+        return {
+            "ptm": self.ptm,
+            "organism": self.organism,
+            "label": self.label,
+            "site_predictions": site_predictions_to_dicts(self.site_predictions),
+        }
 
+@dataclass(frozen=True)
+class MultiSequencePrediction:
+    """ Contains the predictions of several models for a sequence """
+    sequence_name: str
+    sequence: str
+    model_predictions: List[ModelPrediction]
+
+    def to_dict(self) -> dict:
+        return {
+            "sequence_name": self.sequence_name,
+            "sequence": self.sequence,
+            "model_predictions": [model_prediction.to_dict() for model_prediction in self.model_predictions],
+        }
+
+@dataclass(frozen=True)
+class MultiSequencePredictions:
+    """ Contains the predictions of several models for a list of sequences """
+    sequence_predictions: List[MultiSequencePrediction]
+
+    def to_dict(self) -> dict:
+        """ Same as dataclasses.asdict, without its recursive deep copy """
+        return {"sequence_predictions": [sequence_prediction.to_dict() for sequence_prediction in self.sequence_predictions]}
+
+
+class _ScoredProbabilities:
+    """ The probabilities scored so far whose sequences are not complete yet, in order """
+
+    def __init__(self):
+        self._chunks: Deque[np.ndarray] = deque()
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def extend(self, probabilities: np.ndarray):
+        if len(probabilities):
+            self._chunks.append(probabilities)
+            self._length += len(probabilities)
+
+    def take(self, count: int) -> np.ndarray:
+        """ Remove and return the first count probabilities, a view when they are in a single chunk """
+        parts = []
+        remaining = count
+        while remaining:
+            chunk = self._chunks[0]
+            if len(chunk) <= remaining:
+                parts.append(self._chunks.popleft())
+                remaining -= len(chunk)
+            else:
+                parts.append(chunk[:remaining])
+                self._chunks[0] = chunk[remaining:]
+                remaining = 0
+        self._length -= count
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
 
 
 class Predict:
@@ -40,6 +314,12 @@ class Predict:
 
     KMER_LENGTH = 53
 
+    """ The default number of kmers scored per model call """
+    BATCH_SIZE = 1024
+
+    """ The number of residues of the sequences encoded together when predicting with several models """
+    CHUNK_RESIDUES = 65536
+
     @staticmethod
     def to_one_hot(kmer: Kmer, alphabet) -> List[int]:
         """
@@ -82,19 +362,187 @@ class Predict:
       Parameters:
           kmer: The kmers to predict on
           alphabet: The alphabet used to encode the kmer.
+          model_file: The h5 file of the model, loaded once through the shared ModelRegistry
         
       Returns:
           A array of probabilities, one for each kmer,
           e.g. [0.1, 0.9]
       """        
-      tensor = Predict._tensor_encoding(kmers, alphabet)
-      model = tf.keras.models.load_model(model_file)
-      result =  model.predict(tensor)
-      # convert the result to a list of floats
-      return [float(probability) for probability in result]
+      model = ModelRegistry.shared().get_file(model_file)
+      return Predict._on_kmers_with_model(kmers, alphabet, model)
+
+    @staticmethod
+    def _on_kmers_with_model(kmers: List[Kmer], alphabet: Alphabet, model: Any) -> List[float]:
+      """ Same as on_kmers, but with an already loaded model """
+      if not kmers:
+          return []
+      return Predict._on_tensor(Predict._tensor_encoding(kmers, alphabet), model)
+
+    @staticmethod
+    def _on_tensor(tensor: np.ndarray, model: Any) -> List[float]:
+      """ Scores encoded kmers with model.predict, which splits them into its own batches """
+      if not len(tensor):
+          return []
+      metrics = Metrics.shared()
+      metrics.count_sites(model, len(tensor))
+      with metrics.stage("predict", model):
+          # identical kmers are scored once, see KmerDeduplicator
+          return KmerDeduplicator.shared().predict(tensor, model).tolist()
+
+    @staticmethod
+    def encode_sequence(sequence: Sequence, amino_acids: List[str], alphabet: Alphabet) -> Tuple[np.ndarray, np.ndarray]:
+      """
+      Encodes the kmers around every site of the given amino acids in a sequence, in the
+      same order as the kmers of Sequence.get_kmers for each amino acid.
+
+      Parameters:
+          sequence: The sequence to encode
+          amino_acids: The amino acids to predict on, e.g. ['S', 'T']
+          alphabet: The alphabet used to encode the kmers
+
+      Returns:
+          The 1-indexed sites and the (number of sites, KMER_LENGTH) tensor of their kmers
+      """
+      with Metrics.shared().stage("encode"):
+          sites = KmerEncoder.find_sites(sequence.sequence, amino_acids)
+          return sites, KmerEncoder.encode_sites(sequence.sequence, sites, alphabet, Predict.KMER_LENGTH)
+
+    @staticmethod
+    def iter_predictions(
+        sequences: Iterable[Sequence],
+        amino_acids: List[str],
+        alphabet: Alphabet,
+        model: Any,
+        batch_size: int = BATCH_SIZE,
+        cache: Optional[ModelPredictionCache] = None,
+    ) -> Iterator[SequencePrediction]:
+      """
+      Predicts the sites of a stream of sequences, scoring the kmers of consecutive sequences
+      together in batches of batch_size. Each SequencePrediction is yielded as soon as the
+      batch containing its last site has been scored.
+
+      Parameters:
+          sequences: The sequences to predict on
+          amino_acids: The amino acids to predict on, e.g. ['S', 'T']
+          alphabet: The alphabet used to encode the kmers
+          model: The loaded model
+          batch_size: The number of kmers scored per model call
+          cache: The cached predictions of the model, sequences found there are neither encoded nor scored
+      
+      Returns:
+          An iterator of SequencePredictions, one for each sequence, in order
+      """
+      if batch_size < 1:
+          raise ValueError(f"Batch size must be positive, got {batch_size}")
+      pending: Deque[Tuple[Sequence, np.ndarray, Optional[np.ndarray]]] = deque()
+      tensors: List[np.ndarray] = []
+      buffered = 0
+      probabilities = _ScoredProbabilities()
+      for sequence in sequences:
+          cached = cache.get(sequence.sequence) if cache is not None else None
+          if cached is not None:
+              sites = KmerEncoder.find_sites(sequence.sequence, amino_acids)
+              if len(sites) == len(cached):
+                  pending.append((sequence, sites, cached))
+                  yield from Predict._completed_predictions(pending, probabilities, cache)
+                  continue
+          sites, tensor = Predict.encode_sequence(sequence, amino_acids, alphabet)
+          pending.append((sequence, sites, None))
+          tensors.append(tensor)
+          buffered += len(sites)
+          if buffered >= batch_size:
+              block = np.concatenate(tensors)
+              full = buffered - buffered % batch_size
+              for start in range(0, full, batch_size):
+                  probabilities.extend(Predict._on_batch(block[start:start + batch_size], model))
+              tensors = [block[full:]]
+              buffered -= full
+          yield from Predict._completed_predictions(pending, probabilities, cache)
+      if buffered:
+          probabilities.extend(Predict._on_batch(np.concatenate(tensors), model))
+      yield from Predict._completed_predictions(pending, probabilities, cache)
+
+    @staticmethod
+    def _on_batch(tensor: np.ndarray, model: Any) -> np.ndarray:
+      """ Scores the distinct kmers of one batch in a single model call, returning float32 probabilities """
+      metrics = Metrics.shared()
+      metrics.count_sites(model, len(tensor))
+      with metrics.stage("predict", model):
+          return KmerDeduplicator.shared().predict_on_batch(tensor, model)
+
+    @staticmethod
+    def _site_predictions(sequence: Sequence, sites: np.ndarray, probabilities: Union[np.ndarray, List[float]]) -> SitePredictions:
+      """ Pairs each site with its amino acid and probability """
+      return SitePredictions.of_sequence(sequence.sequence, sites, probabilities)
+
+    @staticmethod
+    def _completed_predictions(
+        pending: Deque[Tuple[Sequence, np.ndarray, Optional[np.ndarray]]],
+        probabilities: _ScoredProbabilities,
+        cache: Optional[ModelPredictionCache] = None,
+    ) -> Iterator[SequencePrediction]:
+      """
+      Pops the pending sequences whose sites have all been scored or were cached, consuming the
+      probabilities of the scored ones and adding them to the cache
+      """
+      while pending:
+          sequence, sites, cached = pending[0]
+          if cached is None and len(sites) > len(probabilities):
+              break
+          pending.popleft()
+          if cached is None:
+              sequence_probabilities = probabilities.take(len(sites))
+              if cache is not None:
+                  cache.put(sequence.sequence, sequence_probabilities)
+          else:
+              sequence_probabilities = cached
+          site_predictions = Predict._site_predictions(sequence, sites, sequence_probabilities)
+          yield SequencePrediction(sequence.sequence_name, sequence.sequence, site_predictions)
+
+    @staticmethod
+    def on_sequences(
+        sequences: Iterable[Sequence],
+        ptm: PtmKind,
+        organism: OrganismKind,
+        label: LabelKind,
+        batch_size: int = BATCH_SIZE,
+    ) -> Iterator[SequencePrediction]:
+      """
+      Predicts the sites of a stream of sequences with the model of a given PTM, organism and label.
+      Sequences already scored by the same model file are taken from the shared PredictionCache.
+      See iter_predictions.
+
+      Parameters:
+          sequences: The sequences to predict on
+          ptm: The PTM to predict on
+          organism: The organism to predict on
+          label: The label to predict on
+          batch_size: The number of kmers scored per model call
+      """
+      metrics = Metrics.shared()
+      with metrics.stage("alphabet"):
+          alphabet = Model.get_alphabet(ptm, organism, label)
+      model = ModelRegistry.shared().get(ptm, organism, label)
+      backend, quantized = loaded_backend(model)
+      cache = PredictionCache.shared().for_model(
+          Model.get_h5_file(ptm, organism, label),
+          alphabet,
+          ptm.value.amino_acids,
+          Predict.KMER_LENGTH,
+          backend.value,
+          quantized,
+      )
+      predictions = Predict.iter_predictions(sequences, ptm.value.amino_acids, alphabet, model, batch_size, cache)
+      return metrics.count_sequences(predictions, model)
     
     @staticmethod
-    def on_fasta(fasta_text: str, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> SequencePredictions:
+    def on_fasta(
+        fasta_text: str,
+        ptm: PtmKind,
+        organism: OrganismKind,
+        label: LabelKind,
+        batch_size: Optional[int] = BATCH_SIZE,
+    ) -> SequencePredictions:
       """
       Predicts the probabilities that the sites are phosphorylation sites for all kmers in the fasta text.
 
@@ -103,17 +551,146 @@ class Predict:
           ptm: The PTM to predict on
           organism: The organism to predict on
           label: The label to predict on
+          batch_size: The number of kmers scored per model call across sequences,
+                      or None to make one model call per sequence
       
       Returns:
-          A list of SequencePredictions, one for each sequence in the fasta text
+          The SequencePredictions, held as PredictionColumns, one for each sequence in the fasta text
       """
+      sequences = Fasta.iter_sequences_from_text(fasta_text)
+      if batch_size is not None:
+          return SequencePredictions(PredictionColumns.from_predictions(Predict.on_sequences(sequences, ptm, organism, label, batch_size)))
+
       alphabet = Model.get_alphabet(ptm, organism, label)
-      sequences = Fasta.read_sequences_from_text(fasta_text)
-      h5_file = Model.get_h5_file(ptm, organism, label)
+      model = ModelRegistry.shared().get(ptm, organism, label)
       sequence_predictions = []
       for sequence in sequences:
-          kmers = [kmer for amino_acid in ptm.value.amino_acids for kmer in sequence.get_kmers(Predict.KMER_LENGTH, amino_acid)]
-          probabilities = Predict.on_kmers(kmers, alphabet, h5_file)
-          site_predictions = [SitePrediction(kmer.site, kmer.amino_acid, probability) for kmer, probability in zip(kmers, probabilities)]
+          sites, tensor = Predict.encode_sequence(sequence, ptm.value.amino_acids, alphabet)
+          probabilities = Predict._on_tensor(tensor, model)
+          site_predictions = Predict._site_predictions(sequence, sites, probabilities)
           sequence_predictions.append(SequencePrediction(sequence.sequence_name, sequence.sequence, site_predictions))
-      return SequencePredictions(sequence_predictions)
+      return SequencePredictions(PredictionColumns.from_predictions(sequence_predictions))
+
+    @staticmethod
+    def iter_multi_predictions(
+        sequences: Iterable[Sequence],
+        models: List[Tuple[ModelKey, Alphabet, Any]],
+        batch_size: int = BATCH_SIZE,
+        chunk_residues: int = CHUNK_RESIDUES,
+    ) -> Iterator[MultiSequencePrediction]:
+      """
+      Predicts the sites of a stream of sequences with several models. The sequences are taken in
+      chunks of about chunk_residues residues; within a chunk each sequence is encoded once per
+      alphabet and its kmers are extracted once per set of amino acids, then shared by every model
+      using them, such as the six models of K.
+
+      Parameters:
+          sequences: The sequences to predict on
+          models: The PTM, organism and label, alphabet and loaded model of each model to predict with
+          batch_size: The number of kmers scored per model call
+          chunk_residues: The number of residues of the sequences encoded together
+
+      Returns:
+          An iterator of MultiSequencePredictions, one for each sequence, in order, with the
+          predictions of the models in the order given
+      """
+      if batch_size < 1:
+          raise ValueError(f"Batch size must be positive, got {batch_size}")
+      chunk: List[Sequence] = []
+      residues = 0
+      for sequence in sequences:
+          chunk.append(sequence)
+          residues += len(sequence.sequence)
+          if residues >= chunk_residues:
+              yield from Predict._multi_predictions_of_chunk(chunk, models, batch_size)
+              chunk = []
+              residues = 0
+      if chunk:
+          yield from Predict._multi_predictions_of_chunk(chunk, models, batch_size)
+
+    @staticmethod
+    def _multi_predictions_of_chunk(
+        chunk: List[Sequence], models: List[Tuple[ModelKey, Alphabet, Any]], batch_size: int
+    ) -> Iterator[MultiSequencePrediction]:
+      """ Scores a chunk of sequences with every model, see iter_multi_predictions """
+      # The indices of the models by alphabet, then by amino acids
+      groups: Dict[Alphabet, Dict[Tuple[str, ...], List[int]]] = {}
+      for index, ((ptm, _, _), alphabet, _) in enumerate(models):
+          groups.setdefault(alphabet, {}).setdefault(tuple(ptm.value.amino_acids), []).append(index)
+
+      sites_by_amino_acids: Dict[Tuple[str, ...], List[np.ndarray]] = {}
+      site_predictions: List[List[typing.Sequence[SitePrediction]]] = [[[] for _ in models] for _ in chunk]
+      for alphabet, model_indices_by_amino_acids in groups.items():
+          padded = [KmerEncoder.pad(sequence.sequence, alphabet, Predict.KMER_LENGTH) for sequence in chunk]
+          for amino_acids, model_indices in model_indices_by_amino_acids.items():
+              if amino_acids not in sites_by_amino_acids:
+                  sites_by_amino_acids[amino_acids] = [
+                      KmerEncoder.find_sites(sequence.sequence, list(amino_acids)) for sequence in chunk
+                  ]
+              sites = sites_by_amino_acids[amino_acids]
+              with Metrics.shared().stage("encode"):
+                  tensor = np.concatenate([
+                      KmerEncoder.windows(padded_sequence, sequence_sites, alphabet, Predict.KMER_LENGTH)
+                      for padded_sequence, sequence_sites in zip(padded, sites)
+                  ])
+              for model_index in model_indices:
+                  model = models[model_index][2]
+                  probabilities = np.concatenate([
+                      Predict._on_batch(tensor[start:start + batch_size], model) for start in range(0, len(tensor), batch_size)
+                  ] or [np.empty(0, dtype=np.float32)])
+                  offset = 0
+                  for sequence_index, (sequence, sequence_sites) in enumerate(zip(chunk, sites)):
+                      site_predictions[sequence_index][model_index] = Predict._site_predictions(
+                          sequence, sequence_sites, probabilities[offset:offset + len(sequence_sites)]
+                      )
+                      offset += len(sequence_sites)
+
+      for sequence, sequence_site_predictions in zip(chunk, site_predictions):
+          model_predictions = [
+              ModelPrediction(ptm.name, organism.name, label.name, model_site_predictions)
+              for ((ptm, organism, label), _, _), model_site_predictions in zip(models, sequence_site_predictions)
+          ]
+          yield MultiSequencePrediction(sequence.sequence_name, sequence.sequence, model_predictions)
+
+    @staticmethod
+    def on_sequences_multi(
+        sequences: Iterable[Sequence],
+        model_keys: List[ModelKey],
+        batch_size: int = BATCH_SIZE,
+    ) -> Iterator[MultiSequencePrediction]:
+      """
+      Predicts the sites of a stream of sequences with the models of several PTM, organism and
+      label combinations. See iter_multi_predictions.
+
+      Parameters:
+          sequences: The sequences to predict on
+          model_keys: The PTM, organism and label of each model, e.g. one per PtmKind
+          batch_size: The number of kmers scored per model call
+      """
+      registry = ModelRegistry.shared()
+      metrics = Metrics.shared()
+      with metrics.stage("alphabet"):
+          alphabets = [Model.get_alphabet(ptm, organism, label) for ptm, organism, label in model_keys]
+      models = [
+          ((ptm, organism, label), alphabet, registry.get(ptm, organism, label))
+          for (ptm, organism, label), alphabet in zip(model_keys, alphabets)
+      ]
+      predictions = Predict.iter_multi_predictions(sequences, models, batch_size)
+      return metrics.count_sequences(predictions, *(model for _, _, model in models))
+
+    @staticmethod
+    def on_fasta_multi(
+        fasta_text: str,
+        model_keys: List[ModelKey],
+        batch_size: int = BATCH_SIZE,
+    ) -> MultiSequencePredictions:
+      """
+      Predicts the sites of the sequences in the fasta text with several models, parsing the text once.
+
+      Parameters:
+          fasta_text: The fasta text to predict on
+          model_keys: The PTM, organism and label of each model
+          batch_size: The number of kmers scored per model call
+      """
+      sequences = Fasta.iter_sequences_from_text(fasta_text)
+      return MultiSequencePredictions(list(Predict.on_sequences_multi(sequences, model_keys, batch_size)))
@@ -0,0 +1,258 @@
+""" Opt-in profiles of individual requests, kept on disk until they are downloaded """
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from sitetack.app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileNotFound(KeyError):
+    """ Raised when a profile id does not match any stored profile """
+
+
+@dataclass(frozen=True)
+class ProfileInfo:
+    """ What was profiled, as stored next to the profile """
+    profile_id: str
+    endpoint: str
+    models: List[str]
+    created_at: float
+    seconds: float = 0.0
+    finished: bool = False
+    error: Optional[str] = None
+    """ Whether the Python functions were profiled, False when another profiler was running """
+    python_profile: bool = False
+    """ Whether a TensorFlow trace was captured, False when TensorFlow is not used or another trace was running """
+    tensorflow_trace: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ProfileStore:
+    """ Keeps every profile in its own directory, holding the info of the request, the cProfile
+        statistics, a text summary of them and the TensorFlow trace if any.
+    """
+
+    PROFILE_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+    """ Maximum number of profiles kept, the oldest are deleted beyond it """
+    MAX_PROFILES = 20
+
+    def __init__(self, directory: Path):
+        """
+        Parameters:
+            directory: The directory the profile directories are created in
+        """
+        self.directory = Path(directory)
+
+    def profile_directory(self, profile_id: str) -> Path:
+        """ Get the directory of a profile, checking that the id cannot escape the store """
+        if not self.PROFILE_ID_PATTERN.fullmatch(profile_id):
+            raise ProfileNotFound(profile_id)
+        return self.directory / profile_id
+
+    def info_file(self, profile_id: str) -> Path:
+        return self.profile_directory(profile_id) / "info.json"
+
+    def create(self, endpoint: str, models: List[str]) -> ProfileInfo:
+        """ Store the info of a new profile, deleting the oldest ones beyond MAX_PROFILES """
+        self.remove_oldest(self.MAX_PROFILES - 1)
+        info = ProfileInfo(profile_id=uuid.uuid4().hex, endpoint=endpoint, models=models, created_at=time.time())
+        self.profile_directory(info.profile_id).mkdir(parents=True)
+        self.write_info(info)
+        return info
+
+    def write_info(self, info: ProfileInfo):
+        self.info_file(info.profile_id).write_text(json.dumps(info.to_dict()))
+
+    def info(self, profile_id: str) -> ProfileInfo:
+        """ Read the info of a profile.
+
+            Raises:
+                ProfileNotFound: When there is no profile with this id
+        """
+        try:
+            return ProfileInfo(**json.loads(self.info_file(profile_id).read_text()))
+        except FileNotFoundError:
+            raise ProfileNotFound(profile_id)
+
+    def files(self, profile_id: str) -> List[str]:
+        """ The paths of the files of a profile, relative to its directory """
+        directory = self.profile_directory(profile_id)
+        return sorted(str(path.relative_to(directory)) for path in directory.rglob("*") if path.is_file())
+
+    def archive(self, profile_id: str) -> bytes:
+        """ Zip the files of a profile.
+
+            Raises:
+                ProfileNotFound: When there is no profile with this id
+        """
+        self.info(profile_id)
+        directory = self.profile_directory(profile_id)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in self.files(profile_id):
+                archive.write(str(directory / name), f"{profile_id}/{name}")
+        return buffer.getvalue()
+
+    def remove_oldest(self, keep: int):
+        """ Delete the profiles created first, keeping the newest keep of them """
+        if not self.directory.is_dir():
+            return
+        profiles = []
+        for profile_directory in self.directory.iterdir():
+            try:
+                profiles.append((self.info(profile_directory.name).created_at, profile_directory))
+            except (ProfileNotFound, ValueError, TypeError):
+                continue
+        profiles.sort()
+        for _, profile_directory in profiles[:max(0, len(profiles) - keep)]:
+            shutil.rmtree(profile_directory, ignore_errors=True)
+
+
+class Profiler:
+    """ Profiles the blocking part of individual requests: their Python functions with cProfile,
+        and their TensorFlow ops with the TensorFlow profiler when TensorFlow is already in use.
+        Only the thread running the request is profiled, so time spent in the micro-batch of
+        another request or in an inference process shows up as waiting.
+    """
+
+    """ Number of functions listed in the text summary, by cumulative time """
+    SUMMARY_FUNCTIONS = 60
+
+    _shared: Optional["Profiler"] = None
+    _shared_lock = threading.Lock()
+
+    # The TensorFlow profiler traces the whole process, so a single trace runs at a time
+    _trace_lock = threading.Lock()
+
+    def __init__(self, store: ProfileStore, enabled: bool = True):
+        """
+        Parameters:
+            store: Where the profiles are stored
+            enabled: Whether requests may ask to be profiled
+        """
+        self.store = store
+        self.enabled = enabled
+
+    @classmethod
+    def shared(cls) -> "Profiler":
+        """ Get the profiler of the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                settings = get_settings()
+                cls._shared = cls(ProfileStore(Path(settings.profile_dir)), enabled=settings.profiling_enabled)
+            return cls._shared
+
+    def start(self, endpoint: str, models: List[str]) -> Optional[ProfileInfo]:
+        """ Create the profile of a request, or return None when profiling is disabled """
+        if not self.enabled:
+            return None
+        return self.store.create(endpoint, models)
+
+    def abandon(self, info: ProfileInfo, error: str):
+        """ Record a profile as finished with an error, for a request rejected before its work started """
+        try:
+            self.store.write_info(replace(info, finished=True, error=error))
+        except OSError as e:
+            logger.warning("Could not save profile %s: %s", info.profile_id, e)
+
+    def call(self, info: ProfileInfo, func: Callable[..., Any], *args: Any) -> Any:
+        """ Run func and store its profile, to be run on the thread doing the work """
+        with self._profiling(info):
+            return func(*args)
+
+    def iterate(self, info: ProfileInfo, func: Callable[..., Iterable[Any]], *args: Any) -> Iterator[Any]:
+        """ Consume the iterable returned by func and store its profile once it is exhausted or closed """
+        with self._profiling(info):
+            yield from func(*args)
+
+    def _profiling(self, info: ProfileInfo) -> "_Profiling":
+        return _Profiling(self, info)
+
+    def _start_trace(self, info: ProfileInfo) -> bool:
+        tf = sys.modules.get("tensorflow")
+        if tf is None or not self._trace_lock.acquire(blocking=False):
+            return False
+        try:
+            tf.profiler.experimental.start(str(self.store.profile_directory(info.profile_id) / "tensorflow"))
+            return True
+        except Exception as e:
+            logger.warning("Could not start the TensorFlow trace of profile %s: %s", info.profile_id, e)
+            self._trace_lock.release()
+            return False
+
+    def _stop_trace(self, info: ProfileInfo):
+        try:
+            sys.modules["tensorflow"].profiler.experimental.stop()
+        except Exception as e:
+            logger.warning("Could not save the TensorFlow trace of profile %s: %s", info.profile_id, e)
+        finally:
+            self._trace_lock.release()
+
+    def _save(self, info: ProfileInfo, profile: Optional[cProfile.Profile]):
+        directory = self.store.profile_directory(info.profile_id)
+        if profile is not None:
+            profile.dump_stats(str(directory / "profile.pstats"))
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(self.SUMMARY_FUNCTIONS)
+            (directory / "summary.txt").write_text(summary.getvalue())
+        self.store.write_info(info)
+
+
+class _Profiling:
+    """ Profiles the block it guards and saves the profile when it exits """
+
+    def __init__(self, profiler: Profiler, info: ProfileInfo):
+        self.profiler = profiler
+        self.info = info
+        self.profile: Optional[cProfile.Profile] = None
+        self.trace = False
+        self.start = 0.0
+
+    def __enter__(self):
+        self.trace = self.profiler._start_trace(self.info)
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiler is active, from Python 3.12 there can only be one per process
+            self.profile = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        if self.trace:
+            self.profiler._stop_trace(self.info)
+        info = replace(
+            self.info,
+            seconds=seconds,
+            finished=True,
+            error=None if exc_type is None or exc_type is GeneratorExit else f"{exc_type.__name__}: {exc_value}",
+            python_profile=self.profile is not None,
+            tensorflow_trace=self.trace,
+        )
+        try:
+            self.profiler._save(info, self.profile)
+        except OSError as e:
+            logger.warning("Could not save profile %s: %s", info.profile_id, e)
+        return False
@@ -0,0 +1,233 @@
+""" Keeps loaded models resident so that every request shares them """
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+from sitetack.app.backends import InferenceBackend, make_loader
+from sitetack.app.batching import MicroBatcher
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.metrics import Metrics
+from sitetack.app.model import Model, ModelKey
+from sitetack.app.runtime import import_tensorflow
+from sitetack.app.settings import get_settings
+
+
+def load_keras_model(h5_file: Path) -> Any:
+    """ Load a Keras model for inference from an h5 file. TensorFlow is imported here, on the first
+        load, so that the app, the command line and validation start without paying for it, and
+        its thread settings are applied then, see sitetack.app.runtime.
+    """
+    tf = import_tensorflow()
+
+    return tf.keras.models.load_model(h5_file, compile=False)
+
+
+def _model_name(key: Union[Path, ModelKey]) -> str:
+    """ The name of a model in the metrics, PTM:ORGANISM:LABEL or the end of the path of its file """
+    if isinstance(key, Path):
+        return "/".join(key.parts[-3:])
+    return ":".join(kind.name for kind in key)
+
+
+@dataclass(frozen=True)
+class RegistryStats:
+    """ Counters describing how the model registry has been used """
+    hits: int
+    misses: int
+    evictions: int
+    load_seconds: float
+    resident_models: int
+    resident_bytes: int
+
+
+@dataclass(frozen=True)
+class _Entry:
+    """ A loaded model and the size of the file it was loaded from """
+    model: Any
+    size: int
+
+
+class ModelRegistry:
+    """ Loads each model file once and keeps it resident, evicting the least recently used
+        models when the registry grows past its budget. Models are keyed by the resolved path of
+        their file, whether they are asked for by PTM, organism and label or by file.
+    """
+
+    _shared: Optional["ModelRegistry"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_models: int = 0,
+        max_bytes: int = 0,
+        loader: Callable[[Path], Any] = load_keras_model,
+    ):
+        """
+        Parameters:
+            max_models: The maximum number of models kept loaded at once, 0 for no limit
+            max_bytes: The maximum total size of the h5 files kept loaded at once, 0 for no limit
+            loader: Loads a model from an h5 file
+        """
+        self._max_models = max_models
+        self._max_bytes = max_bytes
+        self._loader = loader
+        self._entries: "OrderedDict[Path, _Entry]" = OrderedDict()
+        self._load_locks: Dict[Path, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._load_seconds = 0.0
+
+    @classmethod
+    def shared(cls) -> "ModelRegistry":
+        """ Get the registry shared by the whole process, configured from the settings. With
+            inference processes, its models stand in for the models loaded in the WorkerPool.
+            Concurrent calls to the same model are coalesced by the shared MicroBatcher.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                batcher = MicroBatcher.shared()
+                if get_settings().inference_processes > 0:
+                    from sitetack.app.workers import WorkerPool
+
+                    cls._shared = cls(loader=batcher.wrap(WorkerPool.shared().model))
+                else:
+                    cls._shared = cls.local(batcher.wrap(cls.backend_loader()))
+            return cls._shared
+
+    @classmethod
+    def local(cls, loader: Optional[Callable[[Path], Any]] = None) -> "ModelRegistry":
+        """ Create a registry running the models in this process, configured from the settings.
+
+            Parameters:
+                loader: Loads a model from an h5 file, backend_loader() by default
+        """
+        settings = get_settings()
+        return cls(
+            max_models=settings.model_cache_size,
+            max_bytes=settings.model_cache_bytes,
+            loader=loader or cls.backend_loader(),
+        )
+
+    @staticmethod
+    def backend_loader() -> Callable[[Path], Any]:
+        """ Get the loader of the inference backend of the settings """
+        settings = get_settings()
+        return make_loader(
+            InferenceBackend(settings.inference_backend),
+            Path(settings.export_dir),
+            Model.model_directory_path(),
+            load_keras_model,
+        )
+
+    def get(self, ptm: PtmKind, organism: OrganismKind, label: LabelKind) -> Any:
+        """ Get the model for a given PTM, organism and label, loading it on first use.
+
+            Parameters:
+                ptm (PtmKind): The PTM to use
+                organism (OrganismKind): The organism to use
+                label (LabelKind): The label to use
+        """
+        return self._get(Path(Model.get_h5_file(ptm, organism, label)).resolve(), (ptm, organism, label))
+
+    def get_file(self, h5_file: Path) -> Any:
+        """ Get the model stored in an h5 file, loading it on first use.
+
+            Parameters:
+                h5_file (Path): The h5 file of the model
+        """
+        h5_file = Path(h5_file).resolve()
+        return self._get(h5_file, h5_file)
+
+    def _get(self, h5_file: Path, name_key: Union[Path, ModelKey]) -> Any:
+        """ Get the model of a resolved h5 file, named after name_key in the metrics if it is loaded now """
+        with self._lock:
+            entry = self._lookup(h5_file)
+            if entry is not None:
+                return entry.model
+            load_lock = self._load_locks.setdefault(h5_file, threading.Lock())
+
+        # Only one thread loads a given model, the others wait for it and count as hits
+        try:
+            with load_lock:
+                with self._lock:
+                    entry = self._lookup(h5_file)
+                    if entry is not None:
+                        return entry.model
+                    self._misses += 1
+
+                metrics = Metrics.shared()
+                start = time.perf_counter()
+                with metrics.stage("load_model", name=_model_name(name_key)):
+                    model = self._loader(h5_file)
+                elapsed = time.perf_counter() - start
+                metrics.name_model(model, _model_name(name_key))
+
+                with self._lock:
+                    self._load_seconds += elapsed
+                    self._entries[h5_file] = _Entry(model=model, size=h5_file.stat().st_size)
+                    self._evict()
+        finally:
+            # Also when the loader raises, so that a failed load does not leave its lock behind
+            with self._lock:
+                self._load_locks.pop(h5_file, None)
+        return model
+
+    def _lookup(self, h5_file: Path) -> Optional[_Entry]:
+        """ Find a resident entry and mark it as recently used, the lock must be held """
+        entry = self._entries.get(h5_file)
+        if entry is not None:
+            self._entries.move_to_end(h5_file)
+            self._hits += 1
+        return entry
+
+    def _evict(self):
+        """ Evict least recently used entries until within budget, the lock must be held.
+            The most recently used entry is always kept.
+        """
+        while len(self._entries) > 1 and self._over_budget():
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _over_budget(self) -> bool:
+        if self._max_models and len(self._entries) > self._max_models:
+            return True
+        if self._max_bytes and self._resident_bytes() > self._max_bytes:
+            return True
+        return False
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def stats(self) -> RegistryStats:
+        """ Get the hit, miss and load time counters of the registry """
+        with self._lock:
+            return RegistryStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                load_seconds=self._load_seconds,
+                resident_models=len(self._entries),
+                resident_bytes=self._resident_bytes(),
+            )
+
+    def clear(self):
+        """ Unload every model, keeping the counters """
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Union[Path, ModelKey]) -> bool:
+        """ Whether the model of an h5 file, or of a PTM, organism and label, is resident """
+        h5_file = key if isinstance(key, Path) else Model.get_h5_file(*key)
+        h5_file = Path(h5_file).resolve()
+        with self._lock:
+            return h5_file in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
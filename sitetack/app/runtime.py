@@ -0,0 +1,84 @@
+""" Applies the thread and CPU settings of a deployment to the process, before its first model load """
+
+import logging
+import os
+import threading
+from typing import Any, Set
+
+from sitetack.app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_affinity_applied = False
+_tensorflow_configured = False
+
+
+def parse_cpu_list(value: str) -> Set[int]:
+    """ Parse a list of CPUs in the format of taskset and cgroups.
+
+        Parameters:
+            value: Comma separated CPUs and ranges of CPUs, e.g. '0-3,8'
+        Returns:
+            Set[int]: The CPUs, empty for a blank value
+        Raises:
+            ValueError: When an entry is not a CPU or a range of CPUs
+    """
+    cpus: Set[int] = set()
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        first, _, last = entry.partition("-")
+        try:
+            start, end = int(first), int(last or first)
+        except ValueError:
+            raise ValueError(f"Expected a CPU or a range of CPUs such as 0-3, got {entry!r}")
+        if start < 0 or end < start:
+            raise ValueError(f"Invalid range of CPUs {entry!r}")
+        cpus.update(range(start, end + 1))
+    return cpus
+
+
+def apply_cpu_affinity():
+    """ Pin the process to the CPUs of the settings, once. Threads started afterwards, such as
+        those of TensorFlow and BLAS, inherit the affinity.
+    """
+    global _affinity_applied
+    with _lock:
+        if _affinity_applied:
+            return
+        _affinity_applied = True
+        cpus = parse_cpu_list(get_settings().cpu_affinity)
+        if not cpus:
+            return
+        if not hasattr(os, "sched_setaffinity"):
+            logger.warning("CPU affinity is not supported on this platform, ignoring SITETACK_CPU_AFFINITY")
+            return
+        os.sched_setaffinity(0, cpus)
+        logger.info("Pinned the process to CPUs %s", sorted(cpus))
+
+
+def configure_tensorflow(tf: Any):
+    """ Set the intra-op and inter-op thread pools of TensorFlow from the settings, once. They can
+        only be set before TensorFlow runs its first operation, so later calls only log a warning.
+    """
+    global _tensorflow_configured
+    with _lock:
+        if _tensorflow_configured:
+            return
+        _tensorflow_configured = True
+        settings = get_settings()
+        try:
+            if settings.tf_intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(settings.tf_intra_op_threads)
+            if settings.tf_inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(settings.tf_inter_op_threads)
+        except RuntimeError as e:
+            logger.warning("TensorFlow was already initialized, its thread settings are unchanged: %s", e)
+
+
+def import_tensorflow() -> Any:
+    """ Import TensorFlow with the CPU and thread settings applied, for every model load """
+    apply_cpu_affinity()
+    import tensorflow as tf
+
+    configure_tensorflow(tf)
+    return tf
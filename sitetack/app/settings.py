@@ -0,0 +1,170 @@
+""" Deployment settings, read from environment variables """
+
+import os
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+
+def int_from_env(name: str, default: int) -> int:
+    """ Read an integer environment variable.
+
+        Parameters:
+            name (str): The name of the environment variable, e.g. 'SITETACK_MODEL_CACHE_SIZE'
+            default (int): The value to use when the variable is unset or blank
+        Returns:
+            int: The value of the environment variable
+    """
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Environment variable {name} must be an integer, got {value!r}")
+
+
+def bool_from_env(name: str, default: bool) -> bool:
+    """ Read a boolean environment variable, such as '1', 'true' or 'yes'.
+
+        Parameters:
+            name (str): The name of the environment variable, e.g. 'SITETACK_METRICS'
+            default (bool): The value to use when the variable is unset or blank
+        Returns:
+            bool: The value of the environment variable
+    """
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Environment variable {name} must be a boolean such as true or false, got {value!r}")
+
+
+def default_cache_dir() -> str:
+    """ The directory for files the app can rebuild, e.g. ~/.cache/sitetack """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return str(Path(cache_home) / "sitetack")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """ Deployment settings for the app, such as cache sizes """
+
+    """ Maximum number of models kept loaded at once, 0 for no limit """
+    model_cache_size: int = 0
+
+    """ Maximum total size in bytes of the h5 files kept loaded at once, 0 for no limit """
+    model_cache_bytes: int = 0
+
+    """ Number of kmers scored per model call, across the sequences of a submission """
+    batch_size: int = 1024
+
+    """ Milliseconds a batch waits for the running batch of the same model, gathering the kmers of
+        concurrent requests into one model call, 0 to disable micro-batching
+    """
+    batch_max_wait_ms: int = 5
+
+    """ Number of submissions scored at once, off the event loop """
+    inference_workers: int = 2
+
+    """ Number of processes the models are run in, each owning a subset of them, 0 to run them in the API process """
+    inference_processes: int = 0
+
+    """ Threads TensorFlow uses within an operation, such as a matrix product, 0 for its default of one per core """
+    tf_intra_op_threads: int = 0
+
+    """ Operations TensorFlow runs at once, 0 for its default """
+    tf_inter_op_threads: int = 0
+
+    """ CPUs the process is pinned to, such as '0-3,8', blank to use every CPU it is allowed on """
+    cpu_affinity: str = ""
+
+    """ Number of submissions waiting for a worker before new ones are turned away """
+    inference_queue: int = 8
+
+    """ Seconds a turned away client is told to wait before retrying """
+    retry_after: int = 5
+
+    """ Directory where background jobs keep their submissions and results """
+    job_dir: str = str(Path(tempfile.gettempdir()) / "sitetack-jobs")
+
+    """ Number of background jobs running at once """
+    job_workers: int = 1
+
+    """ Seconds after which finished background jobs are deleted, 0 to keep them """
+    job_max_age: int = 7 * 24 * 60 * 60
+
+    """ Directory for files the app can rebuild, such as the model index """
+    cache_dir: str = default_cache_dir()
+
+    """ Maximum total size in bytes of the predictions cached in memory, 0 to disable the memory tier """
+    prediction_cache_bytes: int = 64 * 1024 * 1024
+
+    """ Directory of the on-disk prediction cache, blank to disable the disk tier """
+    prediction_cache_dir: str = ""
+
+    """ Maximum total size in bytes of the predictions cached on disk """
+    prediction_cache_disk_bytes: int = 1024 * 1024 * 1024
+
+    """ Number of distinct kmers remembered per model across batches, 0 to deduplicate within batches only """
+    kmer_cache_size: int = 0
+
+    """ Models loaded and warmed up at startup, 'all' or comma separated PTM[:ORGANISM[:LABEL]] entries """
+    preload_models: str = ""
+
+    """ How models are run: 'keras' or 'numpy' from their h5 files, or 'saved_model' or 'tflite' once exported with sitetack-export """
+    inference_backend: str = "keras"
+
+    """ Directory the models are exported to by sitetack-export """
+    export_dir: str = str(Path(default_cache_dir()) / "exported")
+
+    """ Whether to time the prediction stages and expose them on /metrics """
+    metrics_enabled: bool = False
+
+    """ Whether requests may ask to be profiled, with the X-Sitetack-Profile header or the profile query parameter """
+    profiling_enabled: bool = False
+
+    """ Directory where the profiles of requests are kept until downloaded """
+    profile_dir: str = str(Path(tempfile.gettempdir()) / "sitetack-profiles")
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """ Build the settings from the SITETACK_* environment variables """
+        cache_dir = os.environ.get("SITETACK_CACHE_DIR") or default_cache_dir()
+        return cls(
+            model_cache_size=int_from_env("SITETACK_MODEL_CACHE_SIZE", cls.model_cache_size),
+            model_cache_bytes=int_from_env("SITETACK_MODEL_CACHE_BYTES", cls.model_cache_bytes),
+            batch_size=int_from_env("SITETACK_BATCH_SIZE", cls.batch_size),
+            batch_max_wait_ms=int_from_env("SITETACK_BATCH_MAX_WAIT_MS", cls.batch_max_wait_ms),
+            inference_workers=int_from_env("SITETACK_INFERENCE_WORKERS", cls.inference_workers),
+            inference_processes=int_from_env("SITETACK_INFERENCE_PROCESSES", cls.inference_processes),
+            tf_intra_op_threads=int_from_env("SITETACK_TF_INTRA_OP_THREADS", cls.tf_intra_op_threads),
+            tf_inter_op_threads=int_from_env("SITETACK_TF_INTER_OP_THREADS", cls.tf_inter_op_threads),
+            cpu_affinity=os.environ.get("SITETACK_CPU_AFFINITY", "").strip(),
+            inference_queue=int_from_env("SITETACK_INFERENCE_QUEUE", cls.inference_queue),
+            retry_after=int_from_env("SITETACK_RETRY_AFTER", cls.retry_after),
+            job_dir=os.environ.get("SITETACK_JOB_DIR") or cls.job_dir,
+            job_workers=int_from_env("SITETACK_JOB_WORKERS", cls.job_workers),
+            job_max_age=int_from_env("SITETACK_JOB_MAX_AGE", cls.job_max_age),
+            cache_dir=cache_dir,
+            prediction_cache_bytes=int_from_env("SITETACK_PREDICTION_CACHE_BYTES", cls.prediction_cache_bytes),
+            prediction_cache_dir=os.environ.get("SITETACK_PREDICTION_CACHE_DIR", "").strip(),
+            prediction_cache_disk_bytes=int_from_env("SITETACK_PREDICTION_CACHE_DISK_BYTES", cls.prediction_cache_disk_bytes),
+            kmer_cache_size=int_from_env("SITETACK_KMER_CACHE_SIZE", cls.kmer_cache_size),
+            preload_models=os.environ.get("SITETACK_PRELOAD_MODELS", "").strip(),
+            inference_backend=os.environ.get("SITETACK_INFERENCE_BACKEND", "").strip() or cls.inference_backend,
+            export_dir=os.environ.get("SITETACK_EXPORT_DIR") or str(Path(cache_dir) / "exported"),
+            metrics_enabled=bool_from_env("SITETACK_METRICS", cls.metrics_enabled),
+            profiling_enabled=bool_from_env("SITETACK_PROFILING", cls.profiling_enabled),
+            profile_dir=os.environ.get("SITETACK_PROFILE_DIR") or cls.profile_dir,
+        )
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """ Get the settings of this process, read once from the environment """
+    return Settings.from_env()
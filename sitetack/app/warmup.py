@@ -0,0 +1,164 @@
+""" Loads and warms up models at startup, so that a replica only receives traffic once it is warm """
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, replace
+from enum import Enum
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.kmer import Kmer
+from sitetack.app.model import Model, ModelIndex, ModelKey
+from sitetack.app.predict import Predict
+from sitetack.app.registry import ModelRegistry
+from sitetack.app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+GetModel = Callable[[PtmKind, OrganismKind, LabelKind], Any]
+
+
+def parse_model_keys(value: str, available: List[ModelKey]) -> List[ModelKey]:
+    """ Select models from a comma separated list of PTM[:ORGANISM[:LABEL]] entries, where a missing
+        organism or label matches any, or 'all' for every available model.
+
+        Parameters:
+            value: The selection, e.g. 'PHOSPHORYLATION_ST:HUMAN:NO_LABELS,UBIQUITINATION_K'
+            available: The models that can be selected, in the order they are returned
+        Returns:
+            List[ModelKey]: The selected models, without duplicates
+        Raises:
+            ValueError: When an entry names an unknown kind or matches no available model
+    """
+    value = value.strip()
+    if value.lower() == "all":
+        return list(available)
+    selected = set()
+    kinds = (PtmKind, OrganismKind, LabelKind)
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        names = entry.split(":")
+        if len(names) > len(kinds):
+            raise ValueError(f"Expected PTM[:ORGANISM[:LABEL]], got {entry!r}")
+        for name, kind in zip(names, kinds):
+            if name not in kind.__members__:
+                raise ValueError(f"Unknown {kind.__name__} {name!r} in {entry!r}")
+        matches = [key for key in available if all(member.name == name for member, name in zip(key, names))]
+        if not matches:
+            raise ValueError(f"No model matches {entry!r}")
+        selected.update(matches)
+    return [key for key in available if key in selected]
+
+
+class WarmupState(Enum):
+    """ The life cycle of the warm-up """
+    PENDING = "pending"
+    WARMING = "warming"
+    READY = "ready"
+    FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class WarmupStatus:
+    """ The progress of the warm-up, as reported by /health/ready """
+    state: WarmupState
+    models_total: int = 0
+    models_ready: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state.value,
+            "models_total": self.models_total,
+            "models_ready": self.models_ready,
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+
+class Warmup:
+    """ Loads the model index, then loads the selected models and scores a batch of padding kmers
+        with each, so that TensorFlow builds their graphs before the first request does.
+    """
+
+    _shared: Optional["Warmup"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        preload: str = "",
+        batch_size: int = Predict.BATCH_SIZE,
+        get_model: Optional[GetModel] = None,
+        index: Callable[[], ModelIndex] = Model.index,
+    ):
+        """
+        Parameters:
+            preload: The models to warm up, see parse_model_keys, blank to only load the index
+            batch_size: The number of kmers of the warm-up batch
+            get_model: Loads the model of a PTM, organism and label, the shared ModelRegistry by default
+            index: Gets the model index
+        """
+        self.preload = preload
+        self.batch_size = batch_size
+        self._get_model = get_model
+        self._index = index
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._status = WarmupStatus(WarmupState.PENDING)
+
+    @classmethod
+    def shared(cls) -> "Warmup":
+        """ Get the warm-up of the whole process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                settings = get_settings()
+                cls._shared = cls(preload=settings.preload_models, batch_size=settings.batch_size)
+            return cls._shared
+
+    def start(self):
+        """ Run the warm-up on a background thread, once """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="sitetack-warmup", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: Optional[float] = None):
+        """ Wait for a started warm-up to finish """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> WarmupStatus:
+        with self._lock:
+            return self._status
+
+    @property
+    def ready(self) -> bool:
+        return self.status().state == WarmupState.READY
+
+    def _set_status(self, **changes):
+        with self._lock:
+            self._status = replace(self._status, **changes)
+
+    def run(self):
+        """ Warm up in the calling thread, recording the progress in the status """
+        start = time.monotonic()
+        self._set_status(state=WarmupState.WARMING)
+        try:
+            index = self._index()
+            keys = parse_model_keys(self.preload, index.keys())
+            self._set_status(models_total=len(keys))
+            get_model = self._get_model or ModelRegistry.shared().get
+            for ptm, organism, label in keys:
+                model = get_model(ptm, organism, label)
+                padding = index.get_alphabet(ptm, organism, label).encode(Kmer.padding * Predict.KMER_LENGTH)
+                model.predict_on_batch(np.tile(padding, (self.batch_size, 1)))
+                self._set_status(models_ready=self.status().models_ready + 1, seconds=time.monotonic() - start)
+            self._set_status(state=WarmupState.READY, seconds=time.monotonic() - start)
+            logger.info("Warmed up %d models in %.1f s", len(keys), time.monotonic() - start)
+        except Exception as e:
+            logger.exception("Warm-up failed")
+            self._set_status(state=WarmupState.FAILED, error=str(e), seconds=time.monotonic() - start)
@@ -0,0 +1,227 @@
+""" Runs models in a pool of inference processes, each owning a subset of the models, so that
+    scoring scales across cores without loading every model in every process
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sitetack.app.backends import InferenceBackend, loaded_backend
+from sitetack.app.settings import get_settings
+
+Loader = Callable[[Path], Any]
+
+
+def _initialize_worker(loader: Optional[Loader]):
+    """ Give the worker process its own registry, which runs the models in it """
+    from sitetack.app.registry import ModelRegistry
+
+    ModelRegistry._shared = ModelRegistry.local(loader)
+
+
+def _predict_in_worker(h5_file: str, tensor: np.ndarray, whole: bool) -> np.ndarray:
+    from sitetack.app.registry import ModelRegistry
+
+    model = ModelRegistry.shared().get_file(Path(h5_file))
+    probabilities = model.predict(tensor) if whole else model.predict_on_batch(tensor)
+    return np.asarray(probabilities, dtype=np.float32)
+
+
+def _loaded_backend_in_worker(h5_file: str) -> Tuple[str, bool]:
+    from sitetack.app.registry import ModelRegistry
+
+    backend, quantized = loaded_backend(ModelRegistry.shared().get_file(Path(h5_file)))
+    return backend.value, quantized
+
+
+@dataclass(frozen=True)
+class WorkerStats:
+    """ Counters of the worker pool, with one entry per process """
+    processes: int
+    models: List[int]
+    batches: List[int]
+    kmers: List[int]
+    restarts: int
+
+
+class WorkerModel:
+    """ Stands in for a model loaded in a worker process, offering predict and predict_on_batch
+        like a Keras model
+    """
+
+    def __init__(self, pool: "WorkerPool", h5_file: Path):
+        self._pool = pool
+        self.h5_file = str(h5_file)
+
+    @property
+    def inference_backend(self) -> InferenceBackend:
+        """ The backend that loaded the model in its worker process """
+        return self._pool.loaded_backend(self.h5_file)[0]
+
+    @property
+    def quantized(self) -> bool:
+        """ Whether the model loaded in its worker process has quantized weights """
+        return self._pool.loaded_backend(self.h5_file)[1]
+
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        return self._pool.predict(self.h5_file, tensor, whole=False)
+
+    def predict(self, tensor: np.ndarray) -> np.ndarray:
+        return self._pool.predict(self.h5_file, tensor, whole=True)
+
+
+class WorkerPool:
+    """ A fixed number of inference processes. Each model is assigned to the process owning the
+        fewest models when it is first used and is only ever loaded there, so the memory of the
+        models is not multiplied by the number of processes. The batches of a model are sent to its
+        process and scored while the calling thread waits, so several threads scoring different
+        models run in parallel.
+
+        Processes are started with spawn, so that they do not inherit the threads, locks and open
+        files of the API process. A process that dies is replaced on the next batch sent to it,
+        and the batch that was running fails.
+    """
+
+    _shared: Optional["WorkerPool"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, processes: int, loader: Optional[Loader] = None):
+        """
+        Parameters:
+            processes: The number of inference processes
+            loader: Loads a model from an h5 file in a worker process, it must be picklable.
+                    The loader configured by the settings by default, see ModelRegistry.local
+        """
+        if processes < 1:
+            raise ValueError(f"processes must be positive, got {processes}")
+        self.processes = processes
+        self._loader = loader
+        self._context = get_context("spawn")
+        self._lock = threading.Lock()
+        self._executors = [self._start() for _ in range(processes)]
+        self._owners: Dict[str, int] = {}
+        self._backends: Dict[str, Tuple[InferenceBackend, bool]] = {}
+        self._batches = [0] * processes
+        self._kmers = [0] * processes
+        self._restarts = 0
+
+    @classmethod
+    def shared(cls) -> "WorkerPool":
+        """ Get the pool of the API process, configured from the settings """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(processes=get_settings().inference_processes)
+            return cls._shared
+
+    @classmethod
+    def shutdown_shared(cls):
+        """ Stop the processes of the shared pool if it was started """
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.shutdown(wait=False)
+                cls._shared = None
+
+    def _start(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1, mp_context=self._context, initializer=_initialize_worker, initargs=(self._loader,)
+        )
+
+    def model(self, h5_file: Path) -> WorkerModel:
+        """ Get the stand-in of a model, usable as the loader of a ModelRegistry """
+        return WorkerModel(self, h5_file)
+
+    def owner(self, h5_file: str) -> int:
+        """ The index of the process owning a model, assigning it on first use """
+        with self._lock:
+            if h5_file not in self._owners:
+                counts = [0] * self.processes
+                for index in self._owners.values():
+                    counts[index] += 1
+                self._owners[h5_file] = counts.index(min(counts))
+            return self._owners[h5_file]
+
+    def loaded_backend(self, h5_file: str) -> Tuple[InferenceBackend, bool]:
+        """ The backend that loaded a model in the process owning it and whether its weights are
+            quantized, loading it there if needed. The answer is kept until the process is replaced,
+            as its replacement loads the model again.
+
+            Raises:
+                BrokenProcessPool: When the process died while loading, it is replaced for the next call
+        """
+        with self._lock:
+            if h5_file in self._backends:
+                return self._backends[h5_file]
+        index = self.owner(h5_file)
+        with self._lock:
+            executor = self._executors[index]
+        try:
+            backend, quantized = executor.submit(_loaded_backend_in_worker, h5_file).result()
+        except BrokenProcessPool:
+            self._replace(index, executor)
+            raise
+        with self._lock:
+            if self._executors[index] is executor:
+                self._backends[h5_file] = (InferenceBackend(backend), quantized)
+        return InferenceBackend(backend), quantized
+
+    def _replace(self, index: int, executor: ProcessPoolExecutor):
+        """ Replace the broken executor of a process, unless another thread already did """
+        with self._lock:
+            if self._executors[index] is executor:
+                self._executors[index] = self._start()
+                self._restarts += 1
+                for h5_file, owner in self._owners.items():
+                    if owner == index:
+                        self._backends.pop(h5_file, None)
+
+    def predict(self, h5_file: str, tensor: np.ndarray, whole: bool = False) -> np.ndarray:
+        """ Score encoded kmers with a model in the process owning it.
+
+            Parameters:
+                h5_file: The h5 file of the model
+                tensor: The encoded kmers
+                whole: Whether to call model.predict, which splits the kmers into its own batches,
+                       rather than model.predict_on_batch
+            Returns:
+                np.ndarray: The probabilities of the kmers, as float32
+            Raises:
+                BrokenProcessPool: When the process died while scoring, it is replaced for the next batch
+        """
+        index = self.owner(h5_file)
+        with self._lock:
+            executor = self._executors[index]
+        try:
+            probabilities = executor.submit(_predict_in_worker, h5_file, np.ascontiguousarray(tensor), whole).result()
+        except BrokenProcessPool:
+            self._replace(index, executor)
+            raise
+        with self._lock:
+            self._batches[index] += 1
+            self._kmers[index] += len(tensor)
+        return probabilities
+
+    def stats(self) -> WorkerStats:
+        with self._lock:
+            models = [0] * self.processes
+            for index in self._owners.values():
+                models[index] += 1
+            return WorkerStats(
+                processes=self.processes,
+                models=models,
+                batches=list(self._batches),
+                kmers=list(self._kmers),
+                restarts=self._restarts,
+            )
+
+    def shutdown(self, wait: bool = True):
+        """ Stop the processes once their running batches are done """
+        with self._lock:
+            executors = list(self._executors)
+        for executor in executors:
+            executor.shutdown(wait=wait)
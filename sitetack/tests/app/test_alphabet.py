@@ -11,3 +11,14 @@ class TestAlphabet:
         alphabet_str = "ARNDCEQGHILKMFPSTWYVXZ-U"
         alphabet = Alphabet(alphabet_str)
         assert alphabet.str == alphabet_str
+
+    def test_encode_returns_indices(self):
+        alphabet = Alphabet("ARN-")
+        assert alphabet.encode("NRA-").tolist() == [2, 1, 0, 3]
+
+    def test_encode_marks_characters_not_in_alphabet(self):
+        alphabet = Alphabet("ARN-")
+        assert alphabet.encode("AXé").tolist() == [0, Alphabet.INVALID_INDEX, Alphabet.INVALID_INDEX]
+
+    def test_lookup_table_is_shared_between_equal_alphabets(self):
+        assert Alphabet("ARN-").lookup_table() is Alphabet("ARN-").lookup_table()
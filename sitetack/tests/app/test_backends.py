@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from pathlib import Path
+from sitetack.app.backends import (
+    InferenceBackend,
+    SavedModelPredictor,
+    TFLitePredictor,
+    exported_path,
+    is_up_to_date,
+    loaded_backend,
+    make_loader,
+)
+from sitetack.app.export import export_model
+from sitetack.app.registry import load_keras_model
+
+
+def make_h5_model(model_directory: Path) -> Path:
+    """ Save a small model taking encoded kmers, like the models of sitetack/models """
+    kmers = tf.keras.Input(shape=(53,))
+    x = tf.keras.layers.Embedding(24, 4)(kmers)
+    x = tf.keras.layers.Flatten()(x)
+    probabilities = tf.keras.layers.Dense(1, activation="sigmoid")(x)
+    h5_file = model_directory / "Phosphorylation (S,T)" / "Human" / "model_no_labels.h5"
+    h5_file.parent.mkdir(parents=True)
+    tf.keras.Model(kmers, probabilities).save(str(h5_file))
+    return h5_file
+
+
+@pytest.fixture(scope="module")
+def exported(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("backends")
+    h5_file = make_h5_model(directory / "models")
+    paths = export_model(
+        h5_file, [InferenceBackend.SAVED_MODEL, InferenceBackend.TFLITE], directory / "exported", directory / "models"
+    )
+    return directory, h5_file, paths
+
+
+class TestExportedPath:
+    def test_exported_path_mirrors_models_directory(self, tmp_path):
+        h5_file = tmp_path / "models" / "PTM" / "Human" / "model.h5"
+        path = exported_path(h5_file, InferenceBackend.TFLITE, tmp_path / "exported", tmp_path / "models")
+        assert path == tmp_path / "exported" / "PTM" / "Human" / "model.tflite"
+
+    def test_exported_path_is_none_outside_models_directory(self, tmp_path):
+        assert exported_path(tmp_path / "model.h5", InferenceBackend.TFLITE, tmp_path / "exported", tmp_path / "models") is None
+
+
+class TestPredictors:
+    @pytest.mark.parametrize("backend", [InferenceBackend.SAVED_MODEL, InferenceBackend.TFLITE])
+    def test_predictor_matches_keras_model(self, exported, backend):
+        _, h5_file, paths = exported
+        predictor = {InferenceBackend.SAVED_MODEL: SavedModelPredictor, InferenceBackend.TFLITE: TFLitePredictor}[backend](paths[backend])
+        tensor = np.random.default_rng(0).integers(0, 24, size=(1500, 53)).astype(np.uint8)
+        expected = np.asarray(load_keras_model(h5_file).predict(tensor)).reshape(-1)
+        np.testing.assert_allclose(np.asarray(predictor.predict(tensor)).reshape(-1), expected, atol=1e-5)
+        np.testing.assert_allclose(np.asarray(predictor.predict_on_batch(tensor[:7])).reshape(-1), expected[:7], atol=1e-5)
+
+
+class TestMakeLoader:
+    def test_keras_backend_returns_fallback(self, tmp_path):
+        assert make_loader(InferenceBackend.KERAS, tmp_path, tmp_path, load_keras_model) is load_keras_model
+
+    def test_loader_uses_up_to_date_export(self, exported):
+        directory, h5_file, paths = exported
+        loader = make_loader(InferenceBackend.TFLITE, directory / "exported", directory / "models", fallback=load_keras_model)
+        assert is_up_to_date(paths[InferenceBackend.TFLITE], h5_file)
+        assert isinstance(loader(h5_file), TFLitePredictor)
+
+    def test_loader_falls_back_to_keras_without_export(self, exported, tmp_path):
+        directory, h5_file, _ = exported
+        loaded = []
+        loader = make_loader(InferenceBackend.SAVED_MODEL, tmp_path, directory / "models", fallback=loaded.append)
+        loader(h5_file)
+        assert loaded == [h5_file]
+
+    def test_loader_falls_back_to_keras_when_h5_file_changed(self, tmp_path):
+        h5_file = tmp_path / "models" / "model.h5"
+        h5_file.parent.mkdir()
+        h5_file.write_bytes(b"retrained")
+        path = exported_path(h5_file, InferenceBackend.TFLITE, tmp_path / "exported", tmp_path / "models")
+        assert path is not None
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"old model")
+        path.with_name(f"{path.name}.json").write_text('{"h5_sha256": "0", "quantized": false}')
+        loaded = []
+        make_loader(InferenceBackend.TFLITE, tmp_path / "exported", tmp_path / "models", fallback=loaded.append)(h5_file)
+        assert loaded == [h5_file]
+
+
+class TestLoadedBackend:
+    def test_exported_models_report_their_backend(self, exported):
+        directory, h5_file, _ = exported
+        for backend in [InferenceBackend.SAVED_MODEL, InferenceBackend.TFLITE]:
+            loader = make_loader(backend, directory / "exported", directory / "models", fallback=load_keras_model)
+            assert loaded_backend(loader(h5_file)) == (backend, False)
+
+    def test_quantized_export_reports_quantized(self, exported, tmp_path):
+        directory, h5_file, _ = exported
+        export_model(h5_file, [InferenceBackend.TFLITE], tmp_path, directory / "models", quantize=True)
+        loader = make_loader(InferenceBackend.TFLITE, tmp_path, directory / "models", fallback=load_keras_model)
+        assert loaded_backend(loader(h5_file)) == (InferenceBackend.TFLITE, True)
+
+    def test_fallback_reports_keras(self, exported, tmp_path):
+        directory, h5_file, _ = exported
+        loader = make_loader(InferenceBackend.TFLITE, tmp_path, directory / "models", fallback=load_keras_model)
+        assert loaded_backend(loader(h5_file)) == (InferenceBackend.KERAS, False)
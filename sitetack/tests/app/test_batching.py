@@ -0,0 +1,141 @@
+import threading
+import time
+import numpy as np
+import pytest
+from pathlib import Path
+from sitetack.app.backends import InferenceBackend, loaded_backend
+from sitetack.app.batching import BatchedModel, MicroBatcher
+
+
+class FakeModel:
+    """ Scores each kmer as the sum of its codes, and can hold its first call until released """
+
+    def __init__(self, hold_first: bool = False):
+        self.calls = []
+        self.release = threading.Event()
+        if not hold_first:
+            self.release.set()
+        self.started = threading.Event()
+
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        self.calls.append(len(tensor))
+        self.started.set()
+        if len(self.calls) == 1:
+            self.release.wait(5)
+        return tensor.sum(axis=1, keepdims=True).astype(np.float32)
+
+    def predict(self, tensor: np.ndarray) -> np.ndarray:
+        return self.predict_on_batch(tensor)
+
+
+class FailingModel:
+    def predict_on_batch(self, tensor: np.ndarray) -> np.ndarray:
+        raise RuntimeError("model failed")
+
+
+def kmers(count: int, value: int) -> np.ndarray:
+    return np.full((count, 53), value, dtype=np.uint8)
+
+
+def wait_for_queue(model: BatchedModel, requests: int):
+    deadline = time.monotonic() + 5
+    while len(model._queue) < requests and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class TestBatchedModel:
+    def test_lone_request_runs_at_once(self):
+        fake = FakeModel()
+        model = BatchedModel(fake, MicroBatcher(max_batch=100, max_wait=10))
+        start = time.monotonic()
+        np.testing.assert_array_equal(model.predict_on_batch(kmers(3, 1)).reshape(-1), [53, 53, 53])
+        assert time.monotonic() - start < 1
+        assert fake.calls == [3]
+
+    def test_concurrent_requests_are_scored_together(self):
+        fake = FakeModel(hold_first=True)
+        batcher = MicroBatcher(max_batch=100, max_wait=10)
+        model = BatchedModel(fake, batcher)
+        results = {}
+
+        def call(value: int, count: int):
+            results[value] = model.predict_on_batch(kmers(count, value)).reshape(-1)
+
+        first = threading.Thread(target=call, args=(1, 2))
+        first.start()
+        assert fake.started.wait(5)
+        others = [threading.Thread(target=call, args=(value, value)) for value in (2, 3, 4)]
+        for thread in others:
+            thread.start()
+        wait_for_queue(model, 3)
+        fake.release.set()
+        for thread in [first] + others:
+            thread.join(5)
+
+        assert fake.calls == [2, 9]
+        for value, count in [(1, 2), (2, 2), (3, 3), (4, 4)]:
+            np.testing.assert_array_equal(results[value], [53 * value] * count)
+        stats = batcher.stats()
+        assert stats.requests == 4
+        assert stats.batches == 2
+        assert stats.requests_per_batch == 2
+
+    def test_full_batch_stops_waiting(self):
+        fake = FakeModel(hold_first=True)
+        model = BatchedModel(fake, MicroBatcher(max_batch=10, max_wait=10))
+        first = threading.Thread(target=model.predict_on_batch, args=(kmers(1, 1),))
+        first.start()
+        assert fake.started.wait(5)
+        second = threading.Thread(target=model.predict_on_batch, args=(kmers(6, 2),))
+        second.start()
+        wait_for_queue(model, 1)
+        third = threading.Thread(target=model.predict_on_batch, args=(kmers(6, 3),))
+        third.start()
+        # The queue is full, so the second batch starts while the first is still running
+        second.join(5)
+        assert fake.calls == [1, 12]
+        fake.release.set()
+        first.join(5)
+        third.join(5)
+
+    def test_large_requests_bypass_batching(self):
+        fake = FakeModel()
+        batcher = MicroBatcher(max_batch=4, max_wait=10)
+        BatchedModel(fake, batcher).predict_on_batch(kmers(4, 1))
+        assert fake.calls == [4]
+        assert batcher.stats().bypassed == 1
+
+    def test_errors_reach_every_caller(self):
+        model = BatchedModel(FailingModel(), MicroBatcher(max_batch=100, max_wait=1))
+        with pytest.raises(RuntimeError):
+            model.predict_on_batch(kmers(2, 1))
+
+
+class TestMicroBatcher:
+    def test_max_batch_must_be_positive(self):
+        with pytest.raises(ValueError):
+            MicroBatcher(max_batch=0, max_wait=1)
+
+    def test_wrap_returns_batched_models(self):
+        fake = FakeModel()
+        model = MicroBatcher(max_batch=10, max_wait=1).wrap(lambda h5_file: fake)(Path("model.h5"))
+        assert isinstance(model, BatchedModel)
+        assert model.model is fake
+
+    def test_batched_models_report_the_backend_of_their_model(self):
+        batcher = MicroBatcher(max_batch=10, max_wait=1)
+        assert loaded_backend(BatchedModel(FakeModel(), batcher)) == (InferenceBackend.KERAS, False)
+
+        class QuantizedModel(FakeModel):
+            inference_backend = InferenceBackend.TFLITE
+            quantized = True
+
+        assert loaded_backend(BatchedModel(QuantizedModel(), batcher)) == (InferenceBackend.TFLITE, True)
+
+    def test_disabled_batcher_returns_loader(self):
+        def loader(h5_file):
+            return None
+
+        batcher = MicroBatcher(max_batch=10, max_wait=0)
+        assert not batcher.enabled
+        assert batcher.wrap(loader) is loader
@@ -0,0 +1,158 @@
+import os
+from pathlib import Path
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.cache import PredictionCache, SqlitePredictionStore
+from sitetack.app.predict import Predict
+from sitetack.app.sequence import Sequence
+from sitetack.tests.fakes import SumModel
+import numpy as np
+
+
+ALPHABET = Alphabet("ARNDCEQGHILKMFPSTWYVXZ-U")
+
+
+def make_model_file(directory: Path, content: bytes = b"weights") -> Path:
+    h5_file = directory / "model.h5"
+    h5_file.write_bytes(content)
+    return h5_file
+
+
+class TestPredictionCache:
+    def test_memory_tier_evicts_least_recently_used(self):
+        entry_bytes = 1 + 4 + PredictionCache.ENTRY_OVERHEAD
+        cache = PredictionCache(max_bytes=2 * entry_bytes)
+        cache.put(b"a", b"1234")
+        cache.put(b"b", b"5678")
+        assert cache.get(b"a") == b"1234"
+        cache.put(b"c", b"9012")
+        assert cache.get(b"b") is None
+        assert cache.get(b"a") == b"1234"
+        assert cache.get(b"c") == b"9012"
+        assert cache.stats().memory_bytes == 2 * entry_bytes
+
+    def test_memory_tier_bounds_empty_predictions(self):
+        cache = PredictionCache(max_bytes=10 * (32 + PredictionCache.ENTRY_OVERHEAD))
+        for index in range(1000):
+            cache.put(index.to_bytes(32, "big"), b"")
+        stats = cache.stats()
+        assert stats.memory_entries == 10
+        assert stats.memory_bytes == 10 * (32 + PredictionCache.ENTRY_OVERHEAD)
+
+    def test_disabled_memory_tier_keeps_nothing(self):
+        cache = PredictionCache(max_bytes=0)
+        cache.put(b"a", b"")
+        cache.put(b"b", b"1234")
+        assert cache.stats().memory_entries == 0
+        assert cache.get(b"a") is None
+
+    def test_stats_report_hit_ratio(self):
+        cache = PredictionCache(max_bytes=1024)
+        cache.put(b"a", b"1234")
+        cache.get(b"a")
+        cache.get(b"a")
+        cache.get(b"b")
+        stats = cache.stats()
+        assert (stats.memory_hits, stats.disk_hits, stats.misses) == (2, 0, 1)
+        assert stats.hit_ratio == 2 / 3
+
+    def test_disk_tier_is_kept_across_instances(self, tmp_path):
+        cache = PredictionCache(max_bytes=1024, directory=tmp_path, max_disk_bytes=1024)
+        cache.put(b"a", b"1234")
+        cache.close()
+
+        cache = PredictionCache(max_bytes=1024, directory=tmp_path, max_disk_bytes=1024)
+        assert cache.get(b"a") == b"1234"
+        assert cache.get(b"a") == b"1234"
+        stats = cache.stats()
+        assert (stats.memory_hits, stats.disk_hits) == (1, 1)
+        assert stats.disk_bytes == 4
+        cache.close()
+
+    def test_disk_tier_read_errors_count_as_misses(self, tmp_path):
+        cache = PredictionCache(max_bytes=1024, directory=tmp_path, max_disk_bytes=1024)
+        cache.close()
+        assert cache.get(b"a") is None
+        assert cache.stats().misses == 1
+
+    def test_disk_tier_evicts_least_recently_used_beyond_max_bytes(self, tmp_path):
+        store = SqlitePredictionStore(tmp_path / "predictions.sqlite", max_bytes=10)
+        store.put(b"a", b"1234")
+        store.put(b"b", b"5678")
+        store.get(b"a")
+        store.put(b"c", b"9012")
+        assert store.get(b"b") is None
+        assert store.get(b"a") == b"1234"
+        assert store.size_bytes == 8
+        store.close()
+
+    def test_disk_tier_evicts_against_the_writes_of_every_process(self, tmp_path):
+        first = SqlitePredictionStore(tmp_path / "predictions.sqlite", max_bytes=10)
+        second = SqlitePredictionStore(tmp_path / "predictions.sqlite", max_bytes=10)
+        first.put(b"a", b"1234")
+        second.put(b"b", b"5678")
+        assert first.size_bytes == second.size_bytes == 8
+        first.put(b"c", b"9012")
+        assert second.get(b"a") is None
+        assert second.size_bytes == 8
+        first.close()
+        second.close()
+
+    def test_for_model_returns_none_when_disabled(self, tmp_path):
+        cache = PredictionCache(max_bytes=0)
+        assert cache.for_model(make_model_file(tmp_path), ALPHABET, ["S", "T"], 53) is None
+
+    def test_model_identity_changes_with_model_content(self, tmp_path):
+        cache = PredictionCache(max_bytes=1024)
+        h5_file = make_model_file(tmp_path, b"weights")
+        first = cache.model_identity(h5_file, ALPHABET, ["S", "T"], 53)
+        assert cache.model_identity(h5_file, ALPHABET, ["S", "T"], 53) == first
+        assert cache.model_identity(h5_file, ALPHABET, ["K"], 53) != first
+
+        h5_file.write_bytes(b"retrained")
+        os.utime(h5_file, ns=(0, 0))
+        assert cache.model_identity(h5_file, ALPHABET, ["S", "T"], 53) != first
+
+    def test_model_identity_changes_with_backend_and_quantization(self, tmp_path):
+        cache = PredictionCache(max_bytes=1024)
+        h5_file = make_model_file(tmp_path)
+        identities = [
+            cache.model_identity(h5_file, ALPHABET, ["S", "T"], 53, backend, quantized)
+            for backend, quantized in [("keras", False), ("tflite", False), ("tflite", True)]
+        ]
+        assert len(set(identities)) == 3
+
+    def test_model_cache_round_trips_probabilities(self, tmp_path):
+        cache = PredictionCache(max_bytes=1024).for_model(make_model_file(tmp_path), ALPHABET, ["S", "T"], 53)
+        assert cache is not None
+        probabilities = np.asarray([0.1, 0.25, 0.9], dtype=np.float32)
+        cache.put("MSTK", probabilities)
+        cached = cache.get("MSTK")
+        assert cached is not None and cached.dtype == np.float32
+        np.testing.assert_array_equal(cached, probabilities)
+        assert cache.get("MSTR") is None
+
+
+class TestIterPredictionsWithCache:
+    def test_cached_sequences_skip_inference(self, tmp_path):
+        sequences = [Sequence("a", "MSTKS"), Sequence("b", "MKKK"), Sequence("c", "TTSM")]
+        cache = PredictionCache(max_bytes=1024).for_model(make_model_file(tmp_path), ALPHABET, ["S", "T"], 53)
+        model = SumModel()
+        first = list(Predict.iter_predictions(sequences, ["S", "T"], ALPHABET, model, batch_size=2, cache=cache))
+        assert sum(model.batch_sizes) == 6
+
+        model = SumModel()
+        second = list(Predict.iter_predictions(sequences, ["S", "T"], ALPHABET, model, batch_size=2, cache=cache))
+        assert model.batch_sizes == []
+        assert second == first
+        assert first == list(Predict.iter_predictions(sequences, ["S", "T"], ALPHABET, SumModel(), batch_size=2))
+
+    def test_cached_and_scored_sequences_keep_their_order(self, tmp_path):
+        cache = PredictionCache(max_bytes=1024).for_model(make_model_file(tmp_path), ALPHABET, ["S", "T"], 53)
+        list(Predict.iter_predictions([Sequence("b", "TTSM")], ["S", "T"], ALPHABET, SumModel(), cache=cache))
+
+        sequences = [Sequence("a", "MSTKS"), Sequence("b", "TTSM"), Sequence("c", "SKT")]
+        model = SumModel()
+        predictions = list(Predict.iter_predictions(sequences, ["S", "T"], ALPHABET, model, batch_size=4, cache=cache))
+        assert [prediction.sequence_name for prediction in predictions] == ["a", "b", "c"]
+        assert sum(model.batch_sizes) == 5
+        assert predictions == list(Predict.iter_predictions(sequences, ["S", "T"], ALPHABET, SumModel(), batch_size=4))
@@ -0,0 +1,182 @@
+import gzip
+import importlib.resources
+import io
+import json
+import pytest
+from pathlib import Path
+from sitetack.app.cli import (
+    Checkpoint,
+    CliError,
+    OutputFormat,
+    Progress,
+    ReadAhead,
+    TextOutput,
+    ParquetOutput,
+    find_fasta_files,
+    main,
+    score_files,
+)
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.predict import SequencePrediction, SitePrediction
+
+
+def fake_predict(sequences, ptm, organism, label, batch_size):
+    """ Scores every site of the PTM's amino acids with probability 0.5 """
+    for sequence in sequences:
+        site_predictions = [
+            SitePrediction(i + 1, char, 0.5)
+            for i, char in enumerate(sequence.sequence) if char in ptm.value.amino_acids
+        ]
+        yield SequencePrediction(sequence.sequence_name, sequence.sequence, site_predictions)
+
+
+def failing_on(path_name):
+    """ Same as fake_predict, but fails for the sequences of a given file """
+    def predict(sequences, ptm, organism, label, batch_size):
+        if sequences.path.endswith(path_name):
+            raise RuntimeError("model exploded")
+        return fake_predict(sequences, ptm, organism, label, batch_size)
+    return predict
+
+
+def write_inputs(directory: Path):
+    (directory / "a.fasta").write_text(">a1\nSTK\n>a2\nKKS\n")
+    with gzip.open(directory / "b.fa.gz", "wt") as f:
+        f.write(">b1\nTTT\n")
+    (directory / "notes.md").write_text("not a fasta file")
+    return [str(directory / "a.fasta"), str(directory / "b.fa.gz")]
+
+
+def score(inputs, output, checkpoint_file, predict=fake_predict, progress=None):
+    return score_files(
+        inputs,
+        output,
+        checkpoint_file,
+        PtmKind.PHOSPHORYLATION_ST,
+        OrganismKind.HUMAN,
+        LabelKind.NO_LABELS,
+        batch_size=16,
+        progress=progress,
+        predict=predict,
+    )
+
+
+class TestFindFastaFiles:
+    def test_find_fasta_files_expands_directories_sorted(self, tmp_path):
+        expected = write_inputs(tmp_path)
+        assert find_fasta_files([str(tmp_path)]) == expected
+
+    def test_find_fasta_files_keeps_files_and_stdin(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        assert find_fasta_files([inputs[1], "-", inputs[0]]) == [inputs[1], "-", inputs[0]]
+
+    def test_find_fasta_files_raises_when_missing(self, tmp_path):
+        with pytest.raises(CliError):
+            find_fasta_files([str(tmp_path / "missing.fasta")])
+
+    def test_output_format_from_path(self):
+        assert OutputFormat.from_path(Path("out.csv")) == OutputFormat.CSV
+        assert OutputFormat.from_path(Path("out.jsonl")) == OutputFormat.NDJSON
+        assert OutputFormat.from_path(Path("out.parquet")) == OutputFormat.PARQUET
+
+
+class TestReadAhead:
+    def test_read_ahead_yields_sequences_in_order(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        names = [sequence.sequence_name for sequence in ReadAhead(inputs[0], buffer=1)]
+        assert names == ["a1", "a2"]
+
+    def test_read_ahead_raises_error_of_reader(self):
+        def read(path):
+            raise OSError("disk on fire")
+
+        with pytest.raises(OSError):
+            list(ReadAhead("x.fasta", buffer=1, read=read))
+
+
+class TestScoreFiles:
+    def test_score_files_writes_csv_in_input_order(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        output_file = tmp_path / "out.csv"
+        score(inputs, TextOutput(output_file, OutputFormat.CSV), tmp_path / "checkpoint.json")
+        assert output_file.read_text().splitlines() == [
+            "sequence name,site,amino acid,probability",
+            "a1,1,S,0.5000",
+            "a1,2,T,0.5000",
+            "a2,3,S,0.5000",
+            "b1,1,T,0.5000",
+            "b1,2,T,0.5000",
+            "b1,3,T,0.5000",
+        ]
+        assert not (tmp_path / "checkpoint.json").exists()
+
+    def test_score_files_writes_ndjson(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        output_file = tmp_path / "out.ndjson"
+        score(inputs, TextOutput(output_file, OutputFormat.NDJSON), tmp_path / "checkpoint.json")
+        lines = [json.loads(line) for line in output_file.read_text().splitlines()]
+        assert [line["sequence_name"] for line in lines] == ["a1", "a2", "b1"]
+
+    def test_score_files_resumes_after_failure(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        checkpoint_file = tmp_path / "checkpoint.json"
+        expected_file = tmp_path / "expected.csv"
+        score(inputs, TextOutput(expected_file, OutputFormat.CSV), tmp_path / "expected.json")
+
+        output_file = tmp_path / "out.csv"
+        with pytest.raises(CliError):
+            score(inputs, TextOutput(output_file, OutputFormat.CSV), checkpoint_file, predict=failing_on("b.fa.gz"))
+        checkpoint = Checkpoint.load(checkpoint_file)
+        assert checkpoint is not None and checkpoint.completed == inputs[:1]
+
+        with open(output_file, "a") as f:
+            f.write("partial row of an interrupted input")
+        score(inputs, TextOutput(output_file, OutputFormat.CSV), checkpoint_file, predict=failing_on("a.fasta"))
+        assert output_file.read_text() == expected_file.read_text()
+        assert not checkpoint_file.exists()
+
+    def test_score_files_refuses_checkpoint_of_other_options(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        checkpoint_file = tmp_path / "checkpoint.json"
+        Checkpoint({"ptm": "ACETYLATION_K"}, completed=inputs[:1]).save(checkpoint_file)
+        with pytest.raises(CliError):
+            score(inputs, TextOutput(tmp_path / "out.csv", OutputFormat.CSV), checkpoint_file)
+
+    def test_score_files_refuses_to_resume_standard_input(self, tmp_path):
+        checkpoint_file = tmp_path / "checkpoint.json"
+        options = {"ptm": "PHOSPHORYLATION_ST", "organism": "HUMAN", "label": "NO_LABELS", "format": "csv"}
+        Checkpoint(options, completed=["-"]).save(checkpoint_file)
+        with pytest.raises(CliError, match="standard input"):
+            score(["-"], TextOutput(tmp_path / "out.csv", OutputFormat.CSV), checkpoint_file)
+
+    def test_score_files_reports_progress(self, tmp_path):
+        inputs = write_inputs(tmp_path)
+        stream = io.StringIO()
+        score(inputs, TextOutput(tmp_path / "out.csv", OutputFormat.CSV), tmp_path / "checkpoint.json", progress=Progress(2, stream))
+        assert stream.getvalue().splitlines()[-1].startswith("2/2 files, 3 sequences, 6 sites")
+
+    def test_score_files_writes_one_parquet_file_per_input(self, tmp_path):
+        parquet = pytest.importorskip("pyarrow.parquet")
+        inputs = write_inputs(tmp_path)
+        output_directory = tmp_path / "out.parquet"
+        score(inputs, ParquetOutput(output_directory), tmp_path / "checkpoint.json")
+        assert sorted(path.name for path in output_directory.iterdir()) == ["part-00000.parquet", "part-00001.parquet"]
+        table = parquet.read_table(str(output_directory / "part-00000.parquet"))
+        assert table.column("sequence_name").to_pylist() == ["a1", "a1", "a2"]
+        assert table.column("site").to_pylist() == [1, 2, 3]
+
+
+class TestMain:
+    def test_main_scores_fasta_file(self, tmp_path):
+        with importlib.resources.path("sitetack.tests.resources", "two_sequences.fasta") as fasta_path:
+            output_file = tmp_path / "out.csv"
+            exit_code = main([
+                str(fasta_path), "-o", str(output_file), "--ptm", "PHOSPHORYLATION_ST", "--organism", "HUMAN", "--quiet",
+            ])
+        assert exit_code == 0
+        assert output_file.read_text().startswith("sequence name,site,amino acid,probability\n")
+
+    def test_main_returns_error_when_input_missing(self, tmp_path, capsys):
+        exit_code = main([str(tmp_path / "missing.fasta"), "-o", str(tmp_path / "out.csv"), "--ptm", "PHOSPHORYLATION_ST", "--organism", "HUMAN"])
+        assert exit_code == 1
+        assert "No such file or directory" in capsys.readouterr().err
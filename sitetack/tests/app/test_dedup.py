@@ -0,0 +1,57 @@
+from sitetack.app.dedup import KmerDeduplicator
+from sitetack.tests.fakes import SumModel
+import numpy as np
+
+
+def expected(tensor):
+    return (tensor.sum(axis=1) / 1000.0).astype(np.float32)
+
+
+class TestKmerDeduplicator:
+    def test_predict_on_batch_scores_each_distinct_kmer_once(self):
+        tensor = np.array([[1, 2, 3], [4, 5, 6], [1, 2, 3], [1, 2, 3], [7, 8, 9]], dtype=np.uint8)
+        model = SumModel()
+        probabilities = KmerDeduplicator().predict_on_batch(tensor, model)
+        assert probabilities.tolist() == expected(tensor).tolist()
+        assert len(model.batches) == 1
+        assert len(model.batches[0]) == 3
+
+    def test_predict_accepts_sliced_tensors(self):
+        tensor = np.array([[1, 2, 3, 0], [1, 2, 3, 1], [4, 5, 6, 0]], dtype=np.int64)[:, :3]
+        model = SumModel()
+        probabilities = KmerDeduplicator().predict(tensor, model)
+        assert probabilities.tolist() == expected(tensor).tolist()
+        assert len(model.batches[0]) == 2
+
+    def test_cache_skips_kmers_scored_in_earlier_batches(self):
+        deduplicator = KmerDeduplicator(cache_size=10)
+        model = SumModel()
+        deduplicator.predict_on_batch(np.array([[1, 2], [3, 4]], dtype=np.uint8), model)
+        tensor = np.array([[3, 4], [5, 6], [1, 2]], dtype=np.uint8)
+        probabilities = deduplicator.predict_on_batch(tensor, model)
+        assert probabilities.tolist() == expected(tensor).tolist()
+        assert model.batches[-1].tolist() == [[5, 6]]
+
+    def test_cache_evicts_least_recently_used_kmers(self):
+        deduplicator = KmerDeduplicator(cache_size=2)
+        model = SumModel()
+        deduplicator.predict_on_batch(np.array([[1], [2]], dtype=np.uint8), model)
+        deduplicator.predict_on_batch(np.array([[1], [3]], dtype=np.uint8), model)
+        deduplicator.predict_on_batch(np.array([[1], [2], [3]], dtype=np.uint8), model)
+        assert model.batches[-1].tolist() == [[2]]
+
+    def test_cache_is_kept_per_model(self):
+        deduplicator = KmerDeduplicator(cache_size=10)
+        deduplicator.predict_on_batch(np.array([[1, 2]], dtype=np.uint8), SumModel())
+        other = SumModel()
+        deduplicator.predict_on_batch(np.array([[1, 2]], dtype=np.uint8), other)
+        assert len(other.batches) == 1
+
+    def test_stats_report_dedup_ratio(self):
+        deduplicator = KmerDeduplicator(cache_size=10)
+        model = SumModel()
+        deduplicator.predict_on_batch(np.array([[1], [1], [2], [2]], dtype=np.uint8), model)
+        deduplicator.predict_on_batch(np.array([[1], [3]], dtype=np.uint8), model)
+        stats = deduplicator.stats()
+        assert (stats.kmers, stats.unique_kmers, stats.cache_hits, stats.scored_kmers) == (6, 4, 1, 3)
+        assert stats.dedup_ratio == 0.5
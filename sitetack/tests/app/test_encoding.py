@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.encoding import KmerEncoder
+from sitetack.app.kmer import Kmer
+from sitetack.app.predict import Predict
+from sitetack.app.sequence import Sequence
+
+
+class TestKmerEncoder:
+    @classmethod
+    def setup_class(cls):
+        cls.alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV@&-U")
+
+    def expected_tensor(self, sequence: str, sites, length: int) -> np.ndarray:
+        kmers = [Kmer.site_to_kmer(sequence, site, length) for site in sites]
+        return np.array([Predict.to_one_hot(kmer, self.alphabet) for kmer in kmers]).reshape(len(kmers), length)
+
+    def test_find_sites_groups_by_amino_acid(self):
+        sites = KmerEncoder.find_sites("STMSTS", ["S", "T"])
+        assert sites.tolist() == [1, 4, 6, 2, 5]
+
+    def test_find_sites_matches_get_phosporylation_sites(self):
+        sequence = Sequence(sequence_name="RNase_1", sequence="SMASLEKS")
+        assert KmerEncoder.find_sites(sequence.sequence, ["S"]).tolist() == sequence.get_phosporylation_sites("S")
+
+    def test_find_sites_returns_empty_array_when_no_sites(self):
+        assert len(KmerEncoder.find_sites("MALEK", ["S"])) == 0
+
+    @pytest.mark.parametrize("sequence", ["S", "AKA", "ABCDEFGHIK", "MSTAS" * 30])
+    @pytest.mark.parametrize("length", [1, 5, 7, 53])
+    def test_encode_sites_matches_kmers(self, sequence, length):
+        sequence = sequence.replace("B", "@")
+        sites = np.arange(1, len(sequence) + 1)
+        actual = KmerEncoder.encode_sites(sequence, sites, self.alphabet, length)
+        assert np.array_equal(actual, self.expected_tensor(sequence, sites, length))
+
+    def test_encode_sites_random_sequences_match_kmers(self):
+        rng = np.random.default_rng(0)
+        letters = np.array(list("ARNDCEQGHILKMFPSTWYV@&U"))
+        for _ in range(20):
+            sequence = "".join(rng.choice(letters, size=rng.integers(1, 200)))
+            sites = KmerEncoder.find_sites(sequence, ["S", "T"])
+            actual = KmerEncoder.encode_sites(sequence, sites, self.alphabet, Predict.KMER_LENGTH)
+            assert actual.shape == (len(sites), Predict.KMER_LENGTH)
+            if len(sites):
+                assert np.array_equal(actual, self.expected_tensor(sequence, sites, Predict.KMER_LENGTH))
+
+    def test_encode_sites_has_uint8_dtype(self):
+        tensor = KmerEncoder.encode_sites("MSM", np.array([2]), self.alphabet, 5)
+        assert tensor.dtype == np.uint8
+
+    def test_encode_sites_no_sites_has_empty_tensor(self):
+        tensor = KmerEncoder.encode_sites("MALEK", np.array([], dtype=np.int64), self.alphabet, 53)
+        assert tensor.shape == (0, 53)
+
+    def test_encode_sites_raises_when_kmer_has_invalid_character(self):
+        with pytest.raises(ValueError):
+            KmerEncoder.encode_sites("MSX", np.array([2]), self.alphabet, 5)
+
+    def test_encode_sites_ignores_invalid_character_outside_kmers(self):
+        tensor = KmerEncoder.encode_sites("MSMMMMX", np.array([2]), self.alphabet, 3)
+        assert np.array_equal(tensor, self.expected_tensor("MSM", [2], 3))
+
+    def test_encode_sites_raises_when_length_is_even(self):
+        with pytest.raises(ValueError):
+            KmerEncoder.encode_sites("MSM", np.array([2]), self.alphabet, 4)
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import pytest
+from sitetack.app.executor import ExecutorSaturated, InferenceExecutor
+
+
+class TestInferenceExecutor:
+    def test_run_returns_result(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        assert asyncio.run(executor.run(pow, 2, 10)) == 1024
+
+    def test_run_raises_exception_of_call(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        with pytest.raises(ZeroDivisionError):
+            asyncio.run(executor.run(lambda: 1 / 0))
+
+    def test_run_does_not_block_event_loop(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        release = threading.Event()
+
+        async def main():
+            task = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.01)  # the event loop keeps running while the call blocks
+            assert not task.done()
+            release.set()
+            return await task
+
+        assert asyncio.run(main()) is True
+
+    def test_submit_raises_when_saturated(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        executor.submit(release.wait)
+        executor.submit(release.wait)
+        with pytest.raises(ExecutorSaturated):
+            executor.submit(release.wait)
+        release.set()
+
+    def test_submit_frees_slot_when_call_finishes(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        executor.submit(lambda: None).result()
+        executor.shutdown()  # wait for the done callbacks
+        assert executor.pending == 0
+
+    def test_max_workers_must_be_positive(self):
+        with pytest.raises(ValueError):
+            InferenceExecutor(max_workers=0, max_queue=0)
+
+    def test_shared_returns_the_same_executor(self):
+        assert InferenceExecutor.shared() is InferenceExecutor.shared()
+
+    def test_iterate_yields_items_in_order(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+
+        async def main():
+            return [item async for item in executor.iterate(range, 100, buffer=4)]
+
+        assert asyncio.run(main()) == list(range(100))
+
+    def test_iterate_raises_exception_of_iterable(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+
+        def failing():
+            yield 1
+            raise ZeroDivisionError()
+
+        async def main():
+            return [item async for item in executor.iterate(failing)]
+
+        with pytest.raises(ZeroDivisionError):
+            asyncio.run(main())
+
+    def test_iterate_holds_slot_until_consumer_stops(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        produced = []
+
+        def endless():
+            while True:
+                produced.append(len(produced))
+                yield produced[-1]
+
+        async def main():
+            items = executor.iterate(endless, buffer=2)
+            first = await items.__anext__()
+            with pytest.raises(ExecutorSaturated):
+                executor.submit(lambda: None)
+            await items.aclose()
+            return first
+
+        assert asyncio.run(main()) == 0
+        executor.shutdown()  # the producer notices the consumer stopped
+        assert executor.pending == 0
+        assert len(produced) <= 4  # the producer waits for the consumer instead of running ahead
+
+    def test_iterate_closes_the_iterable_on_the_pool_when_the_consumer_stops(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        closed_on = []
+
+        def endless():
+            try:
+                while True:
+                    yield 0
+            finally:
+                closed_on.append(threading.current_thread().name)
+
+        async def main():
+            items = executor.iterate(endless, buffer=1)
+            await items.__anext__()
+            await items.aclose()
+
+        asyncio.run(main())
+        executor.shutdown()
+        assert len(closed_on) == 1 and closed_on[0].startswith("sitetack-inference")
+
+    def test_iterate_raises_when_saturated(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0)
+        release = threading.Event()
+        executor.submit(release.wait)
+
+        async def main():
+            executor.iterate(range, 10)
+
+        with pytest.raises(ExecutorSaturated):
+            asyncio.run(main())
+        release.set()
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from pathlib import Path
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.export import check_equivalence, find_test_sets, read_test_kmers
+
+MUSITEDEEP_TEST_DIRECTORY = Path(__file__).resolve().parents[3] / "test" / "MusiteDeep"
+
+ALPHABET = Alphabet("ARNDCEQGHILKMFPSTWYVXZ-U")
+
+
+class ConstantModel:
+    def __init__(self, probabilities):
+        self.probabilities = np.asarray(probabilities, dtype=np.float32)
+
+    def predict(self, tensor):
+        return self.probabilities[:len(tensor), None]
+
+
+class TestTestSets:
+    @pytest.mark.skipif(not MUSITEDEEP_TEST_DIRECTORY.is_dir(), reason="test/MusiteDeep is not part of the installed package")
+    def test_find_test_sets_maps_every_musitedeep_file_to_a_human_model(self):
+        test_sets = find_test_sets(MUSITEDEEP_TEST_DIRECTORY)
+        assert len(test_sets) == 13
+        assert all(organism == OrganismKind.HUMAN and label == LabelKind.NO_LABELS for _, organism, label in test_sets)
+        assert len(test_sets[(PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)]) == 2
+
+    def test_read_test_kmers_skips_rows_that_are_not_kmers(self, tmp_path):
+        csv_file = tmp_path / "Test_kmers_no_labels_Phosphorylation_ST_Humans.csv"
+        kmer = "A" * 26 + "S" + "-" * 26
+        csv_file.write_text(f"{kmer}, 1.0\n{'K' + kmer}, 0.0\n{kmer[:-1]}*, 0.0\n")
+        tensor = read_test_kmers([csv_file], ALPHABET)
+        assert tensor.shape == (1, 53)
+        assert tensor[0].tolist() == ALPHABET.encode(kmer).tolist()
+
+
+class TestCheckEquivalence:
+    def test_check_equivalence_reports_difference_and_flips(self):
+        tensor = np.zeros((3, 53), dtype=np.uint8)
+        report = check_equivalence(ConstantModel([0.1, 0.49, 0.9]), ConstantModel([0.1, 0.51, 0.9]), tensor)
+        assert report.kmers == 3
+        assert report.max_difference == pytest.approx(0.02, abs=1e-6)
+        assert report.flipped == 1
+        assert report.passed(0.05)
+        assert not report.passed(1e-4)
@@ -1,6 +1,8 @@
+import gzip
 import importlib.resources
+import io
 from pathlib import Path
-from sitetack.app.fasta import Fasta
+from sitetack.app.fasta import Fasta, FastaError
 from sitetack.app.sequence import Sequence
 from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
 from sitetack.app.model import Model
@@ -84,6 +86,43 @@ class TestFasta:
         sequences = Fasta.read_sequences_from_text(text)
         assert sequences == []
 
+    def test_read_sequences_from_file_reads_gzipped_file(self, tmp_path):
+        gzipped_path = tmp_path / "two_sequences.fasta.gz"
+        with gzip.open(gzipped_path, 'wt') as f:
+            f.write(self.two_sequences_path.read_text())
+        assert Fasta.read_sequences_from_file(gzipped_path) == self.two_sequences_sequences
+
+    def test_iter_sequences_from_file_with_mmap_matches_buffered_read(self):
+        sequences = list(Fasta.iter_sequences_from_file(self.two_sequences_path, use_mmap=True))
+        assert sequences == self.two_sequences_sequences
+        assert list(Fasta.iter_sequences_from_file(self.empty_path, use_mmap=True)) == []
+
+    def test_iter_sequences_joins_lines_and_skips_blank_lines(self):
+        lines = [">first description\n", "MSK\r\n", "\n", "  TTA  \n", ">second\n", "S"]
+        assert list(Fasta.iter_sequences(lines)) == [
+            Sequence(sequence_name="first description", sequence="MSKTTA"),
+            Sequence(sequence_name="second", sequence="S"),
+        ]
+
+    def test_iter_sequences_yields_each_record_before_reading_the_next(self):
+        def lines():
+            yield ">first"
+            yield "MSK"
+            yield ">second"
+            raise AssertionError("read too far")
+
+        assert next(Fasta.iter_sequences(lines())) == Sequence(sequence_name="first", sequence="MSK")
+
+    def test_iter_sequences_reads_text_handle(self):
+        handle = io.StringIO(self.two_sequences_path.read_text())
+        assert list(Fasta.iter_sequences(handle)) == self.two_sequences_sequences
+
+    def test_count_sequences_in_file_counts_gzipped_file(self, tmp_path):
+        gzipped_path = tmp_path / "two_sequences.fasta.gz"
+        with gzip.open(gzipped_path, 'wt') as f:
+            f.write(self.two_sequences_path.read_text())
+        assert Fasta.count_sequences_in_file(gzipped_path) == 2
+
     def test_validate_fasta_text_returns_true_when_valid_one_sequence(self):
         with open(self.one_sequence_path, 'r') as f:
             text = f.read()
@@ -113,4 +152,60 @@ class TestFasta:
 
     def test_validate_fasta_text_returns_false_when_duplicate_headers(self):
         text = """>header1\nAGCT\n>header1\nATGC"""
-        assert Fasta.validate_fasta_text(text, alphabet=self.alphabet) == (False, "Duplicate sequence name found: header1")
\ No newline at end of file
+        assert Fasta.validate_fasta_text(text, alphabet=self.alphabet) == (False, "Duplicate sequence name found: header1")
+
+    def test_validate_fasta_text_accepts_windows_line_endings(self):
+        text = ">header1\r\nAGCT\r\n>header2\r\nATGC\r\n"
+        assert Fasta.validate_fasta_text(text, alphabet=self.alphabet) == (True, "The FASTA text is valid.")
+
+    def test_validate_fasta_text_returns_false_when_whitespace_inside_sequence_line(self):
+        text = ">header1\nAG CT"
+        assert Fasta.validate_fasta_text(text, alphabet=self.alphabet)[0] is False
+
+    def test_validate_fasta_text_does_not_print(self, capsys):
+        with open(self.two_sequences_path, 'r') as f:
+            Fasta.validate_fasta_text(f.read(), alphabet=self.alphabet)
+        assert capsys.readouterr().out == ""
+
+    def test_find_errors_locates_invalid_character(self):
+        text = ">header1\nAGCT\n  AG*T  \n>header2\nATGC"
+        assert Fasta.find_errors(text, self.alphabet) == [
+            FastaError(f"Invalid character found in sequence. Valid characters are: {self.alphabet.str}", 3, 5, "header1")
+        ]
+
+    def test_find_errors_collects_all_errors_when_max_errors_is_none(self):
+        text = "AGCT\n>header1\nAG*T\n>header1\nATGC\n>header2\n"
+        errors = Fasta.find_errors(text, self.alphabet, max_errors=None)
+        assert [(error.line, error.column, error.sequence_name) for error in errors] == [
+            (1, 1, None),
+            (3, 3, "header1"),
+            (4, 2, "header1"),
+            (6, 1, "header2"),
+        ]
+        assert errors[2].message == "Duplicate sequence name found: header1"
+        assert errors[3].message == "No sequence data found after header lines."
+
+    def test_find_errors_stops_at_max_errors(self):
+        text = ">header1\nAG*T\n>header2\nAG*T\n>header3\nAG*T"
+        assert len(Fasta.find_errors(text, self.alphabet, max_errors=2)) == 2
+
+    def test_fasta_error_describe_includes_location(self):
+        error = FastaError("Invalid character", 3, 5, "header1")
+        assert error.describe() == "Invalid character (line 3, column 5, sequence header1)"
+
+    def test_parse_matches_read_sequences_from_text_when_valid(self):
+        with open(self.two_sequences_path, 'r') as f:
+            text = f.read()
+        sequences, errors = Fasta.parse(text, self.alphabet)
+        assert errors == []
+        assert sequences == Fasta.read_sequences_from_text(text)
+
+    def test_parse_joins_lines_with_surrounding_whitespace(self):
+        text = "  >header1 \n  AG \n\tCT\r\n>header2\nA"
+        sequences, errors = Fasta.parse(text, self.alphabet)
+        assert errors == []
+        assert sequences == [Sequence(sequence_name="header1", sequence="AGCT"), Sequence(sequence_name="header2", sequence="A")]
+
+    def test_parse_returns_errors_when_invalid(self):
+        _, errors = Fasta.parse(">header1\nA*", self.alphabet)
+        assert [(error.line, error.column) for error in errors] == [(2, 2)]
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+import pytest
+import numpy as np
+from starlette.responses import JSONResponse
+from sitetack.app.formats import (
+    CSV_HEADER,
+    ResultFormat,
+    iter_serialized,
+    sequence_prediction_to_dict,
+    to_arrow,
+    to_csv,
+    to_csv_rows,
+    to_json,
+    to_ndjson_line,
+)
+from sitetack.app.predict import PredictionColumns, SequencePrediction, SequencePredictions, SitePrediction, SitePredictions
+
+
+def sequence_predictions():
+    return [
+        SequencePrediction("sp|P1|A", "MSKT", [SitePrediction(2, "S", 0.123456), SitePrediction(4, "T", 0.9)]),
+        SequencePrediction("no sites", "MAAA", []),
+        SequencePrediction("name, with comma", "S", [SitePrediction(1, "S", 0.5)]),
+        SequencePrediction('ünïcode "quoted"', "ST", SitePredictions.of_sequence("ST", np.array([1, 2]), [0.1, 0.2])),
+    ]
+
+
+class TestFormats:
+    def test_sequence_prediction_to_dict_matches_asdict(self):
+        predictions = sequence_predictions()
+        expected = SequencePredictions(predictions).to_dict()["sequence_predictions"]
+        assert [sequence_prediction_to_dict(prediction) for prediction in predictions] == expected
+
+    def test_to_ndjson_line_is_one_json_line(self):
+        line = to_ndjson_line(sequence_predictions()[0])
+        assert line.endswith("\n") and line.count("\n") == 1
+        assert json.loads(line)["site_predictions"][0] == {"site": 2, "amino_acid": "S", "probability": 0.123456}
+
+    def test_to_csv_rows_matches_frontend_layout(self):
+        assert to_csv_rows(sequence_predictions()[0]) == "sp|P1|A,2,S,0.1235\nsp|P1|A,4,T,0.9000\n"
+
+    def test_to_csv_rows_is_empty_without_sites(self):
+        assert to_csv_rows(sequence_predictions()[1]) == ""
+
+    def test_to_csv_rows_quotes_names_with_commas(self):
+        rows = list(csv.reader(io.StringIO(to_csv_rows(sequence_predictions()[2]))))
+        assert rows == [["name, with comma", "1", "S", "0.5000"]]
+
+    def test_iter_serialized_ndjson_yields_one_chunk_per_sequence(self):
+        chunks = list(iter_serialized(sequence_predictions(), ResultFormat.NDJSON))
+        assert [json.loads(chunk)["sequence_name"] for chunk in chunks] == [
+            "sp|P1|A", "no sites", "name, with comma", 'ünïcode "quoted"'
+        ]
+
+    def test_iter_serialized_csv_starts_with_header(self):
+        chunks = list(iter_serialized(sequence_predictions(), ResultFormat.CSV))
+        assert chunks[0] == CSV_HEADER
+        assert len(list(csv.reader(io.StringIO("".join(chunks))))) == 6
+
+    def test_iter_serialized_is_lazy(self):
+        def predictions():
+            yield sequence_predictions()[0]
+            raise AssertionError("consumed too early")
+
+        chunks = iter_serialized(predictions(), ResultFormat.NDJSON)
+        assert json.loads(next(chunks))["sequence_name"] == "sp|P1|A"
+
+    def test_iter_serialized_rejects_json(self):
+        with pytest.raises(ValueError):
+            list(iter_serialized(sequence_predictions(), ResultFormat.JSON))
+
+    def test_media_types(self):
+        assert ResultFormat.NDJSON.media_type == "application/x-ndjson"
+        assert ResultFormat.CSV.media_type == "text/csv"
+
+    def test_to_json_matches_the_json_response_of_to_dict(self):
+        predictions = sequence_predictions()
+        expected = JSONResponse(SequencePredictions(predictions).to_dict()).body.decode()
+        assert to_json(predictions) == expected
+        assert to_json(PredictionColumns.from_predictions(predictions)) == expected
+
+    def test_to_json_rejects_non_finite_probabilities(self):
+        with pytest.raises(ValueError):
+            to_json([SequencePrediction("nan", "S", [SitePrediction(1, "S", float("nan"))])])
+
+    def test_to_ndjson_line_matches_json_dumps(self):
+        for prediction in sequence_predictions():
+            assert to_ndjson_line(prediction) == json.dumps(sequence_prediction_to_dict(prediction)) + "\n"
+
+    def test_to_csv_rows_quotes_names_with_quotes(self):
+        rows = list(csv.reader(io.StringIO(to_csv_rows(sequence_predictions()[3]))))
+        assert rows == [['ünïcode "quoted"', "1", "S", "0.1000"], ['ünïcode "quoted"', "2", "T", "0.2000"]]
+
+    def test_to_csv_is_the_streamed_csv(self):
+        predictions = sequence_predictions()
+        assert to_csv(predictions) == "".join(iter_serialized(predictions, ResultFormat.CSV))
+
+    def test_to_arrow_has_one_row_per_site(self):
+        pytest.importorskip("pyarrow")
+        table = to_arrow(sequence_predictions())
+        assert table.column_names == ["sequence_name", "site", "amino_acid", "probability"]
+        assert table.column("sequence_name").to_pylist() == ["sp|P1|A", "sp|P1|A", "name, with comma", 'ünïcode "quoted"', 'ünïcode "quoted"']
+        assert table.column("site").to_pylist() == [2, 4, 1, 1, 2]
+        assert table.column("amino_acid").to_pylist() == ["S", "T", "S", "S", "T"]
+        np.testing.assert_allclose(table.column("probability").to_pylist(), [0.123456, 0.9, 0.5, 0.1, 0.2], rtol=1e-6)
@@ -0,0 +1,60 @@
+import json
+import subprocess
+import sys
+import pytest
+
+
+""" Imports the given modules in a fresh interpreter and reports whether TensorFlow was imported,
+    and the import time of the modules in seconds
+"""
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+seconds = time.perf_counter() - start
+print(json.dumps({"tensorflow": "tensorflow" in sys.modules, "seconds": seconds}))
+"""
+
+""" Generous bound on the import time of the app without TensorFlow, which alone takes several seconds """
+MAX_IMPORT_SECONDS = 2.0
+
+
+def probe(*modules, code=""):
+    """ Run PROBE then code, which may print more JSON lines, and return the last JSON line printed """
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE + code, *modules], check=True, capture_output=True, text=True
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+class TestLazyTensorflowImport:
+    @pytest.mark.parametrize("module", ["sitetack.app.main", "sitetack.app.cli", "sitetack.app.fasta", "sitetack.app.predict"])
+    def test_import_does_not_load_tensorflow(self, module):
+        result = probe(module)
+        assert not result["tensorflow"]
+        assert result["seconds"] < MAX_IMPORT_SECONDS
+
+    def test_metadata_routes_and_validation_do_not_load_tensorflow(self):
+        code = """
+from starlette.testclient import TestClient
+from sitetack.app.main import app
+client = TestClient(app)
+for route in ["/ptms", "/organisms", "/labels"]:
+    assert client.get(route).status_code == 200
+response = client.post("/submit/", json={"ptm": "PHOSPHORYLATION_ST", "organism": "HUMAN", "label": "NO_LABELS", "text": ">a\\nST*A"})
+assert response.status_code == 422
+print(json.dumps({"tensorflow": "tensorflow" in sys.modules}))
+"""
+        assert not probe("sitetack.app.main", code=code)["tensorflow"]
+
+    def test_cli_help_does_not_load_tensorflow(self):
+        code = """
+from sitetack.app.cli import main
+try:
+    main(["--help"])
+except SystemExit:
+    pass
+print(json.dumps({"tensorflow": "tensorflow" in sys.modules}))
+"""
+        assert not probe("sitetack.app.cli", code=code)["tensorflow"]
@@ -0,0 +1,95 @@
+import time
+import pytest
+from dataclasses import replace
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.jobs import JobManager, JobNotFound, JobState, JobStore
+from sitetack.app.predict import SequencePrediction, SitePrediction
+
+
+def fake_predict(sequences, ptm, organism, label):
+    """ Scores every site of the PTM's amino acids with probability 0.5 """
+    for sequence in sequences:
+        site_predictions = [
+            SitePrediction(i + 1, char, 0.5)
+            for i, char in enumerate(sequence.sequence) if char in ptm.value.amino_acids
+        ]
+        yield SequencePrediction(sequence.sequence_name, sequence.sequence, site_predictions)
+
+
+def failing_predict(sequences, ptm, organism, label):
+    raise RuntimeError("model exploded")
+
+
+class TestJobStore:
+    def test_create_stores_queued_job(self, tmp_path):
+        store = JobStore(tmp_path)
+        status = store.create(">a\nST", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        assert store.status(status.job_id) == status
+        assert status.state == JobState.QUEUED
+        assert store.input_file(status.job_id).read_text() == ">a\nST"
+
+    def test_status_unknown_job_raises(self, tmp_path):
+        with pytest.raises(JobNotFound):
+            JobStore(tmp_path).status("0" * 32)
+
+    def test_status_rejects_paths_outside_the_store(self, tmp_path):
+        with pytest.raises(JobNotFound):
+            JobStore(tmp_path).status("../etc")
+
+    def test_read_results_returns_pages(self, tmp_path):
+        store = JobStore(tmp_path)
+        status = store.create(">a\nST", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        store.results_file(status.job_id).write_text("".join(f'{{"i": {i}}}\n' for i in range(5)))
+        assert store.read_results(status.job_id, offset=1, limit=2) == [{"i": 1}, {"i": 2}]
+        assert store.read_results(status.job_id, offset=4, limit=2) == [{"i": 4}]
+
+    def test_read_results_skips_a_partly_written_last_line(self, tmp_path):
+        store = JobStore(tmp_path)
+        status = store.create(">a\nST", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        store.results_file(status.job_id).write_text('{"i": 0}\n{"i": ')
+        assert store.read_results(status.job_id) == [{"i": 0}]
+
+    def test_remove_expired_deletes_old_finished_jobs(self, tmp_path):
+        store = JobStore(tmp_path)
+        finished = store.create(">a\nST", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        queued = store.create(">a\nST", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        store.write_status(replace(finished, state=JobState.DONE, updated_at=time.time() - 100))
+        store.remove_expired(max_age=10)
+        with pytest.raises(JobNotFound):
+            store.status(finished.job_id)
+        assert store.status(queued.job_id).state == JobState.QUEUED
+
+
+class TestJobManager:
+    def test_submit_runs_job_to_completion(self, tmp_path):
+        manager = JobManager(JobStore(tmp_path), predict=fake_predict)
+        status = manager.submit(">a\nSTM\n>b\nMMS\n", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        manager.shutdown()
+        status = manager.store.status(status.job_id)
+        assert status.state == JobState.DONE
+        assert status.sequences_total == 2
+        assert status.sequences_done == 2
+        assert status.sites_scored == 3
+        results = manager.store.read_results(status.job_id)
+        assert [result["sequence_name"] for result in results] == ["a", "b"]
+        assert results[1]["site_predictions"] == [{"site": 3, "amino_acid": "S", "probability": 0.5}]
+
+    def test_submit_records_failure(self, tmp_path):
+        manager = JobManager(JobStore(tmp_path), predict=failing_predict)
+        status = manager.submit(">a\nST\n", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        manager.shutdown()
+        status = manager.store.status(status.job_id)
+        assert status.state == JobState.FAILED
+        assert status.error == "model exploded"
+
+    def test_start_requeues_queued_jobs_and_fails_running_jobs(self, tmp_path):
+        store = JobStore(tmp_path)
+        queued = store.create(">a\nST\n", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        running = store.create(">a\nST\n", PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        store.write_status(replace(running, state=JobState.RUNNING))
+        manager = JobManager(store, predict=fake_predict)
+        manager.shutdown()
+        assert store.status(queued.job_id).state == JobState.DONE
+        assert store.read_results(queued.job_id)[0]["sequence_name"] == "a"
+        assert store.status(running.job_id).state == JobState.FAILED
+        assert store.status(running.job_id).error == "Interrupted by a restart of the server"
@@ -1,7 +1,15 @@
+import json
 import pytest
+import threading
 from starlette.testclient import TestClient
 
+from sitetack.app.executor import InferenceExecutor
+from sitetack.app.jobs import JobManager, JobStore
+from sitetack.app.predict import SequencePrediction, SitePrediction
 from sitetack.app.main import app
+from sitetack.app.metrics import Metrics
+from sitetack.app.profiling import ProfileStore, Profiler
+from sitetack.app.warmup import Warmup
 
 client = TestClient(app)
 
@@ -69,6 +77,22 @@ class TestMain:
         response = client.post("/submit/", json=invalid_data)
         assert response.status_code == 422
 
+    def test_submit_with_text_invalid_characters_reports_location(self):
+        invalid_data = self.valid_data_one_sequence
+        invalid_data["text"] = ">RNase_3\nSTAA\nST*A\n>RNase_3\nSTAA"
+        response = client.post("/submit/", json=invalid_data)
+        assert response.status_code == 422
+        detail = response.json()["detail"]
+        assert [error["loc"] for error in detail] == [["body", "request", "text"]] * 2
+        assert "line 3, column 3, sequence RNase_3" in detail[0]["msg"]
+        assert detail[1]["msg"].startswith("Duplicate sequence name found: RNase_3")
+
+    def test_submit_streaming_with_text_invalid_characters_returns_422(self):
+        invalid_data = self.valid_data_one_sequence
+        invalid_data["text"] = ">RNase_3\nST*A"
+        response = client.post("/submit/", params={"format": "ndjson"}, json=invalid_data)
+        assert response.status_code == 422
+
     def test_submit_with_invalid_ptm_and_invalid_characters(self):
         invalid_data = self.valid_data_one_sequence
         invalid_data["ptm"] = "INVALID_PTM_KIND"
@@ -111,3 +135,180 @@ class TestMain:
         response = client.post("/submit/", json=invalid_data)
         assert response.status_code == 422
 
+
+    def test_submit_streams_ndjson(self):
+        response = client.post("/submit/", params={"format": "ndjson"}, json=self.valid_data_one_sequence)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = response.text.splitlines()
+        assert len(lines) == 1
+        sequence_prediction = json.loads(lines[0])
+        assert sequence_prediction["sequence_name"] == "mock_sequence_name"
+        assert len(sequence_prediction["site_predictions"]) == 3
+
+    def test_submit_streams_csv(self):
+        response = client.post("/submit/", params={"format": "csv"}, json=self.valid_data_one_sequence)
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0] == "sequence name,site,amino acid,probability"
+        assert len(lines) == 4
+        assert all(line.startswith("mock_sequence_name,") for line in lines[1:])
+
+    def test_submit_with_invalid_format_returns_422(self):
+        response = client.post("/submit/", params={"format": "xml"}, json=self.valid_data_one_sequence)
+        assert response.status_code == 422
+
+    def test_submit_multi_returns_predictions_of_every_model(self):
+        data = {
+            "models": [
+                {"ptm": "PHOSPHORYLATION_ST", "organism": "HUMAN", "label": "NO_LABELS"},
+                {"ptm": "UBIQUITINATION_K", "organism": "HUMAN", "label": "NO_LABELS"},
+            ],
+            "text": ">mock_sequence_name\nSTAASK",
+        }
+        response = client.post("/submit/multi/", json=data)
+        assert response.status_code == 200
+        sequence_predictions = response.json()["sequence_predictions"]
+        assert len(sequence_predictions) == 1
+        model_predictions = sequence_predictions[0]["model_predictions"]
+        assert [model_prediction["ptm"] for model_prediction in model_predictions] == ["PHOSPHORYLATION_ST", "UBIQUITINATION_K"]
+        assert [len(model_prediction["site_predictions"]) for model_prediction in model_predictions] == [3, 1]
+
+    def test_submit_multi_rejects_characters_missing_from_any_alphabet(self):
+        data = {
+            "models": [
+                {"ptm": "PHOSPHORYLATION_ST", "organism": "HUMAN", "label": "WITH_LABELS"},
+                {"ptm": "PHOSPHORYLATION_ST", "organism": "HUMAN", "label": "NO_LABELS"},
+            ],
+            "text": ">mock_sequence_name\nS@TAAS",
+        }
+        response = client.post("/submit/multi/", json=data)
+        assert response.status_code == 422
+        assert "line 2, column 2" in response.json()["detail"][0]["msg"]
+
+    @pytest.mark.parametrize("models", [
+        [],
+        [{"ptm": "INVALID_PTM_KIND", "organism": "HUMAN", "label": "NO_LABELS"}],
+    ])
+    def test_submit_multi_with_invalid_models_returns_422(self, models):
+        response = client.post("/submit/multi/", json={"models": models, "text": ">a\nS"})
+        assert response.status_code == 422
+
+    def test_submit_when_busy_returns_503_with_retry_after(self, monkeypatch):
+        busy_executor = InferenceExecutor(max_workers=1, max_queue=0)
+        release = threading.Event()
+        busy_executor.submit(release.wait)
+        monkeypatch.setattr(InferenceExecutor, "_shared", busy_executor)
+        try:
+            response = client.post("/submit/", json=self.valid_data_one_sequence)
+        finally:
+            release.set()
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) > 0
+
+    def test_submit_job_then_fetch_results(self, monkeypatch, tmp_path):
+        def fake_predict(sequences, ptm, organism, label):
+            for sequence in sequences:
+                yield SequencePrediction(sequence.sequence_name, sequence.sequence, [SitePrediction(1, "S", 0.5)])
+
+        manager = JobManager(JobStore(tmp_path), predict=fake_predict)
+        monkeypatch.setattr(JobManager, "_shared", manager)
+        response = client.post("/jobs/", json=self.valid_data_one_sequence)
+        assert response.status_code == 200
+        job_id = response.json()["job_id"]
+        manager.shutdown()
+
+        status = client.get(f"/jobs/{job_id}").json()
+        assert status["state"] == "done"
+        assert status["sequences_done"] == status["sequences_total"] == 1
+        results = client.get(f"/jobs/{job_id}/results", params={"offset": 0, "limit": 10}).json()
+        assert results["sequence_predictions"][0]["sequence_name"] == "mock_sequence_name"
+        download = client.get(f"/jobs/{job_id}/download")
+        assert download.status_code == 200
+        assert download.text.count("\n") == 1
+
+    def test_health_ready_returns_503_until_warmed_up(self, monkeypatch):
+        class FakeModel:
+            def predict_on_batch(self, tensor):
+                return tensor[:, :1]
+
+        warmup = Warmup(preload="PHOSPHORYLATION_ST:HUMAN:NO_LABELS", batch_size=4, get_model=lambda *key: FakeModel())
+        monkeypatch.setattr(Warmup, "_shared", warmup)
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()["state"] == "pending"
+
+        warmup.run()
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json()["models_ready"] == 1
+
+    def test_metrics_returns_404_when_disabled(self, monkeypatch):
+        monkeypatch.setattr(Metrics, "_shared", Metrics(enabled=False))
+        assert client.get("/metrics").status_code == 404
+
+    def test_metrics_in_text_format(self, monkeypatch):
+        metrics = Metrics(enabled=True)
+        monkeypatch.setattr(Metrics, "_shared", metrics)
+        with metrics.stage("validate"):
+            pass
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'sitetack_stage_seconds_count{stage="validate",model=""} 1' in response.text
+        assert "# TYPE sitetack_model_cache_requests_total counter" in response.text
+        assert "sitetack_inference_in_flight 0" in response.text
+
+    def test_submit_with_profile_header_stores_a_profile(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(Profiler, "_shared", Profiler(ProfileStore(tmp_path)))
+        invalid_data = self.valid_data_one_sequence
+        invalid_data["text"] = ">RNase_3\nST*A"
+        response = client.post("/submit/", json=invalid_data, headers={"X-Sitetack-Profile": "1"})
+        assert response.status_code == 422
+        profile_id = response.headers["X-Sitetack-Profile"]
+        profile = client.get(f"/profiles/{profile_id}").json()
+        assert profile["finished"] and profile["error"].startswith("FastaValidationError")
+        assert profile["models"] == ["PHOSPHORYLATION_ST:HUMAN:NO_LABELS"]
+        assert "profile.pstats" in profile["files"]
+        download = client.get(f"/profiles/{profile_id}/download")
+        assert download.status_code == 200
+        assert download.headers["content-type"] == "application/zip"
+
+    def test_submit_when_busy_finishes_its_profile(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(Profiler, "_shared", Profiler(ProfileStore(tmp_path)))
+        busy_executor = InferenceExecutor(max_workers=1, max_queue=0)
+        release = threading.Event()
+        busy_executor.submit(release.wait)
+        monkeypatch.setattr(InferenceExecutor, "_shared", busy_executor)
+        try:
+            response = client.post("/submit/", json=self.valid_data_one_sequence, headers={"X-Sitetack-Profile": "1"})
+        finally:
+            release.set()
+        assert response.status_code == 503
+        profile = client.get(f"/profiles/{response.headers['X-Sitetack-Profile']}").json()
+        assert profile["finished"] and profile["error"].startswith("ExecutorSaturated")
+
+    def test_submit_is_not_profiled_when_profiling_is_disabled(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(Profiler, "_shared", Profiler(ProfileStore(tmp_path), enabled=False))
+        invalid_data = self.valid_data_one_sequence
+        invalid_data["text"] = ">RNase_3\nST*A"
+        response = client.post("/submit/", params={"profile": "true"}, json=invalid_data)
+        assert response.status_code == 422
+        assert "X-Sitetack-Profile" not in response.headers
+        assert client.get(f"/profiles/{'0' * 32}").status_code == 404
+
+    def test_get_unknown_job_returns_404(self):
+        response = client.get("/jobs/" + "0" * 32)
+        assert response.status_code == 404
+
+    def test_submit_job_with_invalid_input_returns_422(self):
+        invalid_data = self.valid_data_one_sequence
+        invalid_data["ptm"] = "INVALID_PTM_KIND"
+        response = client.post("/jobs/", json=invalid_data)
+        assert response.status_code == 422
+
+    def test_submit_job_with_text_invalid_characters_returns_422(self):
+        invalid_data = self.valid_data_one_sequence
+        invalid_data["text"] = ">RNase_3\nST*A"
+        response = client.post("/jobs/", json=invalid_data)
+        assert response.status_code == 422
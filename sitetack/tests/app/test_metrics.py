@@ -0,0 +1,94 @@
+import pytest
+from sitetack.app.metrics import Counter, Histogram, Metrics, metric_lines
+
+
+class FakeModel:
+    pass
+
+
+class TestHistogram:
+    def test_renders_cumulative_buckets(self):
+        histogram = Histogram("stage_seconds", "Seconds", ("stage",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, "encode")
+        histogram.observe(0.5, "encode")
+        histogram.observe(5.0, "encode")
+        assert histogram.render() == [
+            "# HELP stage_seconds Seconds",
+            "# TYPE stage_seconds histogram",
+            'stage_seconds_bucket{stage="encode",le="0.1"} 1',
+            'stage_seconds_bucket{stage="encode",le="1.0"} 2',
+            'stage_seconds_bucket{stage="encode",le="+Inf"} 3',
+            'stage_seconds_sum{stage="encode"} 5.55',
+            'stage_seconds_count{stage="encode"} 3',
+        ]
+
+    def test_boundary_values_fall_in_their_bucket(self):
+        histogram = Histogram("h", "h", buckets=(1.0,))
+        histogram.observe(1.0)
+        assert 'h_bucket{le="1.0"} 1' in histogram.render()
+
+
+class TestCounter:
+    def test_counts_per_label_values(self):
+        counter = Counter("sites_total", "Sites", ("model",))
+        counter.inc(3, "a")
+        counter.inc(2, "a")
+        counter.inc(1, "b")
+        assert counter.value("a") == 5
+        assert counter.render()[2:] == ['sites_total{model="a"} 5', 'sites_total{model="b"} 1']
+
+
+class TestMetricLines:
+    def test_escapes_label_values(self):
+        lines = metric_lines("g", "gauge", "help", {('a"b\\c\nd',): 1}, ("label",))
+        assert lines[2] == 'g{label="a\\"b\\\\c\\nd"} 1'
+
+    def test_without_labels(self):
+        assert metric_lines("g", "gauge", "help", {(): 2})[2] == "g 2"
+
+
+class TestMetrics:
+    def test_stage_is_timed_by_model_name(self):
+        metrics = Metrics(enabled=True)
+        model = FakeModel()
+        metrics.name_model(model, "PHOSPHORYLATION_ST:HUMAN:NO_LABELS")
+        with metrics.stage("predict", model):
+            pass
+        with metrics.stage("encode"):
+            pass
+        assert metrics.stage_seconds.count("predict", "PHOSPHORYLATION_ST:HUMAN:NO_LABELS") == 1
+        assert metrics.stage_seconds.count("encode", "") == 1
+
+    def test_stage_is_timed_when_it_raises(self):
+        metrics = Metrics(enabled=True)
+        with pytest.raises(ValueError):
+            with metrics.stage("validate"):
+                raise ValueError("invalid")
+        assert metrics.stage_seconds.count("validate", "") == 1
+
+    def test_counts_sequences_as_they_are_consumed(self):
+        metrics = Metrics(enabled=True)
+        first, second = FakeModel(), FakeModel()
+        metrics.name_model(first, "first")
+        metrics.name_model(second, "second")
+        predictions = metrics.count_sequences(iter(["a", "b"]), first, second)
+        assert metrics.sequences.value("first") == 0
+        assert list(predictions) == ["a", "b"]
+        assert metrics.sequences.value("first") == metrics.sequences.value("second") == 2
+
+    def test_unnamed_models_are_unknown(self):
+        metrics = Metrics(enabled=True)
+        metrics.count_sites(FakeModel(), 5)
+        assert metrics.sites.value("unknown") == 5
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics = Metrics(enabled=False)
+        model = FakeModel()
+        predictions = iter(["a"])
+        with metrics.stage("predict", model):
+            pass
+        metrics.count_sites(model, 5)
+        assert metrics.count_sequences(predictions, model) is predictions
+        assert list(metrics.count_sequences(["a", "b"], model)) == ["a", "b"]
+        assert metrics.stage_seconds.count("predict", "unknown") == 0
+        assert metrics.sites.value("unknown") == 0
@@ -1,4 +1,4 @@
-from sitetack.app.model import Model
+from sitetack.app.model import Model, ModelIndex
 from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
 from sitetack.app.alphabet import Alphabet
 from sitetack.app.kmer import Kmer
@@ -6,6 +6,8 @@ from sitetack.app.predict import Predict
 import tensorflow as tf
 from itertools import product
 import pytest
+import json
+import os
 
 
 class TestModel:
@@ -89,3 +91,83 @@ class TestModel:
 
         for probability in probabilities:
             assert 0 <= probability <= 1
+
+
+class TestModelIndex:
+    @classmethod
+    def setup_class(cls):
+        cls.master_file = Model.master_file_path()
+        cls.model_directory = Model.model_directory_path()
+        cls.index = ModelIndex.build(cls.master_file, cls.model_directory)
+
+    @pytest.mark.parametrize(
+        "ptm, organism, label", list(product(PtmKind, OrganismKind, LabelKind))
+    )
+    def test_build_has_every_choice(self, ptm, organism, label):
+        info = self.index.get(ptm, organism, label)
+        assert isinstance(info.alphabet, Alphabet)
+        assert info.h5_file.is_file()
+        assert label.value.filename_query in info.h5_file.name
+
+    def test_build_alphabet_matches_master_file(self):
+        alphabet = self.index.get_alphabet(PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.WITH_LABELS)
+        assert alphabet == Alphabet("ARNDCEQGHILKMFPSTWYV@&-U")
+
+    def test_keys_lists_choices_with_alphabet_and_h5_file(self):
+        assert self.index.keys() == list(product(PtmKind, OrganismKind, LabelKind))
+        key = (PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.WITH_LABELS)
+        other = (PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        index = ModelIndex({key: Alphabet("ST-"), other: Alphabet("ST-")}, {key: self.index.get_h5_file(*key)})
+        assert index.keys() == [key]
+
+    def test_get_alphabet_unknown_choice_raises(self):
+        index = ModelIndex({}, {})
+        with pytest.raises(RuntimeError):
+            index.get_alphabet(PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.WITH_LABELS)
+
+    def test_get_h5_file_unknown_choice_raises(self):
+        index = ModelIndex({}, {})
+        with pytest.raises(FileNotFoundError):
+            index.get_h5_file(PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.WITH_LABELS)
+
+    def test_load_writes_sidecar_file(self, tmp_path):
+        sidecar_file = tmp_path / "model_index.json"
+        ModelIndex.load(self.master_file, self.model_directory, sidecar_file)
+        assert json.loads(sidecar_file.read_text())["version"] == ModelIndex.SIDECAR_VERSION
+
+    def test_load_from_sidecar_file_matches_build(self, tmp_path):
+        sidecar_file = tmp_path / "model_index.json"
+        ModelIndex.load(self.master_file, self.model_directory, sidecar_file)
+        index = ModelIndex.load(self.master_file, self.model_directory, sidecar_file)
+        for ptm, organism, label in product(PtmKind, OrganismKind, LabelKind):
+            assert index.get(ptm, organism, label) == self.index.get(ptm, organism, label)
+
+    def test_load_ignores_stale_sidecar_file(self, tmp_path):
+        sidecar_file = tmp_path / "model_index.json"
+        data = self.index.to_json(self.master_file, self.model_directory)
+        data["master_file"]["mtime_ns"] -= 1
+        data["alphabets"] = []
+        sidecar_file.write_text(json.dumps(data))
+        index = ModelIndex.load(self.master_file, self.model_directory, sidecar_file)
+        assert index.get_alphabet(PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS) is not None
+        assert json.loads(sidecar_file.read_text())["master_file"]["mtime_ns"] == os.stat(self.master_file).st_mtime_ns
+
+    def test_load_rebuilds_when_an_h5_file_is_added(self, tmp_path):
+        model_directory = tmp_path / "models"
+        organism_directory = model_directory / PtmKind.PHOSPHORYLATION_ST.value.directory_name / OrganismKind.HUMAN.value.directory_name
+        organism_directory.mkdir(parents=True)
+        sidecar_file = tmp_path / "model_index.json"
+        index = ModelIndex.load(self.master_file, model_directory, sidecar_file)
+        key = (PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS)
+        assert key not in index.keys()
+
+        h5_file = organism_directory / f"model_{LabelKind.NO_LABELS.value.filename_query}.h5"
+        h5_file.write_bytes(b"weights")
+        index = ModelIndex.load(self.master_file, model_directory, sidecar_file)
+        assert index.get_h5_file(*key) == h5_file
+
+    def test_load_ignores_unreadable_sidecar_file(self, tmp_path):
+        sidecar_file = tmp_path / "model_index.json"
+        sidecar_file.write_text("not json")
+        index = ModelIndex.load(self.master_file, self.model_directory, sidecar_file)
+        assert index.get_alphabet(PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS) is not None
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from pathlib import Path
+from sitetack.app.backends import InferenceBackend, make_loader
+from sitetack.app.numpy_backend import LAYER_BUILDERS, NumpyModel, UnsupportedModel
+from sitetack.app.registry import load_keras_model
+
+
+def save_model(model, path: Path) -> Path:
+    # Random biases, so that a layer ignoring them is caught
+    rng = np.random.default_rng(0)
+    model.set_weights([w + rng.normal(0, 0.1, size=w.shape).astype(np.float32) for w in model.get_weights()])
+    model.save(str(path))
+    return path
+
+
+def make_cnn_model(path: Path) -> Path:
+    """ Save a model with the architecture of the models of sitetack/models """
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(53,)),
+        tf.keras.layers.Embedding(256, 21),
+        tf.keras.layers.Reshape((53, 21, 1)),
+        tf.keras.layers.Conv2D(16, (3, 3), activation="relu"),
+        tf.keras.layers.MaxPooling2D((2, 2)),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(32, activation="relu"),
+        tf.keras.layers.Dropout(0.1),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    return save_model(model, path)
+
+
+def make_conv1d_model(path: Path) -> Path:
+    kmers = tf.keras.Input(shape=(53,))
+    x = tf.keras.layers.Embedding(24, 8)(kmers)
+    x = tf.keras.layers.Conv1D(6, 5, strides=2, padding="same", activation="tanh")(x)
+    x = tf.keras.layers.MaxPooling1D(3, padding="same")(x)
+    x = tf.keras.layers.GlobalMaxPooling1D()(x)
+    probabilities = tf.keras.layers.Dense(1, activation="sigmoid")(x)
+    return save_model(tf.keras.Model(kmers, probabilities), path)
+
+
+def random_kmers(count: int, high: int) -> np.ndarray:
+    return np.random.default_rng(1).integers(0, high, size=(count, 53)).astype(np.uint8)
+
+
+class TestNumpyModel:
+    def test_matches_keras_on_cnn_model(self, tmp_path):
+        h5_file = make_cnn_model(tmp_path / "model.h5")
+        tensor = random_kmers(1500, 24)
+        expected = np.asarray(load_keras_model(h5_file).predict(tensor)).reshape(-1)
+        model = NumpyModel.from_h5(h5_file)
+        np.testing.assert_allclose(model.predict(tensor).reshape(-1), expected, atol=1e-5)
+        np.testing.assert_allclose(model.predict_on_batch(tensor[:7]).reshape(-1), expected[:7], atol=1e-5)
+
+    def test_matches_keras_on_conv1d_model_with_same_padding(self, tmp_path):
+        h5_file = make_conv1d_model(tmp_path / "model.h5")
+        tensor = random_kmers(200, 24)
+        expected = np.asarray(load_keras_model(h5_file).predict(tensor)).reshape(-1)
+        np.testing.assert_allclose(NumpyModel.from_h5(h5_file).predict(tensor).reshape(-1), expected, atol=1e-5)
+
+    def test_returns_float32_probabilities(self, tmp_path):
+        probabilities = NumpyModel.from_h5(make_cnn_model(tmp_path / "model.h5")).predict_on_batch(random_kmers(5, 24))
+        assert probabilities.shape == (5, 1)
+        assert probabilities.dtype == np.float32
+
+    def test_unsupported_layer_raises(self, tmp_path):
+        model = tf.keras.Sequential([
+            tf.keras.Input(shape=(53,)),
+            tf.keras.layers.Embedding(24, 4),
+            tf.keras.layers.LSTM(2),
+            tf.keras.layers.Dense(1, activation="sigmoid"),
+        ])
+        h5_file = tmp_path / "model.h5"
+        model.save(str(h5_file))
+        with pytest.raises(UnsupportedModel):
+            NumpyModel.from_h5(h5_file)
+
+    @pytest.mark.parametrize("layers", [
+        [tf.keras.layers.Conv1D(4, 3, padding="causal")],
+        [tf.keras.layers.Conv1D(4, 3, dilation_rate=2)],
+        [tf.keras.layers.Conv1D(4, 3, data_format="channels_first")],
+        [tf.keras.layers.Reshape((53, 8, 1)), tf.keras.layers.Conv2D(4, 3, dilation_rate=2)],
+        [tf.keras.layers.Reshape((1, 53, 8)), tf.keras.layers.Conv2D(4, 3, data_format="channels_first")],
+        [tf.keras.layers.MaxPooling1D(2, data_format="channels_first")],
+        [tf.keras.layers.Reshape((1, 53, 8)), tf.keras.layers.MaxPooling2D(2, data_format="channels_first")],
+        [tf.keras.layers.GlobalMaxPooling1D(data_format="channels_first")],
+        [tf.keras.layers.GlobalAveragePooling1D(keepdims=True)],
+    ])
+    def test_layer_settings_the_engine_ignores_raise(self, tmp_path, layers):
+        model = tf.keras.Sequential([tf.keras.Input(shape=(53,)), tf.keras.layers.Embedding(24, 8)] + layers)
+        h5_file = tmp_path / "model.h5"
+        model.save(str(h5_file))
+        with pytest.raises(UnsupportedModel):
+            NumpyModel.from_h5(h5_file)
+
+    @pytest.mark.parametrize("builder", [LAYER_BUILDERS["MaxPooling1D"], LAYER_BUILDERS["MaxPooling2D"]])
+    def test_pooling_with_unknown_padding_raises(self, builder):
+        with pytest.raises(UnsupportedModel, match="padding"):
+            builder({"pool_size": 2, "padding": "full"}, [])
+
+    def test_functional_model_that_is_not_a_chain_raises(self, tmp_path):
+        kmers = tf.keras.Input(shape=(53,))
+        direct = tf.keras.layers.Dense(1, activation="sigmoid")(kmers)
+        hidden = tf.keras.layers.Dense(4, activation="relu")(kmers)
+        probabilities = tf.keras.layers.Dense(1, activation="sigmoid")(hidden)
+        h5_file = tmp_path / "model.h5"
+        tf.keras.Model(kmers, [direct, probabilities]).save(str(h5_file))
+        with pytest.raises(UnsupportedModel, match="chains of layers"):
+            NumpyModel.from_h5(h5_file)
+
+
+class TestNumpyLoader:
+    def test_loader_reads_supported_models(self, tmp_path):
+        h5_file = make_cnn_model(tmp_path / "model.h5")
+        loader = make_loader(InferenceBackend.NUMPY, tmp_path, tmp_path, fallback=load_keras_model)
+        assert isinstance(loader(h5_file), NumpyModel)
+
+    def test_loader_falls_back_to_keras_for_unsupported_models(self, tmp_path):
+        h5_file = tmp_path / "model.h5"
+        tf.keras.Sequential([tf.keras.Input(shape=(53,)), tf.keras.layers.Embedding(24, 4), tf.keras.layers.LSTM(2)]).save(str(h5_file))
+        loaded = []
+        make_loader(InferenceBackend.NUMPY, tmp_path, tmp_path, fallback=loaded.append)(h5_file)
+        assert loaded == [h5_file]
@@ -1,12 +1,18 @@
 import importlib.resources
 from sitetack.app.alphabet import Alphabet
+from sitetack.app.encoding import KmerEncoder
 from sitetack.app.kmer import Kmer
-from sitetack.app.predict import Predict, SitePrediction, SequencePrediction, SequencePredictions
+from dataclasses import asdict
+from sitetack.app.predict import Predict, PredictionColumns, SitePrediction, SitePredictions, SequencePrediction, SequencePredictions
 from pathlib import Path
 from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
 from sitetack.app.sequence import Sequence
 from sitetack.app.model import Model
 from sitetack.app.fasta import Fasta
+from sitetack.tests.fakes import SumModel
+import numpy as np
+import pytest
+
 
 class TestPredict:
 
@@ -104,6 +110,126 @@ class TestPredict:
             assert expected_num_sites == actual_num_sites
 
 
+    def test_on_fasta_batched_matches_per_sequence(self):
+        ptm = PtmKind.PHOSPHORYLATION_ST
+        organism = OrganismKind.ALL_ORGANISM
+        label = LabelKind.WITH_LABELS
+        with open(self.two_sequences_path, 'r') as f:
+            text = f.read()
+        per_sequence = Predict.on_fasta(text, ptm, organism, label, batch_size=None)
+        batched = Predict.on_fasta(text, ptm, organism, label, batch_size=7)
+        assert batched == per_sequence
+
+    @pytest.mark.parametrize("batch_size", [1, 5, 16, 1024])
+    def test_iter_predictions_matches_per_sequence(self, batch_size):
+        alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        amino_acids = ["S", "T"]
+        model = SumModel()
+        expected = []
+        for sequence in self.two_sequences_sequences:
+            kmers = [kmer for amino_acid in amino_acids for kmer in sequence.get_kmers(Predict.KMER_LENGTH, amino_acid)]
+            probabilities = Predict._on_kmers_with_model(kmers, alphabet, model)
+            expected.append(SequencePrediction(sequence.sequence_name, sequence.sequence, [
+                SitePrediction(kmer.site, kmer.amino_acid, probability) for kmer, probability in zip(kmers, probabilities)
+            ]))
+        actual = list(Predict.iter_predictions(self.two_sequences_sequences, amino_acids, alphabet, SumModel(), batch_size))
+        assert actual == expected
+
+    def test_iter_predictions_uses_fixed_size_batches(self):
+        alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        model = SumModel()
+        sequences = [Sequence("a", "STSTS"), Sequence("b", "MMM"), Sequence("c", "TTTT")]
+        predictions = list(Predict.iter_predictions(sequences, ["S", "T"], alphabet, model, batch_size=4))
+        assert model.batch_sizes == [4, 4, 1]
+        assert [len(prediction.site_predictions) for prediction in predictions] == [5, 0, 4]
+
+    def test_iter_predictions_yields_sequences_as_their_batches_finish(self):
+        alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        model = SumModel()
+
+        def sequences():
+            yield Sequence("a", "SS")
+            assert model.batch_sizes == [2]
+            yield Sequence("b", "S")
+
+        predictions = Predict.iter_predictions(sequences(), ["S"], alphabet, model, batch_size=2)
+        assert next(predictions).sequence_name == "a"
+        assert next(predictions).sequence_name == "b"
+
+    def test_encode_sequence_matches_tensor_encoding_of_kmers(self):
+        alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        sequence = self.two_sequences_sequences[0]
+        kmers = sequence.get_kmers(Predict.KMER_LENGTH, "S") + sequence.get_kmers(Predict.KMER_LENGTH, "T")
+        sites, tensor = Predict.encode_sequence(sequence, ["S", "T"], alphabet)
+        assert sites.tolist() == [kmer.site for kmer in kmers]
+        assert np.array_equal(tensor, Predict._tensor_encoding(kmers, alphabet))
+
+    def test_iter_predictions_probabilities_are_floats(self):
+        alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        predictions = list(Predict.iter_predictions([Sequence("a", "MSM")], ["S"], alphabet, SumModel()))
+        probability = predictions[0].site_predictions[0].probability
+        assert isinstance(probability, float)
+        assert probability == pytest.approx(np.sum(Predict._tensor_encoding(
+            [Kmer.site_to_kmer("MSM", 2, Predict.KMER_LENGTH)], alphabet)) / 1000.0)
+
+
+    @pytest.mark.parametrize("chunk_residues", [1, 100, 65536])
+    def test_iter_multi_predictions_matches_single_model_predictions(self, chunk_residues):
+        human = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        labels = Alphabet("ARNDCEQGHILKMFPSTWYV@-U")
+        combos = [
+            ((PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS), human),
+            ((PtmKind.UBIQUITINATION_K, OrganismKind.HUMAN, LabelKind.NO_LABELS), human),
+            ((PtmKind.N6_ACETYLATION_K, OrganismKind.HUMAN, LabelKind.NO_LABELS), human),
+            ((PtmKind.N6_ACETYLATION_K, OrganismKind.HUMAN, LabelKind.WITH_LABELS), labels),
+        ]
+        models = [(key, alphabet, SumModel()) for key, alphabet in combos]
+        sequences = self.two_sequences_sequences
+        actual = list(Predict.iter_multi_predictions(sequences, models, batch_size=5, chunk_residues=chunk_residues))
+
+        assert [prediction.sequence_name for prediction in actual] == [sequence.sequence_name for sequence in sequences]
+        for (ptm, organism, label), alphabet, model in models:
+            expected = Predict.iter_predictions(sequences, ptm.value.amino_acids, alphabet, SumModel(), batch_size=5)
+            for multi_prediction, single_prediction in zip(actual, expected):
+                model_prediction = next(
+                    model_prediction for model_prediction in multi_prediction.model_predictions
+                    if (model_prediction.ptm, model_prediction.label) == (ptm.name, label.name)
+                )
+                assert model_prediction.organism == organism.name
+                assert model_prediction.site_predictions == single_prediction.site_predictions
+
+    def test_iter_multi_predictions_shares_kmers_across_models(self, monkeypatch):
+        alphabet = Alphabet("ARNDCEQGHILKMFPSTWYV-U")
+        calls = {"pad": 0, "find_sites": 0}
+        original_pad, original_find_sites = KmerEncoder.pad, KmerEncoder.find_sites
+
+        def counting_pad(*args):
+            calls["pad"] += 1
+            return original_pad(*args)
+
+        def counting_find_sites(*args):
+            calls["find_sites"] += 1
+            return original_find_sites(*args)
+
+        monkeypatch.setattr(KmerEncoder, "pad", staticmethod(counting_pad))
+        monkeypatch.setattr(KmerEncoder, "find_sites", staticmethod(counting_find_sites))
+        k_ptms = [PtmKind.UBIQUITINATION_K, PtmKind.SUMOYLATION_K, PtmKind.N6_ACETYLATION_K]
+        models = [((ptm, OrganismKind.HUMAN, LabelKind.NO_LABELS), alphabet, SumModel()) for ptm in k_ptms]
+        predictions = list(Predict.iter_multi_predictions([Sequence("a", "MKK"), Sequence("b", "K")], models))
+        assert calls == {"pad": 2, "find_sites": 2}
+        assert [len(prediction.model_predictions) for prediction in predictions] == [3, 3]
+
+    def test_on_fasta_multi_returns_predictions_of_every_model(self):
+        with open(self.two_sequences_path, 'r') as f:
+            text = f.read()
+        model_keys = [
+            (PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS),
+            (PtmKind.UBIQUITINATION_K, OrganismKind.HUMAN, LabelKind.NO_LABELS),
+        ]
+        predictions = Predict.on_fasta_multi(text, model_keys).sequence_predictions
+        assert len(predictions) == 2
+        assert [model_prediction.ptm for model_prediction in predictions[0].model_predictions] == ["PHOSPHORYLATION_ST", "UBIQUITINATION_K"]
+
 
 class TestSequencePredictions:
     def test_to_dict(self):
@@ -131,4 +257,68 @@ class TestSequencePredictions:
             ]
         }
         
-        assert sequence_predictions.to_dict() == expected_to_dict
\ No newline at end of file
+        assert sequence_predictions.to_dict() == expected_to_dict
+
+    def test_to_dict_of_columns_matches_asdict(self):
+        predictions = [
+            SequencePrediction("first", "MSKT", [SitePrediction(2, "S", 0.123456), SitePrediction(4, "T", 0.9)]),
+            SequencePrediction("no sites", "MAAA", []),
+        ]
+        columns = SequencePredictions(PredictionColumns.from_predictions(predictions))
+        assert columns.to_dict() == asdict(SequencePredictions(predictions))
+
+
+class TestSitePredictions:
+    def test_of_sequence_pairs_sites_with_their_amino_acids(self):
+        probabilities = np.array([0.25, 0.5], dtype=np.float32)
+        site_predictions = SitePredictions.of_sequence("MSKT", np.array([2, 4]), probabilities)
+        assert site_predictions == [SitePrediction(2, "S", 0.25), SitePrediction(4, "T", 0.5)]
+        assert site_predictions[-1] == SitePrediction(4, "T", 0.5)
+        assert site_predictions[1:] == [SitePrediction(4, "T", 0.5)]
+        assert isinstance(site_predictions[0].site, int) and isinstance(site_predictions[0].probability, float)
+
+    def test_keeps_float32_probabilities_exact(self):
+        probabilities = np.array([0.1, 0.7], dtype=np.float32)
+        site_predictions = SitePredictions.of_sequence("ST", np.array([1, 2]), probabilities.tolist())
+        assert [site.probability for site in site_predictions] == probabilities.tolist()
+
+    def test_from_list_keeps_probabilities_unchanged(self):
+        sites = [SitePrediction(1, "S", 0.123456789), SitePrediction(3, "T", 0.5)]
+        site_predictions = SitePredictions.from_list(sites)
+        assert list(site_predictions) == sites
+        assert site_predictions.to_dicts() == [asdict(site) for site in sites]
+
+    def test_lengths_must_match(self):
+        with pytest.raises(ValueError):
+            SitePredictions(np.array([1]), np.array([], dtype=np.uint8), np.array([0.5]))
+
+
+class TestPredictionColumns:
+    def predictions(self):
+        return [
+            SequencePrediction("first", "MSKT", [SitePrediction(2, "S", 0.25), SitePrediction(4, "T", 0.5)]),
+            SequencePrediction("no sites", "MAAA", []),
+            SequencePrediction("last", "S", [SitePrediction(1, "S", 0.75)]),
+        ]
+
+    def test_views_match_the_predictions(self):
+        columns = PredictionColumns.from_predictions(self.predictions())
+        assert len(columns) == 3
+        assert columns == self.predictions()
+        assert columns[-1] == self.predictions()[-1]
+        assert columns[1:] == self.predictions()[1:]
+        assert columns.site_counts().tolist() == [2, 0, 1]
+
+    def test_views_share_the_arrays(self):
+        columns = PredictionColumns.from_predictions(self.predictions())
+        site_predictions = columns[0].site_predictions
+        assert isinstance(site_predictions, SitePredictions)
+        assert np.shares_memory(site_predictions.probabilities, columns.site_predictions.probabilities)
+
+    def test_index_out_of_range_raises(self):
+        with pytest.raises(IndexError):
+            PredictionColumns.from_predictions(self.predictions())[3]
+
+    def test_empty(self):
+        columns = PredictionColumns.from_predictions([])
+        assert len(columns) == 0 and columns == []
@@ -0,0 +1,90 @@
+import io
+import pstats
+import sys
+import zipfile
+import pytest
+from types import SimpleNamespace
+from sitetack.app.profiling import ProfileNotFound, ProfileStore, Profiler
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    # Only traced with the TensorFlow profiler when a test installs a fake tensorflow
+    monkeypatch.delitem(sys.modules, "tensorflow", raising=False)
+    return Profiler(ProfileStore(tmp_path), enabled=True)
+
+
+def score(count: int) -> int:
+    return sum(range(count))
+
+
+def fake_tensorflow(calls: list) -> SimpleNamespace:
+    experimental = SimpleNamespace(start=lambda logdir: calls.append(("start", logdir)), stop=lambda: calls.append(("stop",)))
+    return SimpleNamespace(profiler=SimpleNamespace(experimental=experimental))
+
+
+class TestProfileStore:
+    def test_ids_cannot_escape_the_store(self, tmp_path):
+        with pytest.raises(ProfileNotFound):
+            ProfileStore(tmp_path).info("../etc")
+
+    def test_unknown_profile_is_not_found(self, tmp_path):
+        with pytest.raises(ProfileNotFound):
+            ProfileStore(tmp_path).archive("0" * 32)
+
+    def test_keeps_the_newest_profiles(self, tmp_path, monkeypatch):
+        store = ProfileStore(tmp_path)
+        monkeypatch.setattr(ProfileStore, "MAX_PROFILES", 2)
+        infos = [store.create("/submit/", []) for _ in range(3)]
+        with pytest.raises(ProfileNotFound):
+            store.info(infos[0].profile_id)
+        assert [store.info(info.profile_id) for info in infos[1:]] == infos[1:]
+
+
+class TestProfiler:
+    def test_disabled_profiler_does_not_start(self, tmp_path):
+        profiler = Profiler(ProfileStore(tmp_path), enabled=False)
+        assert profiler.start("/submit/", []) is None
+        assert list(tmp_path.iterdir()) == []
+
+    def test_call_saves_the_profile(self, profiler):
+        info = profiler.start("/submit/", ["PHOSPHORYLATION_ST:HUMAN:NO_LABELS"])
+        assert profiler.call(info, score, 1000) == sum(range(1000))
+        saved = profiler.store.info(info.profile_id)
+        assert saved.finished and saved.python_profile and not saved.tensorflow_trace
+        assert saved.error is None
+        assert saved.models == ["PHOSPHORYLATION_ST:HUMAN:NO_LABELS"]
+        assert profiler.store.files(info.profile_id) == ["info.json", "profile.pstats", "summary.txt"]
+        listing = io.StringIO()
+        pstats.Stats(str(profiler.store.profile_directory(info.profile_id) / "profile.pstats"), stream=listing).print_stats()
+        assert "(score)" in listing.getvalue()
+
+    def test_call_records_the_error(self, profiler):
+        info = profiler.start("/submit/", [])
+        with pytest.raises(ValueError):
+            profiler.call(info, int, "x")
+        assert profiler.store.info(info.profile_id).error.startswith("ValueError")
+
+    def test_iterate_saves_the_profile_when_closed_early(self, profiler):
+        info = profiler.start("/submit/", [])
+        items = profiler.iterate(info, range, 10)
+        assert next(items) == 0
+        assert not profiler.store.info(info.profile_id).finished
+        items.close()
+        saved = profiler.store.info(info.profile_id)
+        assert saved.finished and saved.error is None
+
+    def test_traces_tensorflow_when_it_is_loaded(self, profiler, monkeypatch):
+        calls = []
+        monkeypatch.setitem(sys.modules, "tensorflow", fake_tensorflow(calls))
+        info = profiler.start("/submit/", [])
+        profiler.call(info, score, 10)
+        assert calls == [("start", str(profiler.store.profile_directory(info.profile_id) / "tensorflow")), ("stop",)]
+        assert profiler.store.info(info.profile_id).tensorflow_trace
+
+    def test_archive_holds_every_file(self, profiler):
+        info = profiler.start("/submit/", [])
+        profiler.call(info, score, 10)
+        with zipfile.ZipFile(io.BytesIO(profiler.store.archive(info.profile_id))) as archive:
+            names = archive.namelist()
+        assert sorted(names) == [f"{info.profile_id}/{name}" for name in ["info.json", "profile.pstats", "summary.txt"]]
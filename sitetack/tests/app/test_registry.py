@@ -0,0 +1,115 @@
+import pytest
+from pathlib import Path
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.model import Model
+from sitetack.app.registry import ModelRegistry
+
+
+class CountingLoader:
+    """ Stands in for load_model, counting how many times each file is loaded """
+
+    def __init__(self):
+        self.loaded = []
+
+    def __call__(self, h5_file: Path):
+        self.loaded.append(h5_file)
+        return object()
+
+
+class TestModelRegistry:
+    @staticmethod
+    def make_files(directory: Path, count: int, size: int = 10):
+        files = []
+        for i in range(count):
+            h5_file = directory / f"model_{i}.h5"
+            h5_file.write_bytes(b"x" * size)
+            files.append(h5_file)
+        return files
+
+    def test_get_file_loads_each_file_once(self, tmp_path):
+        loader = CountingLoader()
+        registry = ModelRegistry(loader=loader)
+        (h5_file,) = self.make_files(tmp_path, 1)
+        first = registry.get_file(h5_file)
+        second = registry.get_file(h5_file)
+        assert first is second
+        assert len(loader.loaded) == 1
+
+    def test_get_loads_the_h5_file_of_the_choices(self):
+        loader = CountingLoader()
+        registry = ModelRegistry(loader=loader)
+        ptm = PtmKind.PHOSPHORYLATION_ST
+        organism = OrganismKind.HUMAN
+        label = LabelKind.NO_LABELS
+        registry.get(ptm, organism, label)
+        registry.get(ptm, organism, label)
+        assert loader.loaded == [Model.get_h5_file(ptm, organism, label).resolve()]
+        assert (ptm, organism, label) in registry
+
+    def test_get_and_get_file_share_the_model_of_a_file(self):
+        loader = CountingLoader()
+        registry = ModelRegistry(loader=loader)
+        ptm, organism, label = PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS
+        model = registry.get(ptm, organism, label)
+        assert registry.get_file(Model.get_h5_file(ptm, organism, label)) is model
+        assert len(loader.loaded) == 1
+        assert registry.stats().resident_models == 1
+
+    def test_failed_load_is_retried(self, tmp_path):
+        calls = []
+
+        def failing_loader(h5_file: Path):
+            calls.append(h5_file)
+            if len(calls) == 1:
+                raise OSError("unreadable")
+            return object()
+
+        registry = ModelRegistry(loader=failing_loader)
+        (h5_file,) = self.make_files(tmp_path, 1)
+        with pytest.raises(OSError):
+            registry.get_file(h5_file)
+        assert registry._load_locks == {}
+        registry.get_file(h5_file)
+        assert len(calls) == 2
+
+    def test_stats_counts_hits_and_misses(self, tmp_path):
+        registry = ModelRegistry(loader=CountingLoader())
+        h5_file_1, h5_file_2 = self.make_files(tmp_path, 2)
+        registry.get_file(h5_file_1)
+        registry.get_file(h5_file_1)
+        registry.get_file(h5_file_2)
+        stats = registry.stats()
+        assert stats.hits == 1
+        assert stats.misses == 2
+        assert stats.resident_models == 2
+        assert stats.load_seconds >= 0
+
+    def test_max_models_evicts_least_recently_used(self, tmp_path):
+        loader = CountingLoader()
+        registry = ModelRegistry(max_models=2, loader=loader)
+        h5_file_1, h5_file_2, h5_file_3 = self.make_files(tmp_path, 3)
+        registry.get_file(h5_file_1)
+        registry.get_file(h5_file_2)
+        registry.get_file(h5_file_1)  # h5_file_2 is now the least recently used
+        registry.get_file(h5_file_3)
+        assert h5_file_1.resolve() in registry
+        assert h5_file_2.resolve() not in registry
+        assert h5_file_3.resolve() in registry
+        assert registry.stats().evictions == 1
+
+    def test_max_bytes_evicts_until_within_budget(self, tmp_path):
+        registry = ModelRegistry(max_bytes=25, loader=CountingLoader())
+        for h5_file in self.make_files(tmp_path, 3, size=10):
+            registry.get_file(h5_file)
+        stats = registry.stats()
+        assert stats.resident_models == 2
+        assert stats.resident_bytes == 20
+
+    def test_max_bytes_keeps_a_model_larger_than_the_budget(self, tmp_path):
+        registry = ModelRegistry(max_bytes=5, loader=CountingLoader())
+        (h5_file,) = self.make_files(tmp_path, 1, size=10)
+        registry.get_file(h5_file)
+        assert len(registry) == 1
+
+    def test_shared_returns_the_same_registry(self):
+        assert ModelRegistry.shared() is ModelRegistry.shared()
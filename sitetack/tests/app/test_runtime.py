@@ -0,0 +1,88 @@
+import pytest
+from types import SimpleNamespace
+from sitetack.app import runtime
+from sitetack.app.runtime import apply_cpu_affinity, configure_tensorflow, parse_cpu_list
+from sitetack.app.settings import Settings
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """ Reset what the runtime applied, and return a setter of the settings it reads """
+    monkeypatch.setattr(runtime, "_affinity_applied", False)
+    monkeypatch.setattr(runtime, "_tensorflow_configured", False)
+
+    def set_settings(**values):
+        monkeypatch.setattr(runtime, "get_settings", lambda: Settings(**values))
+
+    return set_settings
+
+
+class FakeThreading:
+    def __init__(self, initialized: bool = False):
+        self.initialized = initialized
+        self.intra = None
+        self.inter = None
+
+    def set_intra_op_parallelism_threads(self, threads: int):
+        if self.initialized:
+            raise RuntimeError("Intra op parallelism cannot be modified after initialization.")
+        self.intra = threads
+
+    def set_inter_op_parallelism_threads(self, threads: int):
+        self.inter = threads
+
+
+def fake_tensorflow(initialized: bool = False) -> SimpleNamespace:
+    return SimpleNamespace(config=SimpleNamespace(threading=FakeThreading(initialized)))
+
+
+class TestParseCpuList:
+    def test_parses_cpus_and_ranges(self):
+        assert parse_cpu_list("0-3, 8,10-11") == {0, 1, 2, 3, 8, 10, 11}
+
+    def test_blank_is_empty(self):
+        assert parse_cpu_list(" ") == set()
+
+    @pytest.mark.parametrize("value", ["a", "3-1", "-1", "1-2-3"])
+    def test_invalid_entries_raise(self, value):
+        with pytest.raises(ValueError):
+            parse_cpu_list(value)
+
+
+class TestConfigureTensorflow:
+    def test_sets_thread_pools_once(self, settings):
+        settings(tf_intra_op_threads=2, tf_inter_op_threads=1)
+        tf = fake_tensorflow()
+        configure_tensorflow(tf)
+        assert (tf.config.threading.intra, tf.config.threading.inter) == (2, 1)
+        other = fake_tensorflow()
+        configure_tensorflow(other)
+        assert other.config.threading.intra is None
+
+    def test_defaults_leave_tensorflow_unchanged(self, settings):
+        settings()
+        tf = fake_tensorflow()
+        configure_tensorflow(tf)
+        assert (tf.config.threading.intra, tf.config.threading.inter) == (None, None)
+
+    def test_initialized_tensorflow_is_a_warning(self, settings, caplog):
+        settings(tf_intra_op_threads=2)
+        configure_tensorflow(fake_tensorflow(initialized=True))
+        assert "thread settings are unchanged" in caplog.text
+
+
+class TestApplyCpuAffinity:
+    def test_pins_process_once(self, settings, monkeypatch):
+        settings(cpu_affinity="0")
+        calls = []
+        monkeypatch.setattr(runtime.os, "sched_setaffinity", lambda pid, cpus: calls.append((pid, cpus)), raising=False)
+        apply_cpu_affinity()
+        apply_cpu_affinity()
+        assert calls == [(0, {0})]
+
+    def test_blank_affinity_is_not_applied(self, settings, monkeypatch):
+        settings()
+        calls = []
+        monkeypatch.setattr(runtime.os, "sched_setaffinity", lambda pid, cpus: calls.append(cpus), raising=False)
+        apply_cpu_affinity()
+        assert calls == []
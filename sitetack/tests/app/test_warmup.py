@@ -0,0 +1,79 @@
+import pytest
+from sitetack.app.alphabet import Alphabet
+from sitetack.app.enums import PtmKind, OrganismKind, LabelKind
+from sitetack.app.model import ModelIndex
+from sitetack.app.warmup import Warmup, WarmupState, parse_model_keys
+from pathlib import Path
+
+
+AVAILABLE = [
+    (PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.NO_LABELS),
+    (PtmKind.PHOSPHORYLATION_ST, OrganismKind.HUMAN, LabelKind.WITH_LABELS),
+    (PtmKind.PHOSPHORYLATION_ST, OrganismKind.ALL_ORGANISM, LabelKind.NO_LABELS),
+    (PtmKind.UBIQUITINATION_K, OrganismKind.HUMAN, LabelKind.NO_LABELS),
+]
+
+
+class RecordingModel:
+    """ Stands in for a Keras model, recording the shapes of the batches it scores """
+
+    def __init__(self):
+        self.shapes = []
+
+    def predict_on_batch(self, tensor):
+        self.shapes.append(tensor.shape)
+        return tensor[:, :1]
+
+
+def make_index():
+    alphabet = Alphabet("ARNDCEQGHILKMFPSTWYVXZ-U")
+    return ModelIndex({key: alphabet for key in AVAILABLE}, {key: Path("model.h5") for key in AVAILABLE})
+
+
+class TestParseModelKeys:
+    def test_blank_selects_no_model(self):
+        assert parse_model_keys(" ", AVAILABLE) == []
+
+    def test_all_selects_every_model(self):
+        assert parse_model_keys("all", AVAILABLE) == AVAILABLE
+
+    def test_missing_organism_and_label_match_any(self):
+        selected = parse_model_keys("UBIQUITINATION_K, PHOSPHORYLATION_ST:HUMAN", AVAILABLE)
+        assert selected == [AVAILABLE[0], AVAILABLE[1], AVAILABLE[3]]
+
+    def test_full_entry_selects_one_model(self):
+        assert parse_model_keys("PHOSPHORYLATION_ST:ALL_ORGANISM:NO_LABELS", AVAILABLE) == [AVAILABLE[2]]
+
+    @pytest.mark.parametrize("value", ["PHOSPHORYLATION", "PHOSPHORYLATION_ST:MARS", "SUMOYLATION_K", "A:B:C:D"])
+    def test_invalid_entries_raise_value_error(self, value):
+        with pytest.raises(ValueError):
+            parse_model_keys(value, AVAILABLE)
+
+
+class TestWarmup:
+    def test_run_loads_and_scores_each_selected_model(self):
+        models = {}
+
+        def get_model(ptm, organism, label):
+            return models.setdefault((ptm, organism, label), RecordingModel())
+
+        warmup = Warmup(preload="PHOSPHORYLATION_ST:HUMAN", batch_size=8, get_model=get_model, index=make_index)
+        assert warmup.status().state == WarmupState.PENDING
+        warmup.start()
+        warmup.join(timeout=10)
+        status = warmup.status()
+        assert warmup.ready
+        assert (status.models_total, status.models_ready) == (2, 2)
+        assert list(models) == AVAILABLE[:2]
+        assert all(model.shapes == [(8, 53)] for model in models.values())
+
+    def test_run_reports_failure(self):
+        def get_model(ptm, organism, label):
+            raise OSError("corrupt h5 file")
+
+        warmup = Warmup(preload="all", get_model=get_model, index=make_index)
+        warmup.run()
+        status = warmup.status()
+        assert status.state == WarmupState.FAILED
+        assert status.error == "corrupt h5 file"
+        assert not warmup.ready
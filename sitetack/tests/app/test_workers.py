@@ -0,0 +1,93 @@
+import functools
+import numpy as np
+import pytest
+import tensorflow as tf
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sitetack.app.backends import InferenceBackend, load_numpy_model, loaded_backend
+from sitetack.app.registry import ModelRegistry, load_keras_model
+from sitetack.app.workers import WorkerModel, WorkerPool
+
+# Loads the models in the worker processes with the NumPy engine, which starts without TensorFlow
+LOADER = functools.partial(load_numpy_model, fallback=load_keras_model)
+
+
+def make_h5_model(path: Path, seed: int) -> Path:
+    tf.keras.utils.set_random_seed(seed)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(53,)),
+        tf.keras.layers.Embedding(24, 4),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    model.save(str(path))
+    return path
+
+
+@pytest.fixture(scope="module")
+def h5_files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("workers")
+    return [make_h5_model(directory / f"model_{seed}.h5", seed) for seed in range(3)]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = WorkerPool(processes=2, loader=LOADER)
+    yield pool
+    pool.shutdown()
+
+
+def random_kmers(count: int) -> np.ndarray:
+    return np.random.default_rng(0).integers(0, 24, size=(count, 53)).astype(np.uint8)
+
+
+class TestWorkerPool:
+    def test_processes_must_be_positive(self):
+        with pytest.raises(ValueError):
+            WorkerPool(processes=0)
+
+    def test_models_are_spread_over_processes(self, pool, h5_files):
+        owners = [pool.owner(str(h5_file)) for h5_file in h5_files]
+        assert sorted(owners[:2]) == [0, 1]
+        assert pool.owner(str(h5_files[0])) == owners[0]
+
+    def test_worker_model_matches_model_in_process(self, pool, h5_files):
+        tensor = random_kmers(1500)
+        for h5_file in h5_files:
+            expected = LOADER(h5_file).predict(tensor).reshape(-1)
+            model = pool.model(h5_file)
+            np.testing.assert_allclose(model.predict(tensor).reshape(-1), expected, atol=1e-6)
+            np.testing.assert_allclose(model.predict_on_batch(tensor[:9]).reshape(-1), expected[:9], atol=1e-6)
+
+    def test_worker_model_reports_backend_loaded_in_process(self, pool, h5_files):
+        assert loaded_backend(pool.model(h5_files[0])) == (InferenceBackend.NUMPY, False)
+
+    def test_concurrent_batches(self, pool, h5_files):
+        tensor = random_kmers(64)
+        expected = {str(h5_file): LOADER(h5_file).predict_on_batch(tensor) for h5_file in h5_files}
+        models = [pool.model(h5_file) for h5_file in h5_files] * 4
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda model: model.predict_on_batch(tensor), models))
+        for model, result in zip(models, results):
+            np.testing.assert_allclose(result, expected[model.h5_file], atol=1e-6)
+
+    def test_stats_count_batches_per_process(self, h5_files):
+        pool = WorkerPool(processes=2, loader=LOADER)
+        try:
+            pool.model(h5_files[0]).predict_on_batch(random_kmers(10))
+            stats = pool.stats()
+        finally:
+            pool.shutdown()
+        assert stats.processes == 2
+        assert stats.models == [1, 0]
+        assert stats.batches == [1, 0]
+        assert stats.kmers == [10, 0]
+        assert stats.restarts == 0
+
+
+class TestRegistryWithWorkers:
+    def test_registry_returns_worker_models(self, pool, h5_files):
+        registry = ModelRegistry(loader=pool.model)
+        model = registry.get_file(h5_files[0])
+        assert isinstance(model, WorkerModel)
+        assert registry.get_file(h5_files[0]) is model
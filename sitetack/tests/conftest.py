@@ -0,0 +1,18 @@
+import pytest
+from sitetack.app.model import Model
+from sitetack.app.settings import get_settings
+
+
+@pytest.fixture(autouse=True, scope="session")
+def cache_dir(tmp_path_factory):
+    """ Keep the model index sidecar and other caches of the tests, including those of the
+        interpreters they start, out of the user's cache directory
+    """
+    directory = tmp_path_factory.mktemp("cache")
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setenv("SITETACK_CACHE_DIR", str(directory))
+    monkeypatch.setattr(Model, "_index", None)
+    get_settings.cache_clear()
+    yield directory
+    monkeypatch.undo()
+    get_settings.cache_clear()